@@ -5,15 +5,41 @@
 
 from google import genai
 from google.genai import types
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import HTTPException
 import os
 import pathlib
 import json
+import contextvars
+import hashlib
+import heapq
+import math
+import random
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+import typing
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from datetime import datetime
+import numpy as np
+import pandas as pd
+from datetime import date, datetime, timedelta
+import metricas
+import historial
 # No importamos bcrypt ni nada de autenticación aquí
 
+# pypdf es opcional: solo se usa para extraer el texto de los PDFs en local
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+    print("Advertencia: pypdf no está instalado. El prefiltrado local de CVs estará desactivado.")
+
 # Asegúrate de que esta clave API es válida para Google GenAI
 # Se recomienda usar variables de entorno para las claves sensibles
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_2_KEY")
@@ -31,11 +57,182 @@ except Exception as e:
     print("La funcionalidad de procesamiento de CVs NO funcionará sin una clave de API válida.")
     client = None # Establecer cliente a None si falla la inicialización
 
+class PeticionCV(Request):
+    """
+    Petición de Flask que guarda los archivos subidos en un búfer temporal en
+    memoria (SpooledTemporaryFile) en lugar del volcado a disco por defecto.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UMBRAL_VOLCADO_SUBIDAS_BYTES, mode="rb+", dir=DIRECTORIO_VOLCADO_SUBIDAS)
+
+    @property
+    def max_content_length(self):
+        # Solo se limitan las subidas de CVs. Los lotes envían todos los CVs en una sola
+        # petición: el cuerpo se limita con MAX_TAMANO_LOTE_MB y cada archivo se comprueba
+        # aparte (ver leer_peticion_lote)
+        if self.endpoint in ENDPOINTS_MASIVOS:
+            return MAX_TAMANO_LOTE_MB * 1024 * 1024
+        if self.endpoint in ENDPOINTS_SUBIDA_CV:
+            return MAX_TAMANO_PETICION_MB * 1024 * 1024
+        return super().max_content_length
+
+
 app = Flask(__name__)
+app.request_class = PeticionCV
+
+# Métricas para Prometheus (/metrics): peticiones por ruta y duración de cada etapa del análisis
+registro_metricas = metricas.RegistroMetricas()
+metricas.instrumentar_app(app, registro_metricas)
+duracion_etapas = registro_metricas.histograma(
+    "cvisualizer_etapa_duracion_segundos", "Duración de cada etapa del análisis de CVs.", ("etapa",)
+)
 
 # --- Rutas y Archivos ---
-# Archivo para guardar el historial de EJECUCIONES DE ANÁLISIS AI
-RUTA_HISTORIAL = "./historial_ejecuciones.json"
+# Archivo para guardar el historial de EJECUCIONES DE ANÁLISIS AI (una ejecución por línea)
+RUTA_HISTORIAL = os.environ.get("CVISUALIZER_RUTA_HISTORIAL", "./historial_ejecuciones.jsonl")
+# Historial en el formato anterior (un único array JSON); se migra una vez al arrancar
+RUTA_HISTORIAL_ANTIGUO = "./historial_ejecuciones.json"
+# Cada cuántas ejecuciones añadidas se compacta el archivo del historial
+HISTORIAL_COMPACTAR_CADA = int(os.environ.get("CVISUALIZER_HISTORIAL_COMPACTAR_CADA", "100"))
+# Almacén del historial: "jsonl" (archivo de solo añadido) o "sqlite" (tablas indexadas)
+ALMACEN_HISTORIAL = os.environ.get("CVISUALIZER_ALMACEN_HISTORIAL", "jsonl").strip().lower()
+RUTA_HISTORIAL_SQLITE = os.environ.get("CVISUALIZER_RUTA_HISTORIAL_SQLITE", "./historial_ejecuciones.db")
+# Ejecuciones por página en /historial_ejecuciones si no se indica `limit`, y máximo permitido
+HISTORIAL_PAGINA_POR_DEFECTO = int(os.environ.get("CVISUALIZER_HISTORIAL_PAGINA", "50"))
+HISTORIAL_PAGINA_MAXIMA = 500
+# Carpeta para la caché en disco de resultados de análisis (una entrada JSON por clave)
+RUTA_CACHE_RESULTADOS = os.environ.get("CVISUALIZER_RUTA_CACHE", "./cache_resultados")
+# Carpeta donde se guardan los registros de los trabajos asíncronos (/jobs)
+RUTA_TRABAJOS = os.environ.get("CVISUALIZER_RUTA_TRABAJOS", "./trabajos")
+
+# --- Configuración del modelo y de la caché ---
+MODELO_GEMINI = "gemini-1.5-flash"
+# Motor que responde a los análisis: "gemini" (API real) o "simulado" (local, para pruebas de carga)
+MOTOR_LLM = os.environ.get("CVISUALIZER_MOTOR_LLM", "gemini").lower()
+# Parámetros del motor simulado
+# Latencia: "fija:<s>", "uniforme:<min>:<max>" o "lognormal:<mediana>:<sigma>"
+SIMULADO_LATENCIA = os.environ.get("CVISUALIZER_SIMULADO_LATENCIA", "lognormal:2.0:0.5")
+SIMULADO_TASA_FALLOS = float(os.environ.get("CVISUALIZER_SIMULADO_TASA_FALLOS", "0.0"))
+SIMULADO_SEMILLA = os.environ.get("CVISUALIZER_SIMULADO_SEMILLA")
+CACHE_MAX_ENTRADAS = int(os.environ.get("CVISUALIZER_CACHE_MAX_ENTRADAS", "5000"))
+CACHE_MAX_BYTES = int(os.environ.get("CVISUALIZER_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+CACHE_TTL_SEGUNDOS = int(os.environ.get("CVISUALIZER_CACHE_TTL_SEGUNDOS", str(7 * 24 * 3600)))
+# Precios en USD por millón de tokens, para estimar el coste de cada análisis.
+# Se pueden sobrescribir o ampliar con CVISUALIZER_PRECIOS_MODELOS (JSON con la misma forma)
+PRECIOS_MODELOS = {
+    "gemini-1.5-flash": {"entrada": 0.075, "salida": 0.30, "cacheado": 0.01875},
+    "simulado": {"entrada": 0.0, "salida": 0.0, "cacheado": 0.0},
+}
+PRECIOS_MODELOS.update(json.loads(os.environ.get("CVISUALIZER_PRECIOS_MODELOS", "{}")))
+
+# --- Configuración de la puntuación ---
+# El modelo devuelve una subpuntuación (0-10) por criterio, independiente de los pesos;
+# la puntuación final y la aptitud se calculan en local con los pesos y este umbral
+UMBRAL_APTO = float(os.environ.get("CVISUALIZER_UMBRAL_APTO", "5"))
+
+# --- Configuración del procesamiento por lotes ---
+# Número máximo de llamadas simultáneas a Gemini dentro de un lote (/procesar_lote)
+LOTE_MAX_CONCURRENCIA = int(os.environ.get("CVISUALIZER_LOTE_MAX_CONCURRENCIA", "8"))
+
+# --- Configuración de los micro-lotes ---
+# Si se activa, los análisis simultáneos con el mismo puesto y filtros se
+# agrupan durante una ventana corta y se envían al modelo en una única petición
+MICROLOTES_ACTIVADOS = os.environ.get("CVISUALIZER_MICROLOTES", "0") == "1"
+MICROLOTES_VENTANA_MS = int(os.environ.get("CVISUALIZER_MICROLOTES_VENTANA_MS", "250"))
+MICROLOTES_MAX_DOCUMENTOS = int(os.environ.get("CVISUALIZER_MICROLOTES_MAX_DOCUMENTOS", "4"))
+
+# --- Configuración del prefiltrado local ---
+# Extrae el texto del PDF en local y descarta sin llamar al modelo los CVs que
+# incumplen claramente los filtros (palabras clave, idioma, años de experiencia)
+PREFILTRO_ACTIVADO = os.environ.get("CVISUALIZER_PREFILTRO", "1") == "1"
+PREFILTRO_PROCESOS = int(os.environ.get("CVISUALIZER_PREFILTRO_PROCESOS", "2"))
+PREFILTRO_TIMEOUT_SEGUNDOS = float(os.environ.get("CVISUALIZER_PREFILTRO_TIMEOUT_SEGUNDOS", "10"))
+# Por debajo de estos caracteres se considera que el PDF no tiene capa de texto fiable
+PREFILTRO_MIN_CARACTERES = int(os.environ.get("CVISUALIZER_PREFILTRO_MIN_CARACTERES", "200"))
+CACHE_TEXTOS_MAX_ENTRADAS = int(os.environ.get("CVISUALIZER_CACHE_TEXTOS_MAX_ENTRADAS", "1000"))
+
+# --- Configuración del envío como texto ---
+# Si se activa, los PDFs con capa de texto se envían al modelo como texto extraído
+# (sin fuentes ni imágenes incrustadas); los escaneados se siguen enviando en bytes
+ENVIO_TEXTO_ACTIVADO = os.environ.get("CVISUALIZER_ENVIO_TEXTO", "0") == "1"
+ENVIO_TEXTO_MIN_CARACTERES_PAGINA = int(os.environ.get("CVISUALIZER_ENVIO_TEXTO_MIN_CARACTERES_PAGINA", "200"))
+
+# --- Configuración del aligerado de PDFs ---
+# Antes de enviar un PDF pesado al modelo se recomprimen sus imágenes, se eliminan
+# los objetos duplicados o sin usar y, opcionalmente, se conservan solo las N primeras páginas
+ALIGERADO_ACTIVADO = os.environ.get("CVISUALIZER_ALIGERAR_PDF", "1") == "1"
+ALIGERADO_UMBRAL_BYTES = int(os.environ.get("CVISUALIZER_ALIGERAR_UMBRAL_BYTES", str(1024 * 1024)))
+ALIGERADO_MAX_PAGINAS = int(os.environ.get("CVISUALIZER_ALIGERAR_MAX_PAGINAS", "0")) # 0 = sin límite
+ALIGERADO_MAX_LADO_IMAGEN = int(os.environ.get("CVISUALIZER_ALIGERAR_MAX_LADO_IMAGEN", "1600")) # píxeles
+ALIGERADO_CALIDAD_JPEG = int(os.environ.get("CVISUALIZER_ALIGERAR_CALIDAD_JPEG", "75"))
+ALIGERADO_TIMEOUT_SEGUNDOS = float(os.environ.get("CVISUALIZER_ALIGERAR_TIMEOUT_SEGUNDOS", "20"))
+
+# --- Configuración del limitador de llamadas a Gemini ---
+# Cuotas de la API (peticiones y tokens por minuto) compartidas por todos los hilos
+GEMINI_RPM = int(os.environ.get("CVISUALIZER_GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.environ.get("CVISUALIZER_GEMINI_TPM", "1000000"))
+# Límites de la concurrencia adaptativa (AIMD)
+GEMINI_CONCURRENCIA_INICIAL = int(os.environ.get("CVISUALIZER_GEMINI_CONCURRENCIA_INICIAL", "4"))
+GEMINI_CONCURRENCIA_MAX = int(os.environ.get("CVISUALIZER_GEMINI_CONCURRENCIA_MAX", "16"))
+# Reintentos con espera exponencial y jitter ante errores de cuota o disponibilidad
+GEMINI_MAX_REINTENTOS = int(os.environ.get("CVISUALIZER_GEMINI_MAX_REINTENTOS", "4"))
+GEMINI_ESPERA_BASE_SEGUNDOS = float(os.environ.get("CVISUALIZER_GEMINI_ESPERA_BASE_SEGUNDOS", "1.0"))
+GEMINI_ESPERA_MAX_SEGUNDOS = float(os.environ.get("CVISUALIZER_GEMINI_ESPERA_MAX_SEGUNDOS", "30.0"))
+
+# --- Configuración del cortocircuito de Gemini ---
+# Si en la ventana de las últimas llamadas la tasa de errores o de llamadas lentas
+# supera el umbral, el circuito se abre y las peticiones fallan al momento (503)
+# hasta que, pasada la espera, unas pocas llamadas de prueba confirman que el modelo responde
+CIRCUITO_VENTANA = int(os.environ.get("CVISUALIZER_CIRCUITO_VENTANA", "20"))
+CIRCUITO_MIN_LLAMADAS = int(os.environ.get("CVISUALIZER_CIRCUITO_MIN_LLAMADAS", "10"))
+CIRCUITO_TASA_ERRORES = float(os.environ.get("CVISUALIZER_CIRCUITO_TASA_ERRORES", "0.5"))
+CIRCUITO_LATENCIA_LENTA_SEGUNDOS = float(os.environ.get("CVISUALIZER_CIRCUITO_LATENCIA_LENTA_SEGUNDOS", "30"))
+CIRCUITO_TASA_LENTAS = float(os.environ.get("CVISUALIZER_CIRCUITO_TASA_LENTAS", "0.8"))
+CIRCUITO_ESPERA_SEGUNDOS = float(os.environ.get("CVISUALIZER_CIRCUITO_ESPERA_SEGUNDOS", "30"))
+CIRCUITO_SONDAS = int(os.environ.get("CVISUALIZER_CIRCUITO_SONDAS", "1")) # Llamadas de prueba simultáneas en semiabierto
+
+# --- Configuración de plazos y llamadas de cobertura ---
+# Plazo máximo de cada llamada al modelo (0 = sin plazo). Con la cobertura activada,
+# si una llamada no ha respondido en el percentil indicado de las latencias recientes
+# se lanza un duplicado y se usa la primera respuesta; el presupuesto limita la
+# fracción de llamadas que pueden duplicarse
+LLAMADA_PLAZO_SEGUNDOS = float(os.environ.get("CVISUALIZER_LLAMADA_PLAZO_SEGUNDOS", "120"))
+COBERTURA_ACTIVADA = os.environ.get("CVISUALIZER_COBERTURA", "0") == "1"
+COBERTURA_PERCENTIL = float(os.environ.get("CVISUALIZER_COBERTURA_PERCENTIL", "95"))
+COBERTURA_PRESUPUESTO = float(os.environ.get("CVISUALIZER_COBERTURA_PRESUPUESTO", "0.1"))
+COBERTURA_MIN_MUESTRAS = int(os.environ.get("CVISUALIZER_COBERTURA_MIN_MUESTRAS", "20"))
+COBERTURA_VENTANA = int(os.environ.get("CVISUALIZER_COBERTURA_VENTANA", "200")) # Latencias recientes consideradas
+
+# --- Configuración de las clases de prioridad ---
+# Los análisis interactivos (un CV) y los masivos (lotes) esperan turno para llamar
+# al modelo en una cola de reparto justo ponderado: con ambas clases en espera, la
+# masiva recibe al menos peso_masiva / (peso_interactiva + peso_masiva) de las llamadas
+PRIORIDAD_INTERACTIVA = "interactiva"
+PRIORIDAD_MASIVA = "masiva"
+PESOS_PRIORIDAD = {
+    PRIORIDAD_INTERACTIVA: float(os.environ.get("CVISUALIZER_PESO_PRIORIDAD_INTERACTIVA", "4")),
+    PRIORIDAD_MASIVA: float(os.environ.get("CVISUALIZER_PESO_PRIORIDAD_MASIVA", "1")),
+}
+
+# --- Configuración de los trabajos asíncronos ---
+TRABAJOS_MAX_WORKERS = int(os.environ.get("CVISUALIZER_TRABAJOS_MAX_WORKERS", "4"))
+# Los trabajos terminados se borran del almacén pasado este tiempo
+TRABAJOS_TTL_SEGUNDOS = int(os.environ.get("CVISUALIZER_TRABAJOS_TTL_SEGUNDOS", str(24 * 3600)))
+
+# --- Configuración de la recepción de archivos ---
+# Tamaño máximo de una petición de un solo CV y de cada CV de un lote (se rechaza
+# con 413 antes de leer el cuerpo; en los lotes, solo ese CV se marca como error)
+MAX_TAMANO_PETICION_MB = int(os.environ.get("CVISUALIZER_MAX_TAMANO_PETICION_MB", "32"))
+# Tamaño máximo del cuerpo completo de una petición de lote (/procesar_lote y /procesar_lote/eventos)
+MAX_TAMANO_LOTE_MB = int(os.environ.get("CVISUALIZER_MAX_TAMANO_LOTE_MB", "512"))
+# Los archivos subidos se mantienen en memoria hasta este tamaño; por encima se vuelcan a disco
+UMBRAL_VOLCADO_SUBIDAS_BYTES = int(os.environ.get("CVISUALIZER_UMBRAL_VOLCADO_SUBIDAS_BYTES", str(8 * 1024 * 1024)))
+# Carpeta del volcado: /dev/shm (tmpfs, en memoria) si existe, o la temporal del sistema
+DIRECTORIO_VOLCADO_SUBIDAS = os.environ.get("CVISUALIZER_DIRECTORIO_VOLCADO_SUBIDAS", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+# Endpoints que reciben un único CV (los lotes están en ENDPOINTS_MASIVOS); el resto,
+# como el guardado del historial, no tiene límite de tamaño
+ENDPOINTS_SUBIDA_CV = {"procesar_pdf_route", "procesar_pdf_multipuesto_route", "crear_trabajo_route"}
 
 # --- Modelos Pydantic ---
 # Modelo para validar y estructurar la salida esperada de Gemini
@@ -53,6 +250,23 @@ class Resultado(BaseModel):
     porcentaje_habilidades: Optional[float] = None
     porcentaje_idiomas: Optional[float] = None
     porcentaje_otros: Optional[float] = None
+    # Subpuntuaciones (0-10) por criterio, sin ponderar: permiten recalcular la puntuación con otros pesos
+    subpuntuacion_experiencia: Optional[float] = None
+    subpuntuacion_educacion: Optional[float] = None
+    subpuntuacion_habilidades: Optional[float] = None
+    subpuntuacion_idiomas: Optional[float] = None
+    subpuntuacion_otros: Optional[float] = None
+    cumpleFiltros: Optional[bool] = None
+
+
+# Resultado de una evaluación multipuesto: mismo contenido más el puesto evaluado
+class ResultadoPuesto(Resultado):
+    puesto: str
+
+
+# Resultado dentro de una petición con varios CVs: indica a qué documento corresponde (1..N)
+class ResultadoDocumento(Resultado):
+    indice_documento: int
 
 
 # --- Funciones Auxiliares ---
@@ -83,173 +297,1848 @@ def pasarStringaJson(text):
 
 
 # --- Funciones para manejar el historial de Análisis AI ---
+# El almacén se elige con ALMACEN_HISTORIAL (ver historial.py): "jsonl" es un archivo
+# de solo añadido en el que guardar una ejecución escribe solo sus bytes, con el índice
+# de resúmenes en memoria mientras su archivo no cambie; "sqlite" guarda ejecuciones y
+# candidatos en tablas indexadas. En ambos, el resumen y la búsqueda por timestamp no
+# recorren todo el historial.
+
+def crear_almacen_historial():
+    """Crea el almacén del historial configurado en ALMACEN_HISTORIAL."""
+    # Las ejecuciones guardadas antes de contabilizar el uso lo calculan una vez, al indexarlas
+    if ALMACEN_HISTORIAL == "sqlite":
+        # La primera vez se importa el historial en archivo que hubiera (.jsonl o el .json antiguo)
+        ruta_importar = RUTA_HISTORIAL if os.path.exists(RUTA_HISTORIAL) else RUTA_HISTORIAL_ANTIGUO
+        return historial.HistorialSQLite(RUTA_HISTORIAL_SQLITE, ruta_importar=ruta_importar, completar_uso=resumir_uso)
+    if ALMACEN_HISTORIAL != "jsonl":
+        print(f"Advertencia: Almacén de historial desconocido '{ALMACEN_HISTORIAL}'. Se usa 'jsonl'.")
+    return historial.HistorialJSONL(RUTA_HISTORIAL, RUTA_HISTORIAL_ANTIGUO, HISTORIAL_COMPACTAR_CADA, completar_uso=resumir_uso)
+
+
+def obtener_ejecucion(timestamp):
+    """Devuelve la ejecución del historial con ese timestamp, o None."""
+    return almacen_historial.obtener(timestamp)
+
+
+def obtener_resumen_ejecucion(timestamp):
+    """Devuelve el resumen (agregados) de la ejecución con ese timestamp, o None."""
+    return almacen_historial.obtener_resumen(timestamp)
 
-def cargar_historial():
-    """Carga el historial de ejecuciones de análisis desde el archivo JSON."""
-    if not os.path.exists(RUTA_HISTORIAL):
-        return [] # Si el archivo no existe, retorna una lista vacía
-    try:
-        with open(RUTA_HISTORIAL, 'r', encoding='utf-8') as f:
-            historial = json.load(f)
-            # Asegurarse de que es una lista
-            return historial if isinstance(historial, list) else []
-    except json.JSONDecodeError:
-        print(f"Advertencia: El archivo de historial '{RUTA_HISTORIAL}' está vacío o corrupto. Iniciando con historial vacío.")
-        return []
-    except Exception as e:
-        print(f"Error al cargar el historial: {e}")
-        return []
 
-def guardar_historial(historial):
-    """Guarda el historial de ejecuciones de análisis en el archivo JSON."""
+def leer_consulta_historial(args):
+    """
+    Interpreta los parámetros de /historial_ejecuciones y devuelve los argumentos de
+    la página pedida. Lanza ValueError con un mensaje para el cliente si alguno no es válido.
+    """
+    try:
+        limite = int(args.get('limit', HISTORIAL_PAGINA_POR_DEFECTO))
+    except ValueError:
+        raise ValueError("'limit' debe ser un número entero")
+    if not 1 <= limite <= HISTORIAL_PAGINA_MAXIMA:
+        raise ValueError(f"'limit' debe estar entre 1 y {HISTORIAL_PAGINA_MAXIMA}")
+
+    consulta = {"limite": limite, "cursor": args.get('cursor') or None, "puesto": (args.get('puesto') or '').strip() or None}
+    # Rango de fechas (AAAA-MM-DD) con ambos extremos incluidos; el timestamp ISO se
+    # compara como texto, así que 'hasta' pasa a ser el comienzo del día siguiente
+    for parametro, dias in (('desde', 0), ('hasta', 1)):
+        valor = args.get(parametro)
+        if not valor:
+            consulta[parametro] = None
+            continue
+        try:
+            consulta[parametro] = (date.fromisoformat(valor) + timedelta(days=dias)).isoformat()
+        except ValueError:
+            raise ValueError(f"'{parametro}' debe ser una fecha AAAA-MM-DD")
+    min_candidatos = args.get('min_candidatos')
     try:
-        # Asegurarse de que lo que se guarda es una lista
-        if not isinstance(historial, list):
-             print(f"Advertencia: Intentando guardar un historial que no es una lista. No se guardará.")
-             return
+        consulta["min_candidatos"] = int(min_candidatos) if min_candidatos else None
+    except ValueError:
+        raise ValueError("'min_candidatos' debe ser un número entero")
+    if consulta["cursor"]:
+        # Valida el cursor antes de consultar (cada almacén desempata con su propio tipo de id)
+        historial.decodificar_cursor(consulta["cursor"], almacen_historial.TIPO_DESEMPATE)
+    return consulta
 
-        with open(RUTA_HISTORIAL, 'w', encoding='utf-8') as f:
-            json.dump(historial, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error al guardar el historial: {e}")
 
-# --- Función de procesamiento AI (MODIFICADA para aceptar pesos) ---
-def process_pdf_ai(
-    filepath_name,
-    nombre_puesto,
-    filtro_idioma=None,
-    filtro_experiencia_min=None,
-    filtro_palabras_clave=None,
-    filtro_nivel_educativo=None,
-    filtro_sector=None,
-    # NUEVO: Pesos recibidos del frontend
-    peso_experiencia=40,
-    peso_educacion=30,
-    peso_habilidades=20,
-    peso_idiomas=5,
-    peso_otros=5
-):
+@duracion_etapas.medir(etapa="escritura_historial")
+def anadir_al_historial(ejecucion):
+    """Guarda una ejecución nueva en el historial."""
+    almacen_historial.anadir(ejecucion)
+
+
+# --- Caché de resultados de análisis AI ---
+# La clave depende del contenido del PDF (SHA-256) y de toda la configuración que
+# influye en la respuesta del modelo, así que reenviar el mismo CV con el mismo
+# puesto y filtros (aunque cambien los pesos) no vuelve a llamar a Gemini.
+
+def clave_cache_resultado(pdf_bytes, nombre_puesto, filtros, modelo):
     """
-    Procesa un PDF usando Google Gemini con filtros y pesos de evaluación personalizables.
-    Devuelve el resultado estructurado o None en caso de error.
+    Calcula la clave de caché para un PDF y una configuración de análisis. Los pesos
+    no forman parte de la clave: la respuesta del modelo no depende de ellos.
+    """
+    configuracion = {
+        "puesto": nombre_puesto,
+        "filtros": filtros,
+        "modelo": modelo,
+    }
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(pdf_bytes).digest())
+    h.update(json.dumps(configuracion, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+class CacheResultados:
+    """Caché LRU en disco con caducidad (TTL) y límites de entradas y de tamaño."""
+
+    def __init__(self, ruta, max_entradas, max_bytes, ttl_segundos):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self._lock = threading.Lock()
+        # clave -> tamaño en bytes, ordenado de menos a más recientemente usado
+        self._indice = OrderedDict()
+        self._bytes_totales = 0
+        self._cargar_indice()
+
+    def _ruta_entrada(self, clave):
+        return os.path.join(self.ruta, f"{clave}.json")
+
+    def _cargar_indice(self):
+        """Reconstruye el índice LRU a partir de los archivos existentes (orden por mtime)."""
+        try:
+            os.makedirs(self.ruta, exist_ok=True)
+            entradas = []
+            for nombre in os.listdir(self.ruta):
+                if not nombre.endswith(".json"):
+                    continue
+                stat = os.stat(os.path.join(self.ruta, nombre))
+                entradas.append((stat.st_mtime, nombre[:-len(".json")], stat.st_size))
+            for _, clave, tamano in sorted(entradas):
+                self._indice[clave] = tamano
+                self._bytes_totales += tamano
+            self._expulsar_sobrantes()
+        except Exception as e:
+            print(f"Advertencia: No se pudo cargar el índice de la caché de resultados: {e}")
+
+    def _eliminar(self, clave):
+        tamano = self._indice.pop(clave, 0)
+        self._bytes_totales -= tamano
+        try:
+            os.remove(self._ruta_entrada(clave))
+        except OSError:
+            pass
+
+    def _expulsar_sobrantes(self):
+        while self._indice and (len(self._indice) > self.max_entradas or self._bytes_totales > self.max_bytes):
+            clave_antigua = next(iter(self._indice))
+            self._eliminar(clave_antigua)
+            self.expulsiones += 1
+
+    def obtener(self, clave):
+        """Devuelve el resultado cacheado o None si no existe o ha caducado."""
+        with self._lock:
+            if clave not in self._indice:
+                self.fallos += 1
+                return None
+            try:
+                with open(self._ruta_entrada(clave), 'r', encoding='utf-8') as f:
+                    entrada = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Advertencia: Entrada de caché ilegible {clave}: {e}")
+                self._eliminar(clave)
+                self.fallos += 1
+                return None
+
+            if time.time() - entrada.get("creado", 0) > self.ttl_segundos:
+                self._eliminar(clave)
+                self.fallos += 1
+                return None
+
+            # Marcar como usada recientemente (en memoria y en disco para sobrevivir reinicios)
+            self._indice.move_to_end(clave)
+            try:
+                os.utime(self._ruta_entrada(clave))
+            except OSError:
+                pass
+            self.aciertos += 1
+            return entrada.get("resultado")
+
+    def guardar(self, clave, resultado):
+        """Guarda un resultado en la caché, expulsando las entradas menos usadas si es necesario."""
+        contenido = json.dumps({"creado": time.time(), "resultado": resultado}, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            try:
+                ruta_tmp = self._ruta_entrada(clave) + ".tmp"
+                with open(ruta_tmp, 'wb') as f:
+                    f.write(contenido)
+                os.replace(ruta_tmp, self._ruta_entrada(clave))
+            except OSError as e:
+                print(f"Advertencia: No se pudo escribir en la caché de resultados: {e}")
+                return
+            self._bytes_totales -= self._indice.pop(clave, 0)
+            self._indice[clave] = len(contenido)
+            self._bytes_totales += len(contenido)
+            self._expulsar_sobrantes()
+
+    def estadisticas(self):
+        """Devuelve los contadores de la caché."""
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos / total) if total else 0.0,
+                "expulsiones": self.expulsiones,
+                "entradas": len(self._indice),
+                "bytes": self._bytes_totales,
+                "max_entradas": self.max_entradas,
+                "max_bytes": self.max_bytes,
+                "ttl_segundos": self.ttl_segundos,
+            }
+
+
+cache_resultados = CacheResultados(RUTA_CACHE_RESULTADOS, CACHE_MAX_ENTRADAS, CACHE_MAX_BYTES, CACHE_TTL_SEGUNDOS)
+
+# --- Motores de modelo (LLM) ---
+# process_pdf_ai no habla directamente con Gemini sino con un "motor" que recibe
+# los documentos (bytes de PDF) y el prompt y devuelve el JSON del Resultado.
+# Así se puede sustituir la API real por un motor local y determinista para
+# hacer pruebas de carga del servicio completo sin gastar cuota ni red.
+
+class RespuestaModelo:
+    """Respuesta de un motor: texto JSON generado, uso de tokens (si se conoce) y latencia."""
+
+    def __init__(self, texto, modelo, tokens_entrada=None, tokens_salida=None, tokens_cacheados=None):
+        self.texto = texto
+        self.modelo = modelo
+        self.tokens_entrada = tokens_entrada
+        self.tokens_salida = tokens_salida
+        self.tokens_cacheados = tokens_cacheados
+        self.latencia_segundos = None # La rellena el limitador al completar la llamada
+
+    @property
+    def total_tokens(self):
+        if self.tokens_entrada is None and self.tokens_salida is None:
+            return None
+        return (self.tokens_entrada or 0) + (self.tokens_salida or 0)
+
+
+class MotorLLM:
+    """Interfaz común de los motores de análisis."""
+
+    modelo = None
+
+    def generar(self, documentos, prompt, esquema, num_resultados=None):
+        """
+        Analiza `documentos` (lista de bytes de PDF o de textos ya extraídos) con `prompt` y devuelve una
+        RespuestaModelo cuyo texto es JSON conforme a `esquema` (un modelo
+        Pydantic o una lista de ellos; en ese caso `num_resultados` indica cuántos).
+        """
+        raise NotImplementedError
+
+
+class MotorGemini(MotorLLM):
+    """Motor que llama a la API de Google Gemini."""
+
+    def __init__(self, cliente, modelo):
+        self.cliente = cliente
+        self.modelo = modelo
+
+    def generar(self, documentos, prompt, esquema, num_resultados=None):
+        partes = [
+            types.Part.from_text(text=f"--- Currículum (texto extraído del PDF) ---\n{documento}")
+            if isinstance(documento, str)
+            else types.Part.from_bytes(data=documento, mime_type='application/pdf')
+            for documento in documentos
+        ]
+        # Usando response_mime_type y response_schema, Gemini debería devolver JSON directo
+        config = {'response_mime_type': 'application/json',
+                  'response_schema': esquema}
+        if LLAMADA_PLAZO_SEGUNDOS > 0:
+            # Que la conexión HTTP también se corte al vencer el plazo (en milisegundos)
+            config['http_options'] = types.HttpOptions(timeout=int(LLAMADA_PLAZO_SEGUNDOS * 1000))
+        response = self.cliente.models.generate_content(
+            model=self.modelo,
+            contents=partes + [prompt],
+            config=config
+        )
+        uso = getattr(response, 'usage_metadata', None)
+        return RespuestaModelo(
+            response.text,
+            self.modelo,
+            tokens_entrada=getattr(uso, 'prompt_token_count', None),
+            tokens_salida=getattr(uso, 'candidates_token_count', None),
+            tokens_cacheados=getattr(uso, 'cached_content_token_count', None),
+        )
+
+
+class ErrorMotorSimulado(Exception):
+    """Fallo inyectado por el motor simulado (se comporta como un 503 de la API)."""
+    code = 503
+
+
+class MotorSimulado(MotorLLM):
     """
+    Motor local para pruebas de carga: responde con datos deterministas (derivados
+    del hash de los documentos y del prompt), con una latencia aleatoria según la
+    distribución configurada y con una tasa de fallos configurable.
+    """
+
+    modelo = "simulado"
+
+    def __init__(self, latencia, tasa_fallos=0.0, semilla=None):
+        self.distribucion, self.parametros = self._parsear_latencia(latencia)
+        self.tasa_fallos = tasa_fallos
+        # La latencia y los fallos usan su propio generador; la salida depende solo del contenido
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parsear_latencia(especificacion):
+        nombre, *valores = especificacion.split(":")
+        parametros = [float(v) for v in valores]
+        esperados = {"fija": 1, "uniforme": 2, "lognormal": 2}
+        if nombre not in esperados or len(parametros) != esperados[nombre]:
+            raise ValueError(f"Distribución de latencia no válida: '{especificacion}'")
+        return nombre, parametros
+
+    def _muestrear_latencia(self):
+        with self._lock:
+            if self.distribucion == "fija":
+                return self.parametros[0]
+            if self.distribucion == "uniforme":
+                return self._aleatorio.uniform(*self.parametros)
+            mediana, sigma = self.parametros
+            return self._aleatorio.lognormvariate(math.log(mediana), sigma)
+
+    def _valor_campo(self, nombre, anotacion, rng, indice):
+        """Genera un valor plausible para un campo del esquema según su tipo."""
+        if typing.get_origin(anotacion) is typing.Union: # Optional[X]
+            anotacion = next(a for a in typing.get_args(anotacion) if a is not type(None))
+        if typing.get_origin(anotacion) is list:
+            return [f"{nombre} simulado {indice}-{i}" for i in range(rng.randint(1, 3))]
+        if anotacion is bool:
+            return rng.random() < 0.5
+        if anotacion is int:
+            return rng.randint(0, 10)
+        if anotacion is float:
+            return round(rng.uniform(0, 10), 1)
+        return f"{nombre.capitalize()} simulado {indice}"
+
+    def _generar_objeto(self, modelo_pydantic, rng, indice):
+        objeto = {
+            nombre: self._valor_campo(nombre, campo.annotation, rng, indice)
+            for nombre, campo in modelo_pydantic.model_fields.items()
+        }
+        if "indice_documento" in objeto:
+            objeto["indice_documento"] = indice + 1
+        if "cumpleFiltros" in objeto:
+            objeto["cumpleFiltros"] = rng.random() < 0.9
+        # Mantener la coherencia entre puntuación, aptitud y textos explicativos
+        if "puntuacionPuesto" in objeto and "apto" in objeto:
+            objeto["apto"] = objeto["puntuacionPuesto"] >= 5
+            if "resumenCandidato" in objeto:
+                objeto["resumenCandidato"] = objeto["resumenCandidato"] if objeto["apto"] else None
+            if "razonesNoAptitud" in objeto:
+                objeto["razonesNoAptitud"] = None if objeto["apto"] else objeto["razonesNoAptitud"]
+        return objeto
+
+    def generar(self, documentos, prompt, esquema, num_resultados=None):
+        time.sleep(self._muestrear_latencia())
+        with self._lock:
+            falla = self._aleatorio.random() < self.tasa_fallos
+        if falla:
+            raise ErrorMotorSimulado("503 UNAVAILABLE (fallo simulado)")
+
+        huella = hashlib.sha256()
+        for documento in documentos:
+            huella.update(hashlib.sha256(documento.encode('utf-8') if isinstance(documento, str) else documento).digest())
+        huella.update(prompt.encode('utf-8'))
+        rng = random.Random(huella.hexdigest())
+
+        if typing.get_origin(esquema) is list:
+            modelo_item = typing.get_args(esquema)[0]
+            cantidad = num_resultados if num_resultados is not None else len(documentos)
+            salida = [self._generar_objeto(modelo_item, rng, i) for i in range(cantidad)]
+        else:
+            salida = self._generar_objeto(esquema, rng, 0)
+        texto = json.dumps(salida, ensure_ascii=False)
+        return RespuestaModelo(
+            texto,
+            self.modelo,
+            tokens_entrada=estimar_tokens_entrada(prompt, documentos),
+            tokens_salida=len(texto) // 4,
+            tokens_cacheados=0,
+        )
+
+
+def crear_motor_llm():
+    """Crea el motor configurado en CVISUALIZER_MOTOR_LLM (None si no está disponible)."""
+    if MOTOR_LLM == "simulado":
+        print(f"Usando el motor LLM simulado (latencia {SIMULADO_LATENCIA}, tasa de fallos {SIMULADO_TASA_FALLOS}).")
+        return MotorSimulado(SIMULADO_LATENCIA, SIMULADO_TASA_FALLOS, SIMULADO_SEMILLA)
+    if MOTOR_LLM != "gemini":
+        print(f"Advertencia: Motor LLM desconocido '{MOTOR_LLM}'. Se usará Gemini.")
     if client is None:
-        print("Error: Cliente de Google GenAI no inicializado. La API no está disponible.")
         return None
+    return MotorGemini(client, MODELO_GEMINI)
+
+
+# --- Limitador de llamadas a Gemini ---
+# Todas las llamadas al modelo pasan por un único limitador compartido que:
+#  1. respeta las cuotas de peticiones y tokens por minuto (cubos de tokens),
+#  2. adapta la concurrencia con AIMD (sube poco a poco, se reduce a la mitad
+#     cuando la API responde 429/503),
+#  3. reintenta los errores de cuota/disponibilidad con espera exponencial y jitter,
+#  4. reparte los huecos entre los análisis interactivos y los masivos (ver PESOS_PRIORIDAD).
+
+class CuboTokens:
+    """Cubo de tokens que se rellena de forma continua hasta `capacidad_por_minuto`."""
+
+    def __init__(self, capacidad_por_minuto):
+        self.capacidad = float(capacidad_por_minuto)
+        self.ritmo = self.capacidad / 60.0 # Tokens repuestos por segundo
+        self.disponibles = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.disponibles = min(self.capacidad, self.disponibles + (ahora - self._ultimo) * self.ritmo)
+        self._ultimo = ahora
+
+    def adquirir(self, cantidad):
+        """Bloquea hasta poder consumir `cantidad` tokens."""
+        # Una petición mayor que la capacidad nunca cabría: se limita a la capacidad
+        cantidad = min(float(cantidad), self.capacidad)
+        while True:
+            with self._lock:
+                self._rellenar()
+                if self.disponibles >= cantidad:
+                    self.disponibles -= cantidad
+                    return
+                espera = (cantidad - self.disponibles) / self.ritmo
+            time.sleep(espera)
+
+    def intentar_adquirir(self, cantidad):
+        """Como adquirir, pero sin esperar: devuelve False si ahora no hay tokens suficientes."""
+        cantidad = min(float(cantidad), self.capacidad)
+        with self._lock:
+            self._rellenar()
+            if self.disponibles >= cantidad:
+                self.disponibles -= cantidad
+                return True
+            return False
+
+    def ajustar(self, diferencia):
+        """Corrige el consumo cuando el uso real difiere de lo estimado (puede quedar en negativo)."""
+        with self._lock:
+            self._rellenar()
+            self.disponibles = min(self.capacidad, self.disponibles - diferencia)
+
+
+espera_cola_modelo = registro_metricas.histograma(
+    "cvisualizer_espera_cola_modelo_segundos", "Tiempo de espera por un hueco de llamada al modelo, por clase de prioridad.", ("clase",)
+)
+
+# Clase de prioridad del análisis en curso. La fija cada petición HTTP y se
+# traslada explícitamente (con en_prioridad) a las tareas de los pools de hilos
+prioridad_actual = contextvars.ContextVar("prioridad_actual", default=PRIORIDAD_INTERACTIVA)
+
+
+def en_prioridad(prioridad, funcion, *args):
+    """Ejecuta `funcion(*args)` con la clase de prioridad indicada (para tareas en otros hilos)."""
+    contexto = contextvars.copy_context()
+    contexto.run(prioridad_actual.set, prioridad)
+    return contexto.run(funcion, *args)
+
+
+class ConcurrenciaAIMD:
+    """
+    Límite de llamadas simultáneas con aumento aditivo y reducción multiplicativa.
+    Los huecos se reparten entre las clases de prioridad con una cola de reparto
+    justo ponderado (WFQ): cada espera recibe una etiqueta de tiempo virtual que
+    avanza 1/peso por llamada de su clase, y se atiende siempre la menor.
+    """
 
-    file = pathlib.Path(filepath_name)
-    pdf_bytes = file.read_bytes()
+    def __init__(self, inicial, minimo, maximo, pesos=None):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.pesos = pesos or {PRIORIDAD_INTERACTIVA: 1.0}
+        self.en_curso = 0
+        self._ultima_reduccion = 0.0
+        self._cola = [] # Montículo de turnos (etiqueta, secuencia, clase)
+        self._secuencia = 0
+        self._tiempo_virtual = 0.0
+        self._ultima_etiqueta = {clase: 0.0 for clase in self.pesos}
+        self._condicion = threading.Condition()
+
+    def adquirir(self, clase=None):
+        if clase not in self.pesos:
+            clase = next(iter(self.pesos))
+        llegada = time.monotonic()
+        with self._condicion:
+            etiqueta = max(self._tiempo_virtual, self._ultima_etiqueta[clase]) + 1.0 / self.pesos[clase]
+            self._ultima_etiqueta[clase] = etiqueta
+            self._secuencia += 1
+            turno = (etiqueta, self._secuencia, clase)
+            heapq.heappush(self._cola, turno)
+            while self.en_curso >= int(self.limite) or self._cola[0] is not turno:
+                self._condicion.wait()
+            heapq.heappop(self._cola)
+            self._tiempo_virtual = etiqueta
+            self.en_curso += 1
+            self._condicion.notify_all() # Puede quedar hueco para el siguiente turno
+        espera_cola_modelo.observar(time.monotonic() - llegada, clase=clase)
+
+    def en_cola(self):
+        """Número de llamadas esperando hueco, por clase."""
+        with self._condicion:
+            cuentas = {clase: 0 for clase in self.pesos}
+            for _, _, clase in self._cola:
+                cuentas[clase] += 1
+            return cuentas
+
+    def liberar(self):
+        with self._condicion:
+            self.en_curso -= 1
+            self._condicion.notify_all()
+
+    def exito(self):
+        """Aumento aditivo: aproximadamente +1 de límite por cada ventana completa de llamadas."""
+        with self._condicion:
+            self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+            self._condicion.notify_all()
+
+    def saturacion(self):
+        """Reducción multiplicativa; una ráfaga de errores simultáneos solo reduce una vez."""
+        with self._condicion:
+            ahora = time.monotonic()
+            if ahora - self._ultima_reduccion >= 1.0:
+                self.limite = max(self.minimo, self.limite / 2.0)
+                self._ultima_reduccion = ahora
+
+
+def es_error_saturacion(error):
+    """Indica si un error de la API es por cuota (429) o indisponibilidad temporal (503)."""
+    codigo = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if codigo in (429, 503):
+        return True
+    texto = str(error)
+    return any(marca in texto for marca in ("429", "503", "RESOURCE_EXHAUSTED", "UNAVAILABLE"))
+
+
+def espera_sugerida(error):
+    """Extrae el retryDelay que a veces devuelve la API en los errores 429 (en segundos)."""
+    coincidencia = re.search(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+    return float(coincidencia.group(1)) if coincidencia else None
+
+
+def estimar_tokens_entrada(prompt, documentos):
+    """
+    Estimación aproximada de tokens de entrada: ~4 caracteres por token para el
+    texto y ~258 tokens por página para los PDFs enviados en bytes.
+    """
+    tokens = len(prompt) // 4
+    for documento in documentos:
+        if isinstance(documento, str):
+            tokens += len(documento) // 4
+        else:
+            tokens += (len(re.findall(rb"/Type\s*/Page[^s]", documento)) or 1) * 258
+    return tokens
+
+
+# --- Cortocircuito de Gemini ---
+# Cuando el modelo está caído o responde muy lento, reintentar cada CV solo alarga la
+# espera de todos. El circuito vigila las últimas llamadas y, si fallan o tardan
+# demasiado, rechaza las nuevas al instante hasta comprobar que el modelo se ha recuperado.
+
+circuito_rechazos = registro_metricas.contador(
+    "cvisualizer_circuito_rechazos_total", "Llamadas al modelo rechazadas al momento con el circuito abierto."
+)
+circuito_transiciones = registro_metricas.contador(
+    "cvisualizer_circuito_transiciones_total", "Cambios de estado del cortocircuito del modelo.", ("estado",)
+)
+
+
+class CircuitoAbiertoError(Exception):
+    """El circuito está abierto: no se llama al modelo hasta pasados `reintentar_en` segundos."""
+
+    def __init__(self, reintentar_en):
+        self.reintentar_en = max(1, int(math.ceil(reintentar_en)))
+        super().__init__(f"El servicio de análisis no está disponible temporalmente. Reintente en {self.reintentar_en} s.")
+
+
+def es_fallo_proveedor(error):
+    """Errores que indican un problema del proveedor (saturación o 5xx), no de la petición."""
+    if es_error_saturacion(error):
+        return True
+    codigo = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    return not isinstance(codigo, int) or codigo >= 500
+
+
+class CircuitoModelo:
+    """Cortocircuito con estados cerrado, abierto y semiabierto sobre una ventana de llamadas."""
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, ventana, min_llamadas, tasa_errores, latencia_lenta, tasa_lentas, espera_segundos, sondas):
+        self.min_llamadas = min_llamadas
+        self.tasa_errores = tasa_errores
+        self.latencia_lenta = latencia_lenta
+        self.tasa_lentas = tasa_lentas
+        self.espera_segundos = espera_segundos
+        self.sondas = max(1, sondas)
+        self.estado = self.CERRADO
+        self._llamadas = deque(maxlen=max(1, ventana)) # (fallo, lenta) de las últimas llamadas
+        self._abierto_hasta = 0.0
+        self._sondas_en_curso = 0
+        self.aperturas = 0
+        self.rechazos = 0
+        self._lock = threading.Lock()
+
+    def _cambiar_estado(self, estado):
+        if estado == self.estado:
+            return
+        print(f"Circuito del modelo: {self.estado} -> {estado}")
+        self.estado = estado
+        circuito_transiciones.inc(estado=estado)
+
+    def _abrir(self):
+        self._abierto_hasta = time.monotonic() + self.espera_segundos
+        self._sondas_en_curso = 0
+        self._llamadas.clear()
+        self.aperturas += 1
+        self._cambiar_estado(self.ABIERTO)
+
+    def permitir(self):
+        """
+        Comprueba si se puede llamar al modelo. Con el circuito abierto lanza
+        CircuitoAbiertoError; en semiabierto solo deja pasar `sondas` llamadas a la vez.
+        """
+        with self._lock:
+            if self.estado == self.ABIERTO:
+                restante = self._abierto_hasta - time.monotonic()
+                if restante > 0:
+                    self.rechazos += 1
+                    circuito_rechazos.inc()
+                    raise CircuitoAbiertoError(restante)
+                self._cambiar_estado(self.SEMIABIERTO)
+            if self.estado == self.SEMIABIERTO:
+                if self._sondas_en_curso >= self.sondas:
+                    self.rechazos += 1
+                    circuito_rechazos.inc()
+                    raise CircuitoAbiertoError(1)
+                self._sondas_en_curso += 1
+
+    def registrar(self, exito, latencia):
+        """Anota el resultado de una llamada permitida y abre o cierra el circuito si corresponde."""
+        lenta = latencia is not None and latencia >= self.latencia_lenta
+        with self._lock:
+            if self.estado == self.SEMIABIERTO:
+                self._sondas_en_curso = max(0, self._sondas_en_curso - 1)
+                # Una sonda lenta tampoco demuestra que el modelo se haya recuperado
+                if exito and not lenta:
+                    self._llamadas.clear()
+                    self._cambiar_estado(self.CERRADO)
+                else:
+                    self._abrir()
+                return
+            if self.estado != self.CERRADO:
+                return # Llamada que empezó antes de abrirse el circuito
+            self._llamadas.append((not exito, lenta))
+            total = len(self._llamadas)
+            if total < self.min_llamadas:
+                return
+            fallos = sum(1 for fallo, _ in self._llamadas if fallo)
+            lentas = sum(1 for _, es_lenta in self._llamadas if es_lenta)
+            if fallos / total >= self.tasa_errores or lentas / total >= self.tasa_lentas:
+                self._abrir()
+
+    def liberar_sonda(self):
+        """Devuelve la plaza de sonda de una llamada permitida que no llegó a hacerse."""
+        with self._lock:
+            if self.estado == self.SEMIABIERTO:
+                self._sondas_en_curso = max(0, self._sondas_en_curso - 1)
+
+    def estadisticas(self):
+        """Devuelve el estado actual del circuito."""
+        with self._lock:
+            fallos = sum(1 for fallo, _ in self._llamadas if fallo)
+            lentas = sum(1 for _, es_lenta in self._llamadas if es_lenta)
+            return {
+                "estado": self.estado,
+                "reintentar_en": max(0, round(self._abierto_hasta - time.monotonic(), 1)) if self.estado == self.ABIERTO else 0,
+                "llamadas_ventana": len(self._llamadas),
+                "fallos_ventana": fallos,
+                "lentas_ventana": lentas,
+                "aperturas": self.aperturas,
+                "rechazos": self.rechazos,
+            }
+
+
+# --- Plazos y llamadas de cobertura ---
+# Una llamada lenta retrasa el CV entero. Cada llamada se ejecuta en un hilo con un
+# plazo máximo y, si tarda más que la mayoría de las recientes, se lanza un duplicado
+# (llamada de cobertura) y se usa la respuesta que llegue antes.
+
+coberturas_lanzadas = registro_metricas.contador(
+    "cvisualizer_coberturas_total", "Llamadas de cobertura (duplicadas) lanzadas al modelo."
+)
+coberturas_ganadas = registro_metricas.contador(
+    "cvisualizer_coberturas_ganadas_total", "Llamadas de cobertura que respondieron antes que la original."
+)
+plazos_excedidos = registro_metricas.contador(
+    "cvisualizer_llamadas_plazo_excedido_total", "Llamadas al modelo canceladas por superar el plazo."
+)
+
+
+class PlazoExcedidoError(TimeoutError):
+    """La llamada al modelo no respondió dentro del plazo."""
+
+
+class EjecutorCobertura:
+    """Ejecuta llamadas con plazo y, si se retrasan, con una llamada de cobertura dentro del presupuesto."""
+
+    def __init__(self, plazo_segundos, activada, percentil, presupuesto, min_muestras, ventana, max_hilos):
+        self.plazo_segundos = plazo_segundos
+        self.activada = activada
+        self.percentil = percentil
+        self.presupuesto = presupuesto
+        self.min_muestras = min_muestras
+        self._latencias = deque(maxlen=max(1, ventana)) # Latencias de las llamadas con éxito
+        self.llamadas = 0
+        self.coberturas = 0
+        self.coberturas_ganadas = 0
+        self.plazos_excedidos = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="llamada_modelo")
+
+    def retardo_cobertura(self):
+        """Tiempo tras el que se lanza la cobertura, o None si no hay muestras suficientes."""
+        with self._lock:
+            if not self.activada or len(self._latencias) < self.min_muestras:
+                return None
+            return float(np.percentile(self._latencias, self.percentil))
+
+    def _reservar_cobertura(self):
+        """Consume una cobertura del presupuesto (fracción del total de llamadas)."""
+        with self._lock:
+            if self.coberturas + 1 > self.presupuesto * self.llamadas:
+                return False
+            self.coberturas += 1
+            return True
+
+    def _lanzar(self, llamada):
+        inicio = time.monotonic()
+        futuro = self._executor.submit(llamada)
+
+        def anotar_latencia(f):
+            # Se anota la duración propia de cada llamada (también de las que pierden)
+            if not f.cancelled() and f.exception() is None:
+                with self._lock:
+                    self._latencias.append(time.monotonic() - inicio)
+        futuro.add_done_callback(anotar_latencia)
+        return futuro
+
+    @staticmethod
+    def _cuando_terminen(futuros, funcion):
+        """Llama a `funcion()` una sola vez, cuando todos los futuros hayan terminado o se hayan cancelado."""
+        restantes = [len(futuros)]
+        lock = threading.Lock()
+
+        def terminado(_):
+            with lock:
+                restantes[0] -= 1
+                ultimo = restantes[0] == 0
+            if ultimo:
+                funcion()
+        if not futuros:
+            funcion()
+        for futuro in futuros:
+            futuro.add_done_callback(terminado)
+
+    def ejecutar(self, llamada, permitir_cobertura=lambda: True, al_terminar=None):
+        """
+        Devuelve el resultado de `llamada()` o lanza su error. Si vence el plazo lanza
+        PlazoExcedidoError. `permitir_cobertura()` decide en el momento si hay cuota
+        para el duplicado. `al_terminar()` se llama cuando han acabado de verdad todas
+        las llamadas lanzadas, también las abandonadas por el plazo o por perder frente
+        a la cobertura, que siguen ejecutándose en el pool.
+        """
+        lanzadas = []
+        try:
+            return self._ejecutar(llamada, permitir_cobertura, lanzadas)
+        finally:
+            if al_terminar is not None:
+                self._cuando_terminen(lanzadas, al_terminar)
+
+    def _ejecutar(self, llamada, permitir_cobertura, lanzadas):
+        with self._lock:
+            self.llamadas += 1
+        limite = time.monotonic() + self.plazo_segundos if self.plazo_segundos > 0 else None
+        original = self._lanzar(llamada)
+        lanzadas.append(original)
+        pendientes = {original}
+        retardo = self.retardo_cobertura()
+        if retardo is not None and (self.plazo_segundos <= 0 or retardo < self.plazo_segundos):
+            hechos, _ = wait(pendientes, timeout=retardo)
+            if not hechos and self._reservar_cobertura():
+                if permitir_cobertura():
+                    coberturas_lanzadas.inc()
+                    cobertura = self._lanzar(llamada)
+                    lanzadas.append(cobertura)
+                    pendientes.add(cobertura)
+                else:
+                    with self._lock:
+                        self.coberturas -= 1 # Sin cuota en el limitador: se devuelve al presupuesto
+
+        error = None
+        while pendientes:
+            restante = None if limite is None else limite - time.monotonic()
+            if restante is not None and restante <= 0:
+                break
+            hechos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                if futuro.exception() is None:
+                    if futuro is not original:
+                        coberturas_ganadas.inc()
+                        with self._lock:
+                            self.coberturas_ganadas += 1
+                    for perdedor in pendientes:
+                        perdedor.cancel() # Solo evita las que aún no han empezado
+                    return futuro.result()
+                error = futuro.exception()
+        if pendientes or error is None:
+            for perdedor in pendientes:
+                perdedor.cancel()
+            plazos_excedidos.inc()
+            with self._lock:
+                self.plazos_excedidos += 1
+            raise PlazoExcedidoError(f"La llamada al modelo superó el plazo de {self.plazo_segundos:g} s")
+        raise error
+
+    def estadisticas(self):
+        """Devuelve la tasa de cobertura, la de victorias y el retardo actual."""
+        retardo = self.retardo_cobertura()
+        with self._lock:
+            return {
+                "activada": self.activada,
+                "plazo_segundos": self.plazo_segundos,
+                "retardo_cobertura_segundos": round(retardo, 3) if retardo is not None else None,
+                "llamadas": self.llamadas,
+                "coberturas": self.coberturas,
+                "coberturas_ganadas": self.coberturas_ganadas,
+                "tasa_cobertura": round(self.coberturas / self.llamadas, 4) if self.llamadas else 0.0,
+                "tasa_victorias": round(self.coberturas_ganadas / self.coberturas, 4) if self.coberturas else 0.0,
+                "plazos_excedidos": self.plazos_excedidos,
+            }
+
+
+class LimitadorGemini:
+    """Combina cuotas por minuto, concurrencia AIMD y reintentos para las llamadas al modelo."""
+
+    def __init__(self, rpm, tpm, concurrencia_inicial, concurrencia_max, max_reintentos, espera_base, espera_max, circuito=None, cobertura=None):
+        self.circuito = circuito
+        self.cobertura = cobertura
+        self.cubo_peticiones = CuboTokens(rpm)
+        self.cubo_tokens = CuboTokens(tpm)
+        self.concurrencia = ConcurrenciaAIMD(concurrencia_inicial, 1, concurrencia_max, PESOS_PRIORIDAD)
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.llamadas = 0
+        self.saturaciones = 0
+        self.reintentos = 0
+        self._lock = threading.Lock()
+
+    def ejecutar(self, llamada, tokens_estimados):
+        """
+        Ejecuta `llamada()` respetando los límites. Reintenta los errores de
+        saturación y relanza el último error si se agotan los reintentos. Con el
+        circuito abierto lanza CircuitoAbiertoError sin llegar a llamar al modelo.
+        """
+        for intento in range(self.max_reintentos + 1):
+            if self.circuito is not None:
+                self.circuito.permitir()
+            self.concurrencia.adquirir(prioridad_actual.get())
+            inicio = None
+            espera = None
+            # Con cobertura, el hueco se libera cuando terminan de verdad las llamadas lanzadas
+            # (no al vencer el plazo), así que las abandonadas siguen contando en la concurrencia
+            liberar_al_terminar = self.cobertura is not None
+            try:
+                self.cubo_peticiones.adquirir(1)
+                self.cubo_tokens.adquirir(tokens_estimados)
+                with self._lock:
+                    self.llamadas += 1
+                inicio = time.monotonic()
+                if self.cobertura is not None:
+                    # La cobertura también consume cuota, pero sin esperar a que la haya
+                    respuesta = self.cobertura.ejecutar(
+                        llamada,
+                        lambda: self.cubo_peticiones.intentar_adquirir(1) and self.cubo_tokens.intentar_adquirir(tokens_estimados),
+                        al_terminar=self.concurrencia.liberar
+                    )
+                else:
+                    respuesta = llamada()
+            except Exception as e:
+                if self.circuito is not None:
+                    if inicio is None:
+                        self.circuito.liberar_sonda()
+                    else:
+                        self.circuito.registrar(not es_fallo_proveedor(e), time.monotonic() - inicio)
+                if not es_error_saturacion(e):
+                    raise
+                self.concurrencia.saturacion()
+                with self._lock:
+                    self.saturaciones += 1
+                if intento == self.max_reintentos:
+                    raise
+                # Espera exponencial con "full jitter", respetando el retryDelay de la API si lo hay
+                espera = random.uniform(0, min(self.espera_max, self.espera_base * (2 ** intento)))
+                sugerida = espera_sugerida(e)
+                if sugerida is not None:
+                    espera = max(espera, min(sugerida, self.espera_max))
+                print(f"Advertencia: Gemini saturado ({e}). Reintento {intento + 1}/{self.max_reintentos} en {espera:.1f} s.")
+                with self._lock:
+                    self.reintentos += 1
+            finally:
+                if not liberar_al_terminar or inicio is None:
+                    self.concurrencia.liberar() # Sin llamada lanzada a la cobertura, se libera aquí
+
+            if espera is not None:
+                # La espera se hace sin ocupar hueco de concurrencia; el siguiente intento lo vuelve a pedir
+                time.sleep(espera)
+                continue
+
+            self.concurrencia.exito()
+            latencia = time.monotonic() - inicio
+            if self.circuito is not None:
+                self.circuito.registrar(True, latencia)
+            duracion_etapas.observar(latencia, etapa="llamada_modelo")
+            if isinstance(respuesta, RespuestaModelo):
+                respuesta.latencia_segundos = latencia
+            # Ajustar el cubo de tokens con el uso real si el motor lo devuelve
+            tokens_reales = getattr(respuesta, 'total_tokens', None)
+            if tokens_reales:
+                self.cubo_tokens.ajustar(tokens_reales - tokens_estimados)
+            return respuesta
+
+    def estadisticas(self):
+        """Devuelve el estado actual del limitador."""
+        with self._lock:
+            return {
+                "llamadas": self.llamadas,
+                "saturaciones": self.saturaciones,
+                "reintentos": self.reintentos,
+                "limite_concurrencia": round(self.concurrencia.limite, 2),
+                "en_curso": self.concurrencia.en_curso,
+                "en_cola": self.concurrencia.en_cola(),
+            }
+
+
+motor_llm = crear_motor_llm()
+
+circuito_modelo = CircuitoModelo(
+    CIRCUITO_VENTANA, CIRCUITO_MIN_LLAMADAS, CIRCUITO_TASA_ERRORES,
+    CIRCUITO_LATENCIA_LENTA_SEGUNDOS, CIRCUITO_TASA_LENTAS,
+    CIRCUITO_ESPERA_SEGUNDOS, CIRCUITO_SONDAS
+)
+
+ejecutor_cobertura = EjecutorCobertura(
+    LLAMADA_PLAZO_SEGUNDOS, COBERTURA_ACTIVADA, COBERTURA_PERCENTIL, COBERTURA_PRESUPUESTO,
+    COBERTURA_MIN_MUESTRAS, COBERTURA_VENTANA,
+    max_hilos=GEMINI_CONCURRENCIA_MAX * 2 # Hueco para una cobertura por llamada en curso
+)
+
+limitador_gemini = LimitadorGemini(
+    GEMINI_RPM, GEMINI_TPM,
+    GEMINI_CONCURRENCIA_INICIAL, GEMINI_CONCURRENCIA_MAX,
+    GEMINI_MAX_REINTENTOS, GEMINI_ESPERA_BASE_SEGUNDOS, GEMINI_ESPERA_MAX_SEGUNDOS,
+    circuito=circuito_modelo, cobertura=ejecutor_cobertura
+)
+
+# --- Contabilidad de tokens y coste ---
+# Cada resultado lleva un campo "uso_modelo" con los tokens, el modelo, la latencia
+# y el coste estimado de la llamada que lo produjo. Si una misma llamada resolvió
+# varios resultados (multipuesto o micro-lote), el uso se reparte a partes iguales.
+
+def estimar_coste(modelo, tokens_entrada, tokens_salida, tokens_cacheados):
+    """Coste estimado en USD según PRECIOS_MODELOS, o None si el modelo no tiene precio."""
+    precios = PRECIOS_MODELOS.get(modelo)
+    if precios is None:
+        return None
+    tokens_cacheados = tokens_cacheados or 0
+    # Los tokens cacheados forman parte de los de entrada, pero se cobran a otro precio
+    tokens_no_cacheados = max(0, (tokens_entrada or 0) - tokens_cacheados)
+    coste = (
+        tokens_no_cacheados * precios["entrada"]
+        + tokens_cacheados * precios.get("cacheado", precios["entrada"])
+        + (tokens_salida or 0) * precios["salida"]
+    )
+    return coste / 1_000_000
+
+
+def uso_de_respuesta(respuesta, num_resultados=1):
+    """Uso atribuible a cada uno de los `num_resultados` resultados de una respuesta del modelo."""
+    def repartir(valor):
+        if valor is None or num_resultados == 1:
+            return valor
+        return round(valor / num_resultados, 2)
+
+    coste = estimar_coste(respuesta.modelo, respuesta.tokens_entrada, respuesta.tokens_salida, respuesta.tokens_cacheados)
+    return {
+        "origen": "modelo",
+        "modelo": respuesta.modelo,
+        "tokens_entrada": repartir(respuesta.tokens_entrada),
+        "tokens_salida": repartir(respuesta.tokens_salida),
+        "tokens_cacheados": repartir(respuesta.tokens_cacheados),
+        "latencia_segundos": round(respuesta.latencia_segundos or 0.0, 3),
+        "coste_estimado": None if coste is None else coste / num_resultados,
+        "resultados_por_llamada": num_resultados,
+    }
+
+
+def uso_sin_llamada(origen):
+    """Uso de un resultado que no ha necesitado llamar al modelo ("cache" o "prefiltro")."""
+    return {
+        "origen": origen,
+        "modelo": None,
+        "tokens_entrada": 0,
+        "tokens_salida": 0,
+        "tokens_cacheados": 0,
+        "latencia_segundos": 0.0,
+        "coste_estimado": 0.0,
+        "resultados_por_llamada": 0,
+    }
+
+
+def con_uso(resultado, uso):
+    """Copia del resultado con su uso adjunto (el resultado cacheado se guarda sin él)."""
+    return {**resultado, "uso_modelo": uso}
+
+
+def resumir_uso(resultados):
+    """Agrega el uso_modelo de los resultados de una ejecución (los errores no cuentan)."""
+    resumen = {
+        "tokens_entrada": 0,
+        "tokens_salida": 0,
+        "tokens_cacheados": 0,
+        "tokens_totales": 0,
+        "coste_estimado": 0.0,
+        "latencia_total_segundos": 0.0,
+        "resultados_modelo": 0,
+        "resultados_cache": 0,
+        "resultados_prefiltro": 0,
+        "modelos": [],
+    }
+    for resultado in resultados:
+        uso = resultado.get("uso_modelo") if isinstance(resultado, dict) else None
+        if not isinstance(uso, dict):
+            continue
+        for campo in ("tokens_entrada", "tokens_salida", "tokens_cacheados"):
+            resumen[campo] += uso.get(campo) or 0
+        resumen["coste_estimado"] += uso.get("coste_estimado") or 0.0
+        resumen["latencia_total_segundos"] += uso.get("latencia_segundos") or 0.0
+        origen = uso.get("origen", "modelo")
+        if f"resultados_{origen}" in resumen:
+            resumen[f"resultados_{origen}"] += 1
+        if uso.get("modelo") and uso["modelo"] not in resumen["modelos"]:
+            resumen["modelos"].append(uso["modelo"])
+    for campo in ("tokens_entrada", "tokens_salida", "tokens_cacheados"):
+        resumen[campo] = round(resumen[campo])
+    resumen["tokens_totales"] = resumen["tokens_entrada"] + resumen["tokens_salida"]
+    resumen["coste_estimado"] = round(resumen["coste_estimado"], 6)
+    resumen["latencia_total_segundos"] = round(resumen["latencia_total_segundos"], 3)
+    return resumen
+
+
+# --- Almacén de trabajos asíncronos ---
+# Cada trabajo se guarda como un archivo JSON en RUTA_TRABAJOS y se mantiene
+# también en memoria para que las consultas de estado no toquen el disco.
+
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_EN_PROCESO = "en_proceso"
+ESTADO_COMPLETADO = "completado"
+ESTADO_ERROR = "error"
+
+
+class AlmacenTrabajos:
+    """Registro persistente de trabajos de análisis (estado, resultado y tiempos)."""
+
+    def __init__(self, ruta, ttl_segundos):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._trabajos = {}
+        self._cargar()
+
+    def _ruta_trabajo(self, job_id):
+        return os.path.join(self.ruta, f"{job_id}.json")
+
+    def _cargar(self):
+        """Carga los trabajos existentes; los que quedaron a medias se marcan como error."""
+        try:
+            os.makedirs(self.ruta, exist_ok=True)
+            for nombre in os.listdir(self.ruta):
+                if not nombre.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.ruta, nombre), 'r', encoding='utf-8') as f:
+                        trabajo = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"Advertencia: Registro de trabajo ilegible {nombre}: {e}")
+                    continue
+                if trabajo.get("estado") in (ESTADO_PENDIENTE, ESTADO_EN_PROCESO):
+                    # El PDF solo estaba en memoria, así que el trabajo no se puede retomar
+                    trabajo["estado"] = ESTADO_ERROR
+                    trabajo["error"] = "Trabajo interrumpido por un reinicio del servidor"
+                    trabajo["finalizado"] = datetime.now().isoformat()
+                    self._escribir(trabajo)
+                self._trabajos[trabajo["job_id"]] = trabajo
+        except Exception as e:
+            print(f"Advertencia: No se pudieron cargar los trabajos guardados: {e}")
+
+    def _escribir(self, trabajo):
+        try:
+            ruta_tmp = self._ruta_trabajo(trabajo["job_id"]) + ".tmp"
+            with open(ruta_tmp, 'w', encoding='utf-8') as f:
+                json.dump(trabajo, f, ensure_ascii=False)
+            os.replace(ruta_tmp, self._ruta_trabajo(trabajo["job_id"]))
+        except OSError as e:
+            print(f"Advertencia: No se pudo guardar el trabajo {trabajo.get('job_id')}: {e}")
+
+    def _purgar_caducados(self):
+        limite = time.time() - self.ttl_segundos
+        caducados = [
+            job_id for job_id, trabajo in self._trabajos.items()
+            if trabajo.get("estado") in (ESTADO_COMPLETADO, ESTADO_ERROR) and trabajo.get("_actualizado", 0) < limite
+        ]
+        for job_id in caducados:
+            del self._trabajos[job_id]
+            try:
+                os.remove(self._ruta_trabajo(job_id))
+            except OSError:
+                pass
+
+    def crear(self, datos):
+        """Registra un trabajo nuevo en estado pendiente y devuelve su id."""
+        job_id = uuid.uuid4().hex
+        trabajo = {
+            "job_id": job_id,
+            "estado": ESTADO_PENDIENTE,
+            "creado": datetime.now().isoformat(),
+            "resultado": None,
+            "error": None,
+            "_actualizado": time.time(),
+            **datos,
+        }
+        with self._lock:
+            self._purgar_caducados()
+            self._trabajos[job_id] = trabajo
+            self._escribir(trabajo)
+        return job_id
+
+    def actualizar(self, job_id, **cambios):
+        """Actualiza los campos de un trabajo y lo persiste."""
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+            if trabajo is None:
+                return
+            trabajo.update(cambios)
+            trabajo["_actualizado"] = time.time()
+            self._escribir(trabajo)
+
+    def obtener(self, job_id):
+        """Devuelve una copia del trabajo (sin campos internos) o None si no existe."""
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+            if trabajo is None:
+                return None
+            return {k: v for k, v in trabajo.items() if not k.startswith("_")}
+
+    def contar_activos(self):
+        """Número de trabajos pendientes o en proceso."""
+        with self._lock:
+            return sum(1 for t in self._trabajos.values() if t.get("estado") in (ESTADO_PENDIENTE, ESTADO_EN_PROCESO))
+
+
+almacen_trabajos = AlmacenTrabajos(RUTA_TRABAJOS, TRABAJOS_TTL_SEGUNDOS)
+# Pool de workers que ejecutan los análisis de los trabajos asíncronos
+executor_trabajos = ThreadPoolExecutor(max_workers=TRABAJOS_MAX_WORKERS, thread_name_prefix="trabajo_cv")
+
+# --- Extracción de texto y prefiltrado local ---
+# Los filtros del formulario se pasan al modelo dentro del prompt, pero un CV que
+# incumple claramente un filtro duro no necesita una llamada a Gemini. Antes del
+# modelo se extrae el texto del PDF (en un pool de procesos, cacheado por hash) y
+# se aplican heurísticas deterministas y conservadoras: solo se descarta cuando
+# el texto es fiable y el incumplimiento es evidente.
+
+def extraer_texto_pdf(pdf_bytes):
+    """Extrae el texto de todas las páginas de un PDF (se ejecuta en el pool de procesos)."""
+    import io
+    lector = PdfReader(io.BytesIO(pdf_bytes))
+    paginas = [pagina.extract_text() or "" for pagina in lector.pages]
+    return {"texto": "\n".join(paginas), "paginas": len(paginas)}
+
+
+pool_procesos = None
+lock_pool_procesos = threading.Lock()
+cache_textos = OrderedDict() # sha256 del PDF -> texto extraído (LRU)
+lock_cache_textos = threading.Lock()
+
+
+def obtener_pool_procesos():
+    """Crea bajo demanda el pool de procesos para las tareas de CPU sobre PDFs."""
+    global pool_procesos
+    with lock_pool_procesos:
+        if pool_procesos is None:
+            pool_procesos = ProcessPoolExecutor(max_workers=PREFILTRO_PROCESOS)
+        return pool_procesos
+
+
+def obtener_texto_pdf(pdf_bytes):
+    """
+    Devuelve {"texto", "paginas"} del PDF usando la caché por hash, o None si no
+    se puede extraer (pypdf no instalado, PDF dañado o tiempo agotado).
+    """
+    if PdfReader is None:
+        return None
+    huella = hashlib.sha256(pdf_bytes).hexdigest()
+    with lock_cache_textos:
+        if huella in cache_textos:
+            cache_textos.move_to_end(huella)
+            return cache_textos[huella]
+    try:
+        with duracion_etapas.medir(etapa="extraccion_texto"):
+            extraido = obtener_pool_procesos().submit(extraer_texto_pdf, bytes(pdf_bytes)).result(timeout=PREFILTRO_TIMEOUT_SEGUNDOS)
+    except Exception as e:
+        print(f"Advertencia: No se pudo extraer el texto del PDF en local: {e}")
+        extraido = None
+    with lock_cache_textos:
+        cache_textos[huella] = extraido
+        while len(cache_textos) > CACHE_TEXTOS_MAX_ENTRADAS:
+            cache_textos.popitem(last=False)
+    return extraido
+
+
+def aligerar_pdf_en_proceso(pdf_bytes, max_paginas, max_lado_imagen, calidad_jpeg):
+    """
+    Reescribe el PDF con menos peso (se ejecuta en el pool de procesos): recorta
+    las páginas sobrantes, reduce y recomprime las imágenes y elimina objetos
+    duplicados o huérfanos. Devuelve (bytes, si se recortaron páginas).
+    """
+    import io
+    from pypdf import PdfWriter
+    escritor = PdfWriter(clone_from=PdfReader(io.BytesIO(pdf_bytes)))
+    recortado = bool(max_paginas) and len(escritor.pages) > max_paginas
+    if recortado:
+        for indice in range(len(escritor.pages) - 1, max_paginas - 1, -1):
+            del escritor.pages[indice]
+    for pagina in escritor.pages:
+        for imagen in pagina.images:
+            try:
+                contenido = imagen.image # Requiere Pillow
+                if contenido.mode not in ("RGB", "L"):
+                    continue # Imágenes con transparencia o paleta: se dejan como están
+                if max(contenido.size) > max_lado_imagen:
+                    contenido.thumbnail((max_lado_imagen, max_lado_imagen))
+                imagen.replace(contenido, quality=calidad_jpeg)
+            except Exception:
+                continue # Formato de imagen no soportado: se conserva el original
+        pagina.compress_content_streams()
+    escritor.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    salida = io.BytesIO()
+    escritor.write(salida)
+    return salida.getvalue(), recortado
+
+
+def aligerar_pdf(pdf_bytes):
+    """
+    Devuelve una versión más ligera del PDF para enviarla al modelo, o el PDF
+    original si el aligerado está desactivado, no compensa o falla. Si se han
+    recortado páginas (ALIGERADO_MAX_PAGINAS) se usa siempre la versión recortada.
+    """
+    if not ALIGERADO_ACTIVADO or PdfReader is None:
+        return pdf_bytes
+    if len(pdf_bytes) < ALIGERADO_UMBRAL_BYTES and not ALIGERADO_MAX_PAGINAS:
+        return pdf_bytes
+    inicio = time.monotonic()
+    try:
+        aligerado, recortado = obtener_pool_procesos().submit(
+            aligerar_pdf_en_proceso, bytes(pdf_bytes), ALIGERADO_MAX_PAGINAS, ALIGERADO_MAX_LADO_IMAGEN, ALIGERADO_CALIDAD_JPEG
+        ).result(timeout=ALIGERADO_TIMEOUT_SEGUNDOS)
+    except Exception as e:
+        print(f"Advertencia: No se pudo aligerar el PDF, se envía el original: {e}")
+        return pdf_bytes
+    duracion = time.monotonic() - inicio
+    duracion_etapas.observar(duracion, etapa="aligerado_pdf")
+    print(f"PDF aligerado: {len(pdf_bytes)} -> {len(aligerado)} bytes en {duracion:.2f}s{' (páginas recortadas)' if recortado else ''}.")
+    # Sin recorte, el original se conserva si la reescritura no lo hace más pequeño
+    return aligerado if recortado or len(aligerado) < len(pdf_bytes) else pdf_bytes
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes, para comparar palabras de forma tolerante."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+# Palabras vacías frecuentes de cada idioma, para estimar el idioma principal del CV
+PALABRAS_IDIOMA = {
+    "es": {"de", "la", "el", "en", "y", "los", "las", "del", "con", "para", "por", "una", "como", "que"},
+    "en": {"the", "and", "of", "to", "in", "for", "with", "on", "at", "as", "an", "by", "from", "my"},
+    "fr": {"le", "la", "les", "des", "et", "en", "du", "pour", "avec", "une", "dans", "sur", "au", "aux"},
+    "de": {"der", "die", "das", "und", "mit", "fur", "von", "zu", "im", "den", "bei", "ein", "eine", "auf"},
+    "it": {"il", "di", "e", "la", "per", "con", "del", "della", "un", "una", "nel", "alla", "dei", "che"},
+    "pt": {"de", "e", "do", "da", "em", "para", "com", "os", "as", "uma", "dos", "das", "no", "na"},
+}
+# Nombres con los que se puede escribir cada idioma en el filtro o en el CV (normalizados)
+NOMBRES_IDIOMA = {
+    "es": {"espanol", "castellano", "spanish"},
+    "en": {"ingles", "english"},
+    "fr": {"frances", "french", "francais"},
+    "de": {"aleman", "german", "deutsch"},
+    "it": {"italiano", "italian"},
+    "pt": {"portugues", "portuguese"},
+}
+
+
+def detectar_idioma(texto_normalizado):
+    """Devuelve (idioma, aciertos, aciertos_del_segundo) según las palabras vacías del texto."""
+    palabras = re.findall(r"[a-z]+", texto_normalizado)
+    recuentos = {idioma: sum(1 for p in palabras if p in vacias) for idioma, vacias in PALABRAS_IDIOMA.items()}
+    ordenados = sorted(recuentos.items(), key=lambda x: x[1], reverse=True)
+    return ordenados[0][0], ordenados[0][1], ordenados[1][1]
+
+
+def motivo_descarte_prefiltro(texto, filtros):
+    """
+    Aplica las heurísticas deterministas. Devuelve el motivo de descarte (str)
+    o None si el CV debe pasar al modelo.
+    """
+    texto_normalizado = normalizar_texto(texto)
+
+    # Palabras clave: se descarta solo si no aparece NINGUNA
+    if filtros.get("filtro_palabras_clave"):
+        palabras_clave = [normalizar_texto(p.strip()) for p in filtros["filtro_palabras_clave"].split(",") if p.strip()]
+        if palabras_clave and not any(p in texto_normalizado for p in palabras_clave):
+            return f"Ninguna de las palabras clave requeridas ({filtros['filtro_palabras_clave']}) aparece en el currículum."
+
+    # Experiencia mínima: cota superior = años desde la fecha más antigua del CV hasta hoy
+    if filtros.get("filtro_experiencia_min"):
+        anio_actual = datetime.now().year
+        anios = [int(a) for a in re.findall(r"\b(19[5-9]\d|20\d\d)\b", texto) if int(a) <= anio_actual]
+        if anios:
+            maximo_posible = anio_actual - min(anios)
+            if maximo_posible < filtros["filtro_experiencia_min"]:
+                return (f"El currículum abarca como máximo {maximo_posible} años (desde {min(anios)}), "
+                        f"menos que la experiencia mínima exigida de {filtros['filtro_experiencia_min']} años.")
+
+    # Idioma: se descarta si el CV está claramente en otro idioma y no menciona el requerido
+    if filtros.get("filtro_idioma"):
+        filtro_normalizado = normalizar_texto(filtros["filtro_idioma"])
+        idioma_requerido = next((idioma for idioma, nombres in NOMBRES_IDIOMA.items() if any(n in filtro_normalizado for n in nombres)), None)
+        if idioma_requerido:
+            idioma, aciertos, aciertos_segundo = detectar_idioma(texto_normalizado)
+            menciona_idioma = any(n in texto_normalizado for n in NOMBRES_IDIOMA[idioma_requerido])
+            if idioma != idioma_requerido and aciertos >= 30 and aciertos >= 3 * max(aciertos_segundo, 1) and not menciona_idioma:
+                return f"El currículum está redactado en otro idioma y no menciona el idioma requerido ({filtros['filtro_idioma']})."
+
+    return None
+
+
+def nombre_desde_texto(texto):
+    """Intenta obtener (nombre, apellidos) de la primera línea del CV que parezca un nombre."""
+    for linea in texto.splitlines()[:5]:
+        palabras = linea.strip().split()
+        if 2 <= len(palabras) <= 4 and all(p.replace("-", "").isalpha() for p in palabras):
+            return palabras[0].capitalize(), " ".join(p.capitalize() for p in palabras[1:])
+    return "No identificado", "No identificado"
+
+
+def aplicar_prefiltro(pdf_bytes, filtros):
+    """
+    Etapa previa al modelo. Devuelve un resultado "no apto" con forma de Resultado
+    si el CV incumple claramente algún filtro, o None si debe analizarse con el modelo.
+    """
+    if not PREFILTRO_ACTIVADO or not any(filtros.get(k) for k in ("filtro_palabras_clave", "filtro_experiencia_min", "filtro_idioma")):
+        return None
+    extraido = obtener_texto_pdf(pdf_bytes)
+    if not extraido or len(extraido["texto"].strip()) < PREFILTRO_MIN_CARACTERES:
+        return None # Sin texto fiable (p. ej. PDF escaneado): decide el modelo
+
+    motivo = motivo_descarte_prefiltro(extraido["texto"], filtros)
+    if motivo is None:
+        return None
+    nombre, apellidos = nombre_desde_texto(extraido["texto"])
+    resultado = Resultado(
+        nombre=nombre,
+        apellidos=apellidos,
+        experiencia_trabajo=[],
+        educacion=[],
+        apto=False,
+        puntuacionPuesto=0,
+        razonesNoAptitud=f"Descartado automáticamente en el prefiltrado (sin análisis AI): {motivo}",
+    ).model_dump()
+    resultado["prefiltrado"] = True
+    resultado["uso_modelo"] = uso_sin_llamada("prefiltro")
+    return resultado
+
+
+def normalizar_texto_extraido(texto):
+    """Limpia el texto extraído: une palabras cortadas con guion y compacta espacios y saltos de línea."""
+    texto = unicodedata.normalize("NFC", texto)
+    texto = "".join(c for c in texto if c in "\n\t" or unicodedata.category(c)[0] != "C")
+    texto = re.sub(r"(\w)-\n(\w)", r"\1\2", texto)
+    texto = re.sub(r"[ \t]+", " ", texto)
+    texto = re.sub(r" ?\n ?", "\n", texto)
+    texto = re.sub(r"\n{3,}", "\n\n", texto)
+    return texto.strip()
+
+
+def tiene_capa_texto(extraido):
+    """Indica si el texto extraído es suficiente y legible como para sustituir al PDF."""
+    texto = extraido["texto"]
+    if len(texto.strip()) < max(PREFILTRO_MIN_CARACTERES, ENVIO_TEXTO_MIN_CARACTERES_PAGINA * extraido["paginas"]):
+        return False
+    # Si la extracción produce muchos símbolos raros (fuentes sin mapa Unicode), mejor enviar el PDF
+    legibles = sum(1 for c in texto if c.isalnum() or c.isspace() or c in ".,;:()-/@+%&'\"·•")
+    return legibles / len(texto) >= 0.9
+
+
+def preparar_documento(pdf_bytes):
+    """
+    Devuelve lo que se enviará al modelo para este PDF: su texto normalizado si
+    el envío como texto está activado y el PDF tiene capa de texto, o los bytes
+    del PDF aligerado. La caché de resultados sigue usando el PDF original.
+    """
+    if not ENVIO_TEXTO_ACTIVADO:
+        return aligerar_pdf(pdf_bytes)
+    extraido = obtener_texto_pdf(pdf_bytes)
+    if not extraido or not tiene_capa_texto(extraido):
+        return aligerar_pdf(pdf_bytes) # PDF escaneado o solo imagen
+    return normalizar_texto_extraido(extraido["texto"])
 
-    # Construir el prompt dinámicamente con los filtros
+
+def registrar_envio(pdf_bytes_lista, documentos, tokens_estimados, response):
+    """Escribe en el log el tamaño enviado frente al original y los tokens de la petición."""
+    bytes_pdf = sum(len(pdf) for pdf in pdf_bytes_lista)
+    bytes_enviados = sum(len(d.encode('utf-8')) if isinstance(d, str) else len(d) for d in documentos)
+    modos = ",".join("texto" if isinstance(d, str) else "pdf" for d in documentos)
+    print(f"Envío al modelo [{modos}]: {bytes_pdf} bytes de PDF -> {bytes_enviados} bytes enviados, "
+          f"tokens de entrada estimados {tokens_estimados}, reales {getattr(response, 'tokens_entrada', None)}.")
+
+
+# --- Construcción del prompt de análisis ---
+
+# Descripción de los campos de Resultado que se pide al modelo
+DESCRIPCION_CAMPOS_RESULTADO = """nombre (string): Nombre del candidato (primera letra mayúscula).
+apellidos (string): Apellidos del candidato (primera letra de cada apellido en mayúscula).
+experiencia_trabajo (list[string]): Experiencias laborales relevantes (resumen conciso de roles, empresas, etc.).
+educacion (list[string]): Experiencias académicas relevantes (grados, instituciones, etc.).
+apto (boolean): ¿Es apto para el puesto? (True/False).
+resumenCandidato (string, opcional): Resumen breve de fortalezas aplicadas al puesto.
+puntuacionPuesto (integer): Puntuación de idoneidad general orientativa (0-10).
+razonesNoAptitud (string, opcional): Carencias o razones por las que podría no ser seleccionado (si las hay).
+subpuntuacion_experiencia (float): Subpuntuación de la experiencia laboral relevante (0-10).
+subpuntuacion_educacion (float): Subpuntuación de la formación académica relevante (0-10).
+subpuntuacion_habilidades (float): Subpuntuación de las habilidades técnicas y soft skills aplicables (0-10).
+subpuntuacion_idiomas (float): Subpuntuación del dominio de idiomas relevantes (0-10).
+subpuntuacion_otros (float): Subpuntuación de otros factores (consistencia del historial, logros específicos) (0-10).
+cumpleFiltros (boolean): ¿Cumple todos los filtros aplicados? (True si no hay filtros)."""
+
+
+def construir_prompt_filtros(filtros):
+    """Construye las líneas del prompt correspondientes a los filtros indicados."""
     prompt_filtros = ""
-    if filtro_idioma:
-        prompt_filtros += f"- El idioma principal del candidato debe ser {filtro_idioma}.\n"
-    if filtro_experiencia_min is not None:
-        prompt_filtros += f"- Considera solo candidatos con al menos {filtro_experiencia_min} años de experiencia laboral total.\n"
-    if filtro_palabras_clave:
-        prompt_filtros += f"- Busca específicamente las siguientes palabras clave en el currículum: {filtro_palabras_clave}.\n"
-    if filtro_nivel_educativo:
-        prompt_filtros += f"- Prioriza candidatos con un nivel educativo igual o superior a {filtro_nivel_educativo}.\n"
-    if filtro_sector:
-        prompt_filtros += f"- Busca candidatos con experiencia laboral relevante en el sector de {filtro_sector}.\n"
-
-    # Añadir los pesos personalizables al prompt
-    # Instruir a la IA a usar estos pesos para la evaluación y la puntuación
-    prompt_pesos_instruccion = f"""
+    if filtros.get("filtro_idioma"):
+        prompt_filtros += f"- El idioma principal del candidato debe ser {filtros['filtro_idioma']}.\n"
+    if filtros.get("filtro_experiencia_min") is not None:
+        prompt_filtros += f"- Considera solo candidatos con al menos {filtros['filtro_experiencia_min']} años de experiencia laboral total.\n"
+    if filtros.get("filtro_palabras_clave"):
+        prompt_filtros += f"- Busca específicamente las siguientes palabras clave en el currículum: {filtros['filtro_palabras_clave']}.\n"
+    if filtros.get("filtro_nivel_educativo"):
+        prompt_filtros += f"- Prioriza candidatos con un nivel educativo igual o superior a {filtros['filtro_nivel_educativo']}.\n"
+    if filtros.get("filtro_sector"):
+        prompt_filtros += f"- Busca candidatos con experiencia laboral relevante en el sector de {filtros['filtro_sector']}.\n"
+    return prompt_filtros
+
+
+def construir_instrucciones_criterios(descripcion_puesto):
+    """Construye el bloque del prompt con los criterios que se puntúan por separado."""
+    # Los pesos NO se envían al modelo: la ponderación se hace en local sobre las subpuntuaciones
+    return f"""
 **Instrucciones de Evaluación Adicionales:**
-- Evalúa al candidato para el puesto de {nombre_puesto} basándote en los siguientes pesos relativos para cada criterio:
-    - Experiencia Laboral Relevante: {peso_experiencia}%
-    - Formación Académica Relevante: {peso_educacion}%
-    - Habilidades Técnicas y Soft Skills Aplicables: {peso_habilidades}%
-    - Dominio de Idiomas Relevantes: {peso_idiomas}%
-    - Otros Factores (consistencia del historial, logros específicos): {peso_otros}%
-- Utiliza estos pesos para guiar tu evaluación y la determinación de la puntuación de idoneidad (0-10) y la aptitud (True/False).
+- Evalúa al candidato para {descripcion_puesto} en cada uno de los siguientes criterios, con una subpuntuación de 0 a 10:
+    - Experiencia Laboral Relevante (subpuntuacion_experiencia)
+    - Formación Académica Relevante (subpuntuacion_educacion)
+    - Habilidades Técnicas y Soft Skills Aplicables (subpuntuacion_habilidades)
+    - Dominio de Idiomas Relevantes (subpuntuacion_idiomas)
+    - Otros Factores, como la consistencia del historial o logros específicos (subpuntuacion_otros)
+- Puntúa cada criterio de forma absoluta frente a lo que exige el puesto, sin tener en cuenta la importancia de un criterio frente a otro.
 """
 
-    prompt = f"""
-**Tarea:** Analiza el currículum de un candidato y determina su idoneidad para el puesto de {nombre_puesto}.
+
+def componer_prompt(tarea, instrucciones_criterios, prompt_filtros, paso_adicional, formato_salida, restriccion_formato):
+    """Ensambla el prompt completo a partir de sus bloques."""
+    return f"""
+**Tarea:** {tarea}
 
 **Instrucciones Generales:**
 1. Actúa como un reclutador experto en selección de talento.
 2. Evalúa el currículum basándote únicamente en la información proporcionada en el documento.
 3. Compara el perfil del candidato con los mejores perfiles de CV con los que has sido entrenado.
 
-{prompt_pesos_instruccion}
+{instrucciones_criterios}
 
 {"""**Filtros Aplicados (Considerar durante la evaluación):**
 """ + prompt_filtros if prompt_filtros else ""}
 
-4. Basado en el análisis y los pesos proporcionados, evalúa al candidato en cada criterio.
-5. Determina una puntuación total de idoneidad (0-10) que refleje la evaluación general según los pesos.
-6. Determina si el candidato es apto (`apto`: True/False).
-7. Genera un resumen o las razones de no selección.
-8. **Estima** los porcentajes individuales de contribución de cada criterio al perfil general según tu evaluación y los pesos dados (campos: porcentaje_experiencia, etc.).
+4. Basado en el análisis, asigna a cada criterio su subpuntuación (0-10).
+5. Indica si el candidato cumple todos los filtros aplicados (`cumpleFiltros`: True/False).
+6. Determina una puntuación total de idoneidad orientativa (0-10) y si el candidato es apto (`apto`: True/False).
+7. Genera un resumen de sus fortalezas y, si las hay, las carencias o razones por las que podría no ser seleccionado.
+8. No es necesario rellenar los campos porcentaje_*: se calculan a partir de las subpuntuaciones.
+{paso_adicional}
+**Formato de Salida:** {formato_salida}
 
-**Formato de Salida:** Genera un objeto JSON puro con los siguientes campos:
-
-nombre (string): Nombre del candidato (primera letra mayúscula).
-apellidos (string): Apellidos del candidato (primera letra de cada apellido en mayúscula).
-experiencia_trabajo (list[string]): Experiencias laborales relevantes (resumen conciso de roles, empresas, etc.).
-educacion (list[string]): Experiencias académicas relevantes (grados, instituciones, etc.).
-apto (boolean): ¿Es apto para el puesto? (True/False).
-resumenCandidato (string, opcional): Resumen breve de fortalezas aplicadas al puesto (solo si es apto).
-puntuacionPuesto (integer): Puntuación de idoneidad general (0-10).
-razonesNoAptitud (string, opcional): Razones de no selección (solo si no es apto).
-porcentaje_experiencia (float, opcional): Porcentaje de contribución estimado de la experiencia.
-porcentaje_educacion (float, opcional): Porcentaje de contribución estimado de la educación.
-porcentaje_habilidades (float, opcional): Porcentaje de contribución estimado de las habilidades.
-porcentaje_idiomas (float, opcional): Porcentaje de contribución estimado de los idiomas.
-porcentaje_otros (float, opcional): Porcentaje de contribución estimado de otros factores.
+{DESCRIPCION_CAMPOS_RESULTADO}
 
 **Restricciones:**
 - El idioma del JSON debe ser siempre español.
-- La respuesta debe ser un objeto JSON válido, sin texto adicional.
+- {restriccion_formato}
 - La experiencia laboral y educación deben ser listas de strings con items concisos.
 - Asegúrate de que la respuesta sea directamente parseable como JSON y cumpla con el schema.
 """
 
+
+def construir_prompt_analisis(nombre_puesto, filtros):
+    """Prompt para evaluar un CV para un único puesto (respuesta: un objeto Resultado)."""
+    return componer_prompt(
+        f"Analiza el currículum de un candidato y determina su idoneidad para el puesto de {nombre_puesto}.",
+        construir_instrucciones_criterios(f"el puesto de {nombre_puesto}"),
+        construir_prompt_filtros(filtros),
+        "",
+        "Genera un objeto JSON puro con los siguientes campos:",
+        "La respuesta debe ser un objeto JSON válido, sin texto adicional."
+    )
+
+
+def construir_prompt_multipuesto(puestos, filtros):
+    """Prompt para evaluar un CV para varios puestos a la vez (respuesta: lista de ResultadoPuesto)."""
+    lista_puestos = "\n".join(f"   {i}. {puesto}" for i, puesto in enumerate(puestos, start=1))
+    return componer_prompt(
+        f"Analiza el currículum de un candidato y determina su idoneidad para cada uno de los siguientes {len(puestos)} puestos:\n{lista_puestos}",
+        construir_instrucciones_criterios("cada uno de los puestos"),
+        construir_prompt_filtros(filtros),
+        "9. Repite la evaluación de forma independiente para cada puesto: las subpuntuaciones y la aptitud de un puesto no deben influir en los demás.\n",
+        f"Genera una lista JSON con exactamente {len(puestos)} objetos, uno por puesto y en el mismo orden de la lista anterior. "
+        "Cada objeto incluye el campo puesto (string) con el nombre exacto del puesto evaluado, además de los siguientes campos:",
+        "La respuesta debe ser una lista JSON válida, sin texto adicional."
+    )
+
+
+def construir_prompt_multidocumento(nombre_puesto, num_documentos, filtros):
+    """Prompt para evaluar varios CVs para el mismo puesto (respuesta: lista de ResultadoDocumento)."""
+    return componer_prompt(
+        f"Analiza los {num_documentos} currículums adjuntos (documentos 1 a {num_documentos}, en el orden en que se adjuntan) "
+        f"y determina la idoneidad de cada candidato para el puesto de {nombre_puesto}.",
+        construir_instrucciones_criterios(f"el puesto de {nombre_puesto}"),
+        construir_prompt_filtros(filtros),
+        "9. Evalúa cada currículum de forma independiente: cada documento es un candidato distinto y la información de uno no debe influir en los demás.\n",
+        f"Genera una lista JSON con exactamente {num_documentos} objetos, uno por documento. "
+        "Cada objeto incluye el campo indice_documento (integer) con la posición del documento evaluado (empezando en 1), además de los siguientes campos:",
+        "La respuesta debe ser una lista JSON válida, sin texto adicional."
+    )
+
+
+@duracion_etapas.medir(etapa="parseo_validacion")
+def parsear_resultado(text, esquema=Resultado):
+    """
+    Parsea y valida la respuesta de un objeto Resultado (o subclase).
+    Devuelve el diccionario o None si no es válido.
+    """
+    # Intenta parsear directamente o usando la función auxiliar si es necesario
+    json_result = None
+    try:
+        json_result = json.loads(text)
+        # Opcional: Validar si el JSON cargado coincide con el schema
+        esquema(**json_result) # Esto lanzará un error si no coincide con el modelo
+    except (json.JSONDecodeError, Exception) as e:
+        print(f"Error al parsear JSON o validar schema de la respuesta de Gemini: {e}")
+        print(f"Texto recibido: {text}")
+        # Si falla el parsing directo, intenta con la función auxiliar (menos fiable)
+        json_result = pasarStringaJson(text)
+        if json_result:
+             try:
+                 esquema(**json_result) # Re-validar si el parsing auxiliar tuvo éxito
+             except Exception as e_validar_aux:
+                 print(f"Fallo de validación después de parsing auxiliar: {e_validar_aux}")
+                 return None # Fallo total
+        else:
+            return None # Fallo total en el parsing
+    return json_result
+
+
+@duracion_etapas.medir(etapa="parseo_validacion")
+def parsear_lista_resultados(text, esquema, cantidad):
+    """
+    Parsea y valida una respuesta que debe ser una lista de `cantidad` objetos del esquema.
+    Devuelve la lista de diccionarios o None si no es válida.
+    """
+    try:
+        inicio, fin = text.find("["), text.rfind("]") + 1
+        lista = json.loads(text[inicio:fin] if inicio != -1 and fin > inicio else text)
+        if not isinstance(lista, list) or len(lista) != cantidad:
+            print(f"Error: Se esperaban {cantidad} resultados en la respuesta y se recibieron {len(lista) if isinstance(lista, list) else 'ninguno'}.")
+            return None
+        for elemento in lista:
+            esquema(**elemento)
+        return lista
+    except Exception as e:
+        print(f"Error al parsear o validar la lista de resultados de la respuesta: {e}")
+        print(f"Texto recibido: {text}")
+        return None
+
+
+def separar_configuracion(configuracion):
+    """Divide la configuración de análisis (kwargs de process_pdf_ai) en filtros y pesos."""
+    filtros = {k: configuracion.get(k) for k in ("filtro_idioma", "filtro_experiencia_min", "filtro_palabras_clave", "filtro_nivel_educativo", "filtro_sector")}
+    pesos = {k: v for k, v in configuracion.items() if k.startswith("peso_")}
+    return filtros, pesos
+
+
+@duracion_etapas.medir(etapa="lectura_pdf")
+def leer_pdf(filepath_name):
+    """
+    Devuelve los bytes del PDF, tanto si se recibe una ruta como el propio
+    contenido (bytes o memoryview) o el stream del archivo subido.
+    """
+    if isinstance(filepath_name, (bytes, bytearray, memoryview)):
+        return bytes(filepath_name)
+    if hasattr(filepath_name, "read"):
+        filepath_name.seek(0)
+        return filepath_name.read()
+    file = pathlib.Path(filepath_name)
+    return file.read_bytes()
+
+
+# --- Puntuación local a partir de las subpuntuaciones ---
+# La puntuación final es la suma ponderada de las subpuntuaciones (0-10) con los
+# pesos normalizados; cambiar los pesos solo requiere repetir esta cuenta.
+
+CRITERIOS_EVALUACION = ("experiencia", "educacion", "habilidades", "idiomas", "otros")
+
+
+def calcular_puntuaciones(subpuntuaciones, pesos):
+    """
+    Suma ponderada vectorizada. `subpuntuaciones` es una matriz (CVs x criterios)
+    con valores 0-10 y `pesos` un vector de pesos por criterio. Devuelve las
+    puntuaciones (0-10) y la contribución de cada criterio en porcentaje.
+    """
+    pesos = np.asarray(pesos, dtype=float)
+    if pesos.sum() <= 0:
+        pesos = np.ones_like(pesos) # Sin pesos válidos: todos los criterios cuentan igual
+    ponderadas = np.clip(subpuntuaciones, 0, 10) * (pesos / pesos.sum())
+    puntuaciones = ponderadas.sum(axis=1)
+    divisor = np.where(puntuaciones > 0, puntuaciones, 1.0)[:, None]
+    contribuciones = np.where(puntuaciones[:, None] > 0, ponderadas / divisor * 100, 0.0)
+    return puntuaciones, contribuciones
+
+
+def puntuar_resultados(resultados, pesos, umbral=UMBRAL_APTO):
+    """
+    Recalcula puntuacionPuesto, apto y porcentaje_* de los resultados que traen
+    todas las subpuntuaciones (el resto, como los prefiltrados o los errores, se
+    devuelven sin cambios). No modifica los diccionarios recibidos.
+    """
+    campos = [f"subpuntuacion_{criterio}" for criterio in CRITERIOS_EVALUACION]
+    indices = [
+        i for i, resultado in enumerate(resultados)
+        if isinstance(resultado, dict) and all(isinstance(resultado.get(campo), (int, float)) for campo in campos)
+    ]
+    if not indices:
+        return list(resultados)
+    matriz = np.array([[resultados[i][campo] for campo in campos] for i in indices], dtype=float)
+    vector_pesos = [float(pesos.get(f"peso_{criterio}") or 0) for criterio in CRITERIOS_EVALUACION]
+    puntuaciones, contribuciones = calcular_puntuaciones(matriz, vector_pesos)
+
+    salida = list(resultados)
+    for fila, i in enumerate(indices):
+        resultado = dict(resultados[i])
+        resultado["puntuacionPonderada"] = round(float(puntuaciones[fila]), 2)
+        resultado["puntuacionPuesto"] = int(round(float(puntuaciones[fila])))
+        resultado["apto"] = bool(puntuaciones[fila] >= umbral) and resultado.get("cumpleFiltros") is not False
+        for criterio, contribucion in zip(CRITERIOS_EVALUACION, contribuciones[fila]):
+            resultado[f"porcentaje_{criterio}"] = round(float(contribucion), 1)
+        salida[i] = resultado
+    return salida
+
+
+def puntuar_resultado(resultado, pesos, umbral=UMBRAL_APTO):
+    """Versión de puntuar_resultados para un único resultado."""
+    return puntuar_resultados([resultado], pesos, umbral)[0]
+
+
+# Pesos por defecto del formulario, usados para las ejecuciones del historial que no guardaron los suyos
+PESOS_POR_DEFECTO = {"peso_experiencia": 35.0, "peso_educacion": 30.0, "peso_habilidades": 20.0, "peso_idiomas": 10.0, "peso_otros": 5.0}
+
+
+def reordenar_resultados(resultados, pesos_nuevos, pesos_anteriores, umbral=UMBRAL_APTO):
+    """
+    Recalcula la puntuación de los candidatos de una ejecución guardada con otros
+    pesos y devuelve el nuevo ranking con la variación de posición de cada uno.
+
+    Si el resultado trae subpuntuaciones se usan directamente. En los resultados
+    antiguos se reconstruyen a partir de porcentaje_* (contribución de cada
+    criterio), la puntuación guardada y los pesos con los que se obtuvo:
+    subpuntuacion_i = porcentaje_i / suma(porcentajes) * puntuacion * suma(pesos) / peso_i.
+    Los porcentajes se normalizan por fila porque el historial los tiene en escalas
+    distintas (filas que suman ~1, ~50 o ~100); las filas que suman 0 se omiten.
+    Como en puntuar_resultados, un candidato que no cumplía los filtros nunca es apto.
+    """
+    campos_sub = [f"subpuntuacion_{criterio}" for criterio in CRITERIOS_EVALUACION]
+    campos_porcentaje = [f"porcentaje_{criterio}" for criterio in CRITERIOS_EVALUACION]
+    campos_numericos = ["puntuacionPuesto", "puntuacionPonderada"] + campos_sub + campos_porcentaje
+
+    def numero(valor):
+        return float(valor) if isinstance(valor, (int, float)) and not isinstance(valor, bool) else np.nan
+
+    # Solo se extraen las columnas necesarias (los resultados traen además listas y textos largos)
+    indices = [i for i, resultado in enumerate(resultados) if isinstance(resultado, dict) and 'error' not in resultado]
+    valores = [[resultados[i].get(campo) for campo in campos_numericos] for i in indices]
+    try:
+        matriz = np.array(valores, dtype=float).reshape(len(indices), len(campos_numericos)) # None -> NaN
+    except (TypeError, ValueError):
+        matriz = np.array([[numero(v) for v in fila] for fila in valores], dtype=float).reshape(len(indices), len(campos_numericos))
+    df = pd.DataFrame(matriz, columns=campos_numericos)
+    df.insert(0, "indice", indices)
+    df.insert(1, "nombre", [resultados[i].get("nombre") or "" for i in indices])
+    df.insert(2, "apellidos", [resultados[i].get("apellidos") or "" for i in indices])
+    # Igual que en puntuar_resultados: sin el dato se considera que cumple los filtros
+    df["cumpleFiltros"] = [resultados[i].get("cumpleFiltros") is not False for i in indices]
+    df["puntuacion_anterior"] = df["puntuacionPonderada"].fillna(df["puntuacionPuesto"])
+
+    # Subpuntuaciones reconstruidas para los resultados que no las traen
+    anteriores = np.array([float(pesos_anteriores.get(f"peso_{criterio}") or 0) for criterio in CRITERIOS_EVALUACION])
+    porcentajes = df[campos_porcentaje].to_numpy(dtype=float)
+    sumas = porcentajes.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fracciones = np.where(sumas > 0, porcentajes / sumas, np.nan) # Suma 0 o incompleta: no se puede reconstruir
+        reconstruidas = fracciones * df["puntuacion_anterior"].to_numpy(dtype=float)[:, None] * anteriores.sum() / anteriores
+    reconstruidas = np.where(anteriores > 0, reconstruidas, 0.0) # Criterio sin peso: no aportaba información
+    subpuntuaciones = df[campos_sub].to_numpy(dtype=float)
+    tiene_sub = ~np.isnan(subpuntuaciones).any(axis=1)
+    subpuntuaciones = np.where(tiene_sub[:, None], subpuntuaciones, reconstruidas)
+    validas = ~np.isnan(subpuntuaciones).any(axis=1)
+
+    df = df[validas].copy()
+    puntuaciones, _ = calcular_puntuaciones(
+        subpuntuaciones[validas],
+        [float(pesos_nuevos.get(f"peso_{criterio}") or 0) for criterio in CRITERIOS_EVALUACION]
+    )
+    df["fuente"] = np.where(tiene_sub[validas], "subpuntuaciones", "porcentajes")
+    df["puntuacion"] = puntuaciones.round(2)
+    df["apto"] = (puntuaciones >= umbral) & df["cumpleFiltros"].to_numpy(dtype=bool)
+    df["posicion_anterior"] = df["puntuacion_anterior"].rank(method="first", ascending=False).astype(int)
+    df["posicion"] = df["puntuacion"].rank(method="first", ascending=False).astype(int)
+    df["variacion"] = df["posicion_anterior"] - df["posicion"] # Positivo: sube en el ranking
+    df = df.sort_values("posicion")
+
+    ranking = df[["posicion", "posicion_anterior", "variacion", "indice", "nombre", "apellidos", "puntuacion_anterior", "puntuacion", "apto", "fuente"]]
+    return ranking.to_dict(orient="records"), len(resultados) - len(ranking)
+
+
+# --- Función de procesamiento AI (MODIFICADA para aceptar pesos) ---
+def process_pdf_ai(
+    filepath_name,
+    nombre_puesto,
+    filtro_idioma=None,
+    filtro_experiencia_min=None,
+    filtro_palabras_clave=None,
+    filtro_nivel_educativo=None,
+    filtro_sector=None,
+    # NUEVO: Pesos recibidos del frontend
+    peso_experiencia=40,
+    peso_educacion=30,
+    peso_habilidades=20,
+    peso_idiomas=5,
+    peso_otros=5
+):
+    """
+    Procesa un PDF usando Google Gemini con filtros y pesos de evaluación personalizables.
+    `filepath_name` puede ser la ruta del PDF o directamente su contenido en bytes.
+    Devuelve el resultado estructurado o None en caso de error.
+    """
+    pdf_bytes = leer_pdf(filepath_name)
+    filtros = {
+        "filtro_idioma": filtro_idioma,
+        "filtro_experiencia_min": filtro_experiencia_min,
+        "filtro_palabras_clave": filtro_palabras_clave,
+        "filtro_nivel_educativo": filtro_nivel_educativo,
+        "filtro_sector": filtro_sector,
+    }
+    pesos = {
+        "peso_experiencia": peso_experiencia,
+        "peso_educacion": peso_educacion,
+        "peso_habilidades": peso_habilidades,
+        "peso_idiomas": peso_idiomas,
+        "peso_otros": peso_otros,
+    }
+
+    # Consultar la caché antes de gastar una llamada a Gemini
+    clave_cache = clave_cache_resultado(pdf_bytes, nombre_puesto, filtros, motor_llm.modelo if motor_llm else MODELO_GEMINI)
+    resultado_cacheado = cache_resultados.obtener(clave_cache)
+    if resultado_cacheado is not None:
+        return puntuar_resultado(con_uso(resultado_cacheado, uso_sin_llamada("cache")), pesos)
+
+    # Los CVs que incumplen claramente un filtro no llegan al modelo
+    resultado_prefiltro = aplicar_prefiltro(pdf_bytes, filtros)
+    if resultado_prefiltro is not None:
+        return resultado_prefiltro
+
+    if motor_llm is None:
+        print("Error: Cliente de Google GenAI no inicializado. La API no está disponible.")
+        return None
+
+    # Construir el prompt dinámicamente con los filtros (los pesos se aplican después, en local)
+    prompt = construir_prompt_analisis(nombre_puesto, filtros)
+
     try:
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[
-                types.Part.from_bytes(
-                    data=pdf_bytes,
-                    mime_type='application/pdf',
-                ),
-                prompt
-            ],
-            # Usando response_mime_type y response_schema, Gemini debería devolver JSON directo
-            config={'response_mime_type': 'application/json',
-                    'response_schema': Resultado} # Usamos el schema Resultado
+        # La llamada pasa por el limitador compartido (cuotas, concurrencia AIMD y reintentos)
+        # PDFs con capa de texto: se puede enviar solo el texto extraído (si está activado)
+        documentos = [preparar_documento(pdf_bytes)]
+        tokens_estimados = estimar_tokens_entrada(prompt, documentos)
+        response = limitador_gemini.ejecutar(
+            lambda: motor_llm.generar(documentos, prompt, Resultado), # Usamos el schema Resultado
+            tokens_estimados
         )
+        registrar_envio([pdf_bytes], documentos, tokens_estimados, response)
 
         # Intentar obtener el texto crudo y parsearlo por seguridad,
         # aunque response_mime_type y response_schema deberían dar un JSON string.
-        text = response.text
+        text = response.texto
         # print(f"Respuesta cruda de Gemini: {text}") # Para depuración
 
-        # Intenta parsear directamente o usando la función auxiliar si es necesario
-        json_result = None
-        try:
-            json_result = json.loads(text)
-            # Opcional: Validar si el JSON cargado coincide con el schema
-            Resultado(**json_result) # Esto lanzará un error si no coincide con el modelo
-        except (json.JSONDecodeError, Exception) as e:
-            print(f"Error al parsear JSON o validar schema de la respuesta de Gemini: {e}")
-            print(f"Texto recibido: {text}")
-            # Si falla el parsing directo, intenta con la función auxiliar (menos fiable)
-            json_result = pasarStringaJson(text)
-            if json_result:
-                 try:
-                     Resultado(**json_result) # Re-validar si el parsing auxiliar tuvo éxito
-                 except Exception as e_validar_aux:
-                     print(f"Fallo de validación después de parsing auxiliar: {e_validar_aux}")
-                     return None # Fallo total
-            else:
-                return None # Fallo total en el parsing
-
-        return json_result
+        json_result = parsear_resultado(text)
+        if json_result is None:
+            return None # Fallo total en el parsing o la validación
+
+        # Solo se cachean resultados válidos (sin ponderar, para reutilizarlos con cualquier peso)
+        cache_resultados.guardar(clave_cache, json_result)
+        return puntuar_resultado(con_uso(json_result, uso_de_respuesta(response)), pesos)
 
+    except CircuitoAbiertoError:
+        raise # Fallo rápido: quien llama responde 503 en lugar de un error de análisis
     except Exception as e:
         print(f"Error llamando a la API de Gemini: {e}")
         # Considerar devolver un objeto de error estructurado para manejo en frontend
@@ -257,31 +2146,356 @@ porcentaje_otros (float, opcional): Porcentaje de contribución estimado de otro
         return None # Devolver None para indicar fallo en el procesamiento
 
 
+def process_pdf_ai_multipuesto(
+    filepath_name,
+    puestos,
+    filtro_idioma=None,
+    filtro_experiencia_min=None,
+    filtro_palabras_clave=None,
+    filtro_nivel_educativo=None,
+    filtro_sector=None,
+    peso_experiencia=40,
+    peso_educacion=30,
+    peso_habilidades=20,
+    peso_idiomas=5,
+    peso_otros=5
+):
+    """
+    Evalúa un mismo CV para varios puestos con una sola llamada al modelo (el PDF
+    y las instrucciones se envían una vez). Devuelve una lista de resultados, uno
+    por puesto y en el mismo orden, cada uno con el campo 'puesto'; o None si falla.
+    Los puestos ya cacheados (también por /procesar_pdf) no se vuelven a pedir.
+    """
+    pdf_bytes = leer_pdf(filepath_name)
+    filtros = {
+        "filtro_idioma": filtro_idioma,
+        "filtro_experiencia_min": filtro_experiencia_min,
+        "filtro_palabras_clave": filtro_palabras_clave,
+        "filtro_nivel_educativo": filtro_nivel_educativo,
+        "filtro_sector": filtro_sector,
+    }
+    pesos = {
+        "peso_experiencia": peso_experiencia,
+        "peso_educacion": peso_educacion,
+        "peso_habilidades": peso_habilidades,
+        "peso_idiomas": peso_idiomas,
+        "peso_otros": peso_otros,
+    }
+    modelo = motor_llm.modelo if motor_llm else MODELO_GEMINI
+
+    # Cada puesto comparte la entrada de caché de una evaluación individual
+    claves = {puesto: clave_cache_resultado(pdf_bytes, puesto, filtros, modelo) for puesto in puestos}
+    resultados = {}
+    for puesto in puestos:
+        cacheado = cache_resultados.obtener(claves[puesto])
+        if cacheado is not None:
+            resultados[puesto] = {**cacheado, "puesto": puesto, "uso_modelo": uso_sin_llamada("cache")}
+    pendientes = [puesto for puesto in puestos if puesto not in resultados]
+
+    # Los filtros son comunes a todos los puestos: si el CV los incumple, es no apto para todos
+    resultado_prefiltro = aplicar_prefiltro(pdf_bytes, filtros) if pendientes else None
+    if resultado_prefiltro is not None:
+        for puesto in pendientes:
+            resultados[puesto] = {**resultado_prefiltro, "puesto": puesto}
+        pendientes = []
+
+    if pendientes:
+        if motor_llm is None:
+            print("Error: Cliente de Google GenAI no inicializado. La API no está disponible.")
+            return None
+
+        prompt = construir_prompt_multipuesto(pendientes, filtros)
+        documentos = [preparar_documento(pdf_bytes)]
+        tokens_estimados = estimar_tokens_entrada(prompt, documentos)
+        try:
+            response = limitador_gemini.ejecutar(
+                lambda: motor_llm.generar(documentos, prompt, List[ResultadoPuesto], num_resultados=len(pendientes)),
+                tokens_estimados
+            )
+            registrar_envio([pdf_bytes], documentos, tokens_estimados, response)
+        except CircuitoAbiertoError:
+            raise
+        except Exception as e:
+            print(f"Error llamando a la API de Gemini: {e}")
+            return None
+
+        lista = parsear_lista_resultados(response.texto, ResultadoPuesto, len(pendientes))
+        if lista is None:
+            return None
+
+        # Asociar cada objeto a su puesto por nombre; si el modelo lo alteró, por posición
+        por_nombre = {str(elemento.get("puesto", "")).strip().lower(): elemento for elemento in lista}
+        uso = uso_de_respuesta(response, len(pendientes))
+        for posicion, puesto in enumerate(pendientes):
+            elemento = por_nombre.get(puesto.strip().lower(), lista[posicion])
+            elemento = {**elemento, "puesto": puesto}
+            cache_resultados.guardar(claves[puesto], {k: v for k, v in elemento.items() if k != "puesto"})
+            resultados[puesto] = con_uso(elemento, uso)
+
+    return puntuar_resultados([resultados[puesto] for puesto in puestos], pesos)
+
+
+# --- Micro-lotes: varios CVs por petición al modelo ---
+# El bloque de instrucciones del prompt suele costar más tokens que un CV de 1-2
+# páginas. Cuando llegan análisis simultáneos con la misma configuración (mismo
+# puesto y filtros), se agrupan durante una ventana corta (o hasta N
+# documentos) y se envían en una única petición con un esquema de lista. Si la
+# respuesta combinada no es válida, cada CV se analiza por separado.
+
+class MicroLoteador:
+    """Agrupa análisis con la misma configuración y los resuelve con una sola llamada."""
+
+    def __init__(self, ventana_segundos, max_documentos, plazo_segundos=None):
+        self.ventana_segundos = ventana_segundos
+        self.max_documentos = max_documentos
+        self.plazo_segundos = plazo_segundos # Espera máxima de cada petición por su resultado (None: sin límite)
+        self.lotes_combinados = 0
+        self.documentos_combinados = 0
+        self.lotes_fallidos = 0
+        self._grupos = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=GEMINI_CONCURRENCIA_MAX, thread_name_prefix="microlote")
+
+    def enviar(self, pdf_bytes, nombre_puesto, configuracion):
+        """Analiza un CV (bloqueando hasta tener el resultado) agrupándolo con otros si es posible."""
+        filtros, pesos = separar_configuracion(configuracion)
+        clave_cache = clave_cache_resultado(pdf_bytes, nombre_puesto, filtros, motor_llm.modelo if motor_llm else MODELO_GEMINI)
+        cacheado = cache_resultados.obtener(clave_cache)
+        if cacheado is not None:
+            return puntuar_resultado(con_uso(cacheado, uso_sin_llamada("cache")), pesos)
+        resultado_prefiltro = aplicar_prefiltro(pdf_bytes, filtros)
+        if resultado_prefiltro is not None:
+            return resultado_prefiltro
+
+        # Los pesos no cambian la petición al modelo: se agrupan CVs con el mismo puesto y
+        # filtros (y la misma clase de prioridad, para que un lote no retrase a un interactivo)
+        prioridad = prioridad_actual.get()
+        clave_grupo = json.dumps([nombre_puesto, filtros, prioridad], sort_keys=True, ensure_ascii=False)
+        futuro = Future()
+        with self._lock:
+            grupo = self._grupos.get(clave_grupo)
+            if grupo is None:
+                grupo = {"puesto": nombre_puesto, "configuracion": configuracion, "prioridad": prioridad, "elementos": []}
+                grupo["temporizador"] = threading.Timer(self.ventana_segundos, self._cerrar_grupo, args=(clave_grupo, grupo))
+                grupo["temporizador"].daemon = True
+                self._grupos[clave_grupo] = grupo
+                grupo["temporizador"].start()
+            grupo["elementos"].append((pdf_bytes, clave_cache, futuro))
+            lleno = len(grupo["elementos"]) >= self.max_documentos
+        if lleno:
+            self._cerrar_grupo(clave_grupo, grupo)
+        try:
+            resultado = futuro.result(timeout=self.plazo_segundos)
+        except TimeoutError:
+            raise PlazoExcedidoError(f"El análisis en micro-lote superó el plazo de {self.plazo_segundos:g} s")
+        # Cada petición aplica sus propios pesos sobre las subpuntuaciones del grupo
+        return puntuar_resultado(resultado, pesos) if resultado is not None else None
+
+    def _cerrar_grupo(self, clave_grupo, grupo):
+        """Saca el grupo de la espera (por ventana agotada o por estar lleno) y lo procesa."""
+        with self._lock:
+            if self._grupos.get(clave_grupo) is not grupo:
+                return # Ya se cerró por el otro motivo
+            del self._grupos[clave_grupo]
+        grupo["temporizador"].cancel()
+        try:
+            self._executor.submit(en_prioridad, grupo["prioridad"], self._procesar_grupo, grupo)
+        except Exception as e:
+            self._fallar_pendientes(grupo["elementos"], e)
+
+    @staticmethod
+    def _fallar_pendientes(elementos, error):
+        """Resuelve con `error` los futuros del grupo que sigan pendientes, para no dejar peticiones bloqueadas."""
+        for _, _, futuro in elementos:
+            try:
+                futuro.set_exception(error)
+            except InvalidStateError:
+                pass # Ya tenía resultado
+
+    def _analizar_individual(self, pdf_bytes, futuro, nombre_puesto, configuracion):
+        try:
+            futuro.set_result(process_pdf_ai(pdf_bytes, nombre_puesto, **configuracion))
+        except CircuitoAbiertoError as e:
+            futuro.set_exception(e)
+        except Exception as e:
+            print(f"Error inesperado en el análisis individual del micro-lote: {e}")
+            futuro.set_result(None)
+
+    def _procesar_grupo(self, grupo):
+        try:
+            self._procesar_grupo_pendiente(grupo)
+        except Exception as e:
+            print(f"Error inesperado procesando un micro-lote de {len(grupo['elementos'])} CVs: {e}")
+            self._fallar_pendientes(grupo["elementos"], e)
+
+    def _procesar_grupo_pendiente(self, grupo):
+        elementos = grupo["elementos"]
+        nombre_puesto, configuracion = grupo["puesto"], grupo["configuracion"]
+        if len(elementos) == 1:
+            pdf_bytes, _, futuro = elementos[0]
+            self._analizar_individual(pdf_bytes, futuro, nombre_puesto, configuracion)
+            return
+
+        resultados = None
+        if motor_llm is not None:
+            try:
+                resultados = self._analizar_combinado(elementos, nombre_puesto, configuracion)
+            except CircuitoAbiertoError as e:
+                # Con el circuito abierto tampoco se prueban las llamadas individuales
+                for _, _, futuro in elementos:
+                    futuro.set_exception(e)
+                return
+        if resultados is None:
+            # Respuesta combinada inválida: volver a las llamadas individuales
+            with self._lock:
+                self.lotes_fallidos += 1
+            for pdf_bytes, _, futuro in elementos:
+                self._executor.submit(en_prioridad, grupo["prioridad"], self._analizar_individual, pdf_bytes, futuro, nombre_puesto, configuracion)
+            return
+
+        with self._lock:
+            self.lotes_combinados += 1
+            self.documentos_combinados += len(elementos)
+        for (_, clave_cache, futuro), resultado in zip(elementos, resultados):
+            uso = resultado.pop("uso_modelo")
+            cache_resultados.guardar(clave_cache, resultado)
+            futuro.set_result(con_uso(resultado, uso))
+
+    def _analizar_combinado(self, elementos, nombre_puesto, configuracion):
+        """Una petición con todos los documentos. Devuelve los resultados en orden o None."""
+        filtros, _ = separar_configuracion(configuracion)
+        pdfs = [pdf_bytes for pdf_bytes, _, _ in elementos]
+        documentos = [preparar_documento(pdf_bytes) for pdf_bytes in pdfs]
+        prompt = construir_prompt_multidocumento(nombre_puesto, len(documentos), filtros)
+        tokens_estimados = estimar_tokens_entrada(prompt, documentos)
+        try:
+            response = limitador_gemini.ejecutar(
+                lambda: motor_llm.generar(documentos, prompt, List[ResultadoDocumento], num_resultados=len(documentos)),
+                tokens_estimados
+            )
+            registrar_envio(pdfs, documentos, tokens_estimados, response)
+        except CircuitoAbiertoError:
+            raise
+        except Exception as e:
+            print(f"Error llamando a la API de Gemini con un micro-lote de {len(documentos)} CVs: {e}")
+            return None
+
+        lista = parsear_lista_resultados(response.texto, ResultadoDocumento, len(documentos))
+        if lista is None:
+            return None
+        por_indice = {elemento.get("indice_documento"): elemento for elemento in lista}
+        if sorted(por_indice) != list(range(1, len(documentos) + 1)):
+            print(f"Error: Los índices de documento de la respuesta combinada no son válidos: {sorted(por_indice)}")
+            return None
+        uso = uso_de_respuesta(response, len(documentos))
+        return [
+            con_uso({k: v for k, v in por_indice[i].items() if k != "indice_documento"}, uso)
+            for i in range(1, len(documentos) + 1)
+        ]
+
+    def estadisticas(self):
+        """Devuelve los contadores de micro-lotes."""
+        with self._lock:
+            return {
+                "activado": MICROLOTES_ACTIVADOS,
+                "lotes_combinados": self.lotes_combinados,
+                "documentos_combinados": self.documentos_combinados,
+                "lotes_fallidos": self.lotes_fallidos,
+                "grupos_en_espera": len(self._grupos),
+            }
+
+
+# Cada petición espera como mucho la ventana más dos plazos de llamada al modelo: la
+# combinada y, si su respuesta no es válida, la individual de respaldo
+microloteador = MicroLoteador(
+    MICROLOTES_VENTANA_MS / 1000.0, MICROLOTES_MAX_DOCUMENTOS,
+    MICROLOTES_VENTANA_MS / 1000.0 + 2 * LLAMADA_PLAZO_SEGUNDOS if LLAMADA_PLAZO_SEGUNDOS > 0 else None
+)
+
+
+def analizar_cv(pdf, nombre_puesto, configuracion):
+    """
+    Punto de entrada común de los endpoints de análisis: usa los micro-lotes si
+    están activados y, si no, llama directamente a process_pdf_ai.
+    """
+    if MICROLOTES_ACTIVADOS:
+        return microloteador.enviar(leer_pdf(pdf), nombre_puesto, configuracion)
+    return process_pdf_ai(pdf, nombre_puesto, **configuracion)
+
+
 # --- Endpoints de la API ---
 
-# El endpoint /procesar_pdf es MODIFICADO para recibir los pesos
-@app.route('/procesar_pdf', methods=['POST'])
-def procesar_pdf_route():
+@app.before_request
+def recibir_subida():
+    """Lee el cuerpo multipart (archivos subidos) midiendo la etapa de recepción."""
+    if request.mimetype == "multipart/form-data":
+        with duracion_etapas.medir(etapa="recepcion_subida"):
+            request.files
+
+
+# Endpoints cuyo tráfico es masivo por defecto; el resto son interactivos
+ENDPOINTS_MASIVOS = {"procesar_lote_route", "procesar_lote_eventos_route"}
+
+
+@app.before_request
+def asignar_prioridad():
     """
-    Recibe un archivo PDF, puesto, filtros y pesos, y lo procesa usando AI.
+    Fija la clase de prioridad de la petición: la del endpoint, salvo que el cliente
+    indique otra en la cabecera X-Prioridad ('interactiva' o 'masiva').
     """
-    if 'pdf' not in request.files:
-        return jsonify({'error': 'No se encontró el archivo PDF'}), 400
+    prioridad = request.headers.get("X-Prioridad", "").strip().lower()
+    if prioridad not in PESOS_PRIORIDAD:
+        prioridad = PRIORIDAD_MASIVA if request.endpoint in ENDPOINTS_MASIVOS else PRIORIDAD_INTERACTIVA
+    prioridad_actual.set(prioridad)
 
-    pdf_file = request.files['pdf']
-    nombre_puesto = request.form.get('puesto')
 
+@app.errorhandler(413)
+def peticion_demasiado_grande(e):
+    """Respuesta JSON cuando el cuerpo supera el tamaño máximo (se corta antes de leerlo)."""
+    if request.endpoint in ENDPOINTS_MASIVOS:
+        return jsonify({'error': f'El lote enviado supera el tamaño máximo permitido ({MAX_TAMANO_LOTE_MB} MB); envíalo en varias partes'}), 413
+    return jsonify({'error': f'El archivo enviado supera el tamaño máximo permitido ({MAX_TAMANO_PETICION_MB} MB)'}), 413
+
+
+@app.errorhandler(CircuitoAbiertoError)
+def circuito_abierto(e):
+    """Fallo rápido con el circuito del modelo abierto: 503 con la espera recomendada en Retry-After."""
+    respuesta = jsonify({'error': str(e), 'reintentar_en': e.reintentar_en})
+    respuesta.headers['Retry-After'] = str(e.reintentar_en)
+    return respuesta, 503
+
+
+def limpiar_temporales_huerfanos():
+    """
+    Elimina los archivos temp_cv_* que versiones anteriores del backend dejaban
+    junto al script cuando el proceso terminaba a mitad de un análisis.
+    """
+    for ruta in pathlib.Path(__file__).parent.glob("temp_cv_*"):
+        try:
+            ruta.unlink()
+            print(f"Eliminado archivo temporal huérfano: {ruta.name}")
+        except OSError as e:
+            print(f"Advertencia: No se pudo eliminar el archivo temporal {ruta}: {e}")
+
+
+def obtener_configuracion_analisis(form):
+    """
+    Extrae del formulario los filtros y pesos de evaluación comunes a todos los
+    endpoints de análisis. Devuelve un diccionario listo para pasar a process_pdf_ai.
+    """
     # Obtener filtros
-    filtro_idioma = request.form.get('filtro_idioma')
-    filtro_experiencia_min_str = request.form.get('filtro_experiencia_min')
-    filtro_experiencia_min = int(filtro_experiencia_min_str) if filtro_experiencia_min_str and filtro_experiencia_min_str.isdigit() else None
-    filtro_palabras_clave = request.form.get('filtro_palabras_clave')
-    filtro_nivel_educativo = request.form.get('filtro_nivel_educativo')
-    filtro_sector = request.form.get('filtro_sector')
-
-    # NUEVO: Obtener pesos del formulario. Usar get con valor por defecto si no vienen o son inválidos
+    filtro_experiencia_min_str = form.get('filtro_experiencia_min')
+    configuracion = {
+        "filtro_idioma": form.get('filtro_idioma'),
+        "filtro_experiencia_min": int(filtro_experiencia_min_str) if filtro_experiencia_min_str and filtro_experiencia_min_str.isdigit() else None,
+        "filtro_palabras_clave": form.get('filtro_palabras_clave'),
+        "filtro_nivel_educativo": form.get('filtro_nivel_educativo'),
+        "filtro_sector": form.get('filtro_sector'),
+    }
+
+    # Obtener pesos del formulario. Usar get con valor por defecto si no vienen o son inválidos
     def get_peso(key, default=0):
-        value_str = request.form.get(key)
+        value_str = form.get(key)
         if value_str is None or value_str == '':
             return default # Usa el valor por defecto si no se proporciona o está vacío
         try:
@@ -291,12 +2505,26 @@ def procesar_pdf_route():
             print(f"Advertencia: Peso inválido para {key}: '{value_str}'. Usando por defecto {default}.")
             return default # Usa el valor por defecto si no es un número válido
 
-    peso_experiencia = get_peso('peso_experiencia', 35.0) # Usar float por defecto
-    peso_educacion = get_peso('peso_educacion', 30.0)
-    peso_habilidades = get_peso('peso_habilidades', 20.0)
-    peso_idiomas = get_peso('peso_idiomas', 10.0)
-    peso_otros = get_peso('peso_otros', 5.0)
+    configuracion["peso_experiencia"] = get_peso('peso_experiencia', 35.0) # Usar float por defecto
+    configuracion["peso_educacion"] = get_peso('peso_educacion', 30.0)
+    configuracion["peso_habilidades"] = get_peso('peso_habilidades', 20.0)
+    configuracion["peso_idiomas"] = get_peso('peso_idiomas', 10.0)
+    configuracion["peso_otros"] = get_peso('peso_otros', 5.0)
+    return configuracion
+
 
+# El endpoint /procesar_pdf es MODIFICADO para recibir los pesos
+@app.route('/procesar_pdf', methods=['POST'])
+def procesar_pdf_route():
+    """
+    Recibe un archivo PDF, puesto, filtros y pesos, y lo procesa usando AI.
+    """
+    if 'pdf' not in request.files:
+        return jsonify({'error': 'No se encontró el archivo PDF'}), 400
+
+    pdf_file = request.files['pdf']
+    nombre_puesto = request.form.get('puesto')
+    configuracion = obtener_configuracion_analisis(request.form)
 
     if pdf_file.filename == '':
         return jsonify({'error': 'Nombre de archivo PDF inválido'}), 400
@@ -304,29 +2532,10 @@ def procesar_pdf_route():
     if not nombre_puesto:
         return jsonify({'error': 'No se especificó el puesto de trabajo'}), 400
 
-    filepath = None
     try:
-        # Guardar archivo temporal
-        # Usar un nombre más robusto para el archivo temporal
-        temp_filename = f"temp_cv_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{pdf_file.filename.replace(' ', '_').replace('/', '_').replace('\\', '_')}"
-        filepath = os.path.join(pathlib.Path(__file__).parent, temp_filename) # Guardar en el directorio del script
-        pdf_file.save(filepath)
-
-        # Llamar a process_pdf_ai con todos los parámetros, incluyendo los pesos
-        resultado = process_pdf_ai(
-            filepath,
-            nombre_puesto,
-            filtro_idioma,
-            filtro_experiencia_min,
-            filtro_palabras_clave,
-            filtro_nivel_educativo,
-            filtro_sector,
-            peso_experiencia, # Pasar los pesos
-            peso_educacion,
-            peso_habilidades,
-            peso_idiomas,
-            peso_otros
-        )
+        # Analizar con todos los parámetros, incluyendo los pesos (directo o en micro-lote).
+        # El PDF se pasa directamente desde el búfer de la subida, sin guardarlo en disco
+        resultado = analizar_cv(pdf_file.stream, nombre_puesto, configuracion)
 
         if resultado:
             # Validar el resultado con el modelo Pydantic antes de enviar al frontend
@@ -341,21 +2550,281 @@ def procesar_pdf_route():
             print("El procesamiento AI devolvió None.")
             return jsonify({'error': 'Error interno o de API al procesar el PDF con AI'}), 500
 
+    except CircuitoAbiertoError:
+        raise # Lo convierte en 503 el manejador de errores del circuito
     except Exception as e:
         print(f"Error inesperado en la ruta /procesar_pdf (antes de llamar a process_pdf_ai): {e}")
         return jsonify({'error': f'Error inesperado al procesar el PDF: {e}'}), 500
+
+
+# Endpoint multipuesto: un CV evaluado para varios puestos en una sola llamada al modelo
+@app.route('/procesar_pdf_multipuesto', methods=['POST'])
+def procesar_pdf_multipuesto_route():
+    """
+    Recibe un PDF, varios puestos (campo 'puestos' repetido), filtros y pesos, y
+    devuelve una lista de resultados, uno por puesto.
+    """
+    if 'pdf' not in request.files:
+        return jsonify({'error': 'No se encontró el archivo PDF'}), 400
+
+    pdf_file = request.files['pdf']
+    # Quitar vacíos y duplicados manteniendo el orden
+    puestos = list(dict.fromkeys(p.strip() for p in request.form.getlist('puestos') if p and p.strip()))
+    configuracion = obtener_configuracion_analisis(request.form)
+
+    if pdf_file.filename == '':
+        return jsonify({'error': 'Nombre de archivo PDF inválido'}), 400
+
+    if not puestos:
+        return jsonify({'error': 'No se especificaron puestos de trabajo'}), 400
+
+    try:
+        resultados = process_pdf_ai_multipuesto(pdf_file.read(), puestos, **configuracion)
+        if resultados is None:
+            print("El procesamiento AI multipuesto devolvió None.")
+            return jsonify({'error': 'Error interno o de API al procesar el PDF con AI'}), 500
+        return jsonify({'resultados': resultados}), 200
+    except CircuitoAbiertoError:
+        raise
+    except Exception as e:
+        print(f"Error inesperado en la ruta /procesar_pdf_multipuesto: {e}")
+        return jsonify({'error': f'Error inesperado al procesar el PDF: {e}'}), 500
+
+
+# --- Procesamiento por lotes ---
+# Mismo puesto/filtros/pesos para muchos PDFs. Los CVs se reparten en un pool de
+# hilos y los resultados se devuelven según terminan, en NDJSON (/procesar_lote)
+# o como Server-Sent Events con información de progreso (/procesar_lote/eventos).
+
+def leer_peticion_lote():
+    """
+    Valida y extrae los datos comunes de una petición de lote.
+    Devuelve (documentos, nombre_puesto, configuracion, concurrencia, None) o,
+    si la petición no es válida, (None, None, None, None, respuesta_error).
+    """
+    pdf_files = request.files.getlist('pdfs')
+    nombre_puesto = request.form.get('puesto')
+    configuracion = obtener_configuracion_analisis(request.form)
+
+    if not pdf_files:
+        return None, None, None, None, (jsonify({'error': 'No se encontraron archivos PDF en el campo "pdfs"'}), 400)
+
+    if not nombre_puesto:
+        return None, None, None, None, (jsonify({'error': 'No se especificó el puesto de trabajo'}), 400)
+
+    concurrencia_str = request.form.get('concurrencia')
+    concurrencia = LOTE_MAX_CONCURRENCIA
+    if concurrencia_str and concurrencia_str.isdigit() and int(concurrencia_str) > 0:
+        concurrencia = min(int(concurrencia_str), LOTE_MAX_CONCURRENCIA)
+
+    # Leer los PDFs antes de empezar a responder: los archivos del formulario
+    # no deben usarse desde los hilos del pool. Los que superan el tamaño máximo
+    # de un CV no se leen (contenido None) y se devuelven como error
+    documentos = []
+    for pdf_file in pdf_files:
+        if not pdf_file.filename:
+            continue
+        pdf_file.stream.seek(0, os.SEEK_END)
+        tamano = pdf_file.stream.tell()
+        pdf_file.stream.seek(0)
+        documentos.append((pdf_file.filename, pdf_file.read() if tamano <= MAX_TAMANO_PETICION_MB * 1024 * 1024 else None))
+    return documentos, nombre_puesto, configuracion, concurrencia, None
+
+
+def procesar_lote(documentos, nombre_puesto, configuracion, concurrencia):
+    """
+    Generador que procesa los documentos en paralelo y va devolviendo
+    (resultado, progreso) según termina cada CV. `progreso` incluye el tiempo
+    transcurrido, los CVs completados y los que siguen en cola o en proceso.
+    """
+    inicio = time.monotonic()
+    total = len(documentos)
+    iniciados = [0]
+    lock_iniciados = threading.Lock()
+
+    def procesar_documento(nombre_archivo, pdf_bytes):
+        with lock_iniciados:
+            iniciados[0] += 1
+        if pdf_bytes is None:
+            return {
+                "error": "Archivo demasiado grande",
+                "nombre_archivo_cv": nombre_archivo,
+                "error_message": f"El archivo supera el tamaño máximo permitido por CV ({MAX_TAMANO_PETICION_MB} MB)",
+            }
+        try:
+            resultado = analizar_cv(pdf_bytes, nombre_puesto, configuracion)
+        except CircuitoAbiertoError as e:
+            return {
+                "error": "Servicio de análisis no disponible temporalmente",
+                "nombre_archivo_cv": nombre_archivo,
+                "error_message": str(e),
+                "reintentar_en": e.reintentar_en,
+            }
+        except Exception as e:
+            print(f"Error inesperado procesando {nombre_archivo} en el lote: {e}")
+            resultado = None
+        if resultado:
+            return {**resultado, "nombre_archivo_cv": nombre_archivo}
+        return {
+            "error": "Error interno o de API al procesar el PDF con AI",
+            "nombre_archivo_cv": nombre_archivo,
+            "error_message": "El procesamiento AI no devolvió resultado",
+        }
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrencia, total)))
+    try:
+        prioridad = prioridad_actual.get()
+        futuros = [executor.submit(en_prioridad, prioridad, procesar_documento, nombre, contenido) for nombre, contenido in documentos]
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            with lock_iniciados:
+                en_cola = total - iniciados[0]
+            progreso = {
+                "completados": completados,
+                "total": total,
+                "en_cola": en_cola,
+                "en_proceso": total - completados - en_cola,
+                "tiempo_transcurrido": round(time.monotonic() - inicio, 3),
+            }
+            yield futuro.result(), progreso
     finally:
-        # Elimina el archivo temporal si existe
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except OSError as e:
-                 print(f"Advertencia: No se pudo eliminar el archivo temporal {filepath}: {e}")
+        # Si el cliente se desconecta se cancelan los CVs que aún no han empezado
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.route('/procesar_lote', methods=['POST'])
+def procesar_lote_route():
+    """
+    Recibe varios PDFs (campo 'pdfs') con un único puesto, filtros y pesos, los
+    procesa en paralelo y devuelve un resultado por línea (NDJSON) según van terminando.
+    """
+    documentos, nombre_puesto, configuracion, concurrencia, error = leer_peticion_lote()
+    if error:
+        return error
+
+    def generar_resultados():
+        for resultado, _ in procesar_lote(documentos, nombre_puesto, configuracion, concurrencia):
+            yield json.dumps(resultado, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generar_resultados()), mimetype='application/x-ndjson')
+
+
+@app.route('/procesar_lote/eventos', methods=['POST'])
+def procesar_lote_eventos_route():
+    """
+    Igual que /procesar_lote pero devuelve Server-Sent Events: un evento 'resultado'
+    por CV completado (con el Resultado, el tiempo transcurrido y la cola pendiente)
+    y un evento 'fin' al terminar el lote.
+    """
+    documentos, nombre_puesto, configuracion, concurrencia, error = leer_peticion_lote()
+    if error:
+        return error
+
+    def generar_eventos():
+        progreso = {"completados": 0, "total": len(documentos), "en_cola": 0, "en_proceso": 0, "tiempo_transcurrido": 0.0}
+        for resultado, progreso in procesar_lote(documentos, nombre_puesto, configuracion, concurrencia):
+            datos = json.dumps({"resultado": resultado, **progreso}, ensure_ascii=False)
+            yield f"event: resultado\ndata: {datos}\n\n"
+        yield f"event: fin\ndata: {json.dumps(progreso, ensure_ascii=False)}\n\n"
+
+    respuesta = Response(stream_with_context(generar_eventos()), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no' # Evitar que un proxy agrupe los eventos
+    return respuesta
+
+
+# --- Endpoints de trabajos asíncronos ---
+# POST /jobs devuelve un id al momento y el análisis se hace en el pool de workers;
+# el cliente consulta después GET /jobs/<id> hasta que el trabajo termina.
+
+def ejecutar_trabajo(job_id, pdf_bytes, nombre_puesto, configuracion):
+    """Ejecuta el análisis de un trabajo en un worker y guarda su resultado."""
+    almacen_trabajos.actualizar(job_id, estado=ESTADO_EN_PROCESO, iniciado=datetime.now().isoformat())
+    try:
+        resultado = analizar_cv(pdf_bytes, nombre_puesto, configuracion)
+    except CircuitoAbiertoError as e:
+        almacen_trabajos.actualizar(job_id, estado=ESTADO_ERROR, error=str(e), reintentar_en=e.reintentar_en, finalizado=datetime.now().isoformat())
+        return
+    except Exception as e:
+        print(f"Error inesperado en el trabajo {job_id}: {e}")
+        resultado = None
+    if resultado:
+        almacen_trabajos.actualizar(job_id, estado=ESTADO_COMPLETADO, resultado=resultado, finalizado=datetime.now().isoformat())
+    else:
+        almacen_trabajos.actualizar(job_id, estado=ESTADO_ERROR, error='Error interno o de API al procesar el PDF con AI', finalizado=datetime.now().isoformat())
+
+
+@app.route('/jobs', methods=['POST'])
+def crear_trabajo_route():
+    """
+    Recibe un PDF, puesto, filtros y pesos (mismos campos que /procesar_pdf),
+    encola el análisis y devuelve inmediatamente el id del trabajo.
+    """
+    if 'pdf' not in request.files:
+        return jsonify({'error': 'No se encontró el archivo PDF'}), 400
+
+    pdf_file = request.files['pdf']
+    nombre_puesto = request.form.get('puesto')
+    configuracion = obtener_configuracion_analisis(request.form)
+
+    if pdf_file.filename == '':
+        return jsonify({'error': 'Nombre de archivo PDF inválido'}), 400
+
+    if not nombre_puesto:
+        return jsonify({'error': 'No se especificó el puesto de trabajo'}), 400
+
+    try:
+        pdf_bytes = pdf_file.read()
+        job_id = almacen_trabajos.crear({"puesto": nombre_puesto, "nombre_archivo_cv": pdf_file.filename})
+        executor_trabajos.submit(en_prioridad, prioridad_actual.get(), ejecutar_trabajo, job_id, pdf_bytes, nombre_puesto, configuracion)
+        return jsonify({'job_id': job_id, 'estado': ESTADO_PENDIENTE}), 202
+    except Exception as e:
+        print(f"Error en la ruta /jobs: {e}")
+        return jsonify({'error': f'Error al crear el trabajo de análisis: {e}'}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def obtener_trabajo_route(job_id):
+    """
+    Devuelve el estado de un trabajo y, si ha terminado, su resultado o error.
+    """
+    trabajo = almacen_trabajos.obtener(job_id)
+    if trabajo is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo), 200
+
+
+@app.route('/estadisticas_cache', methods=['GET'])
+def estadisticas_cache_route():
+    """
+    Devuelve los contadores de aciertos/fallos y la ocupación de la caché de resultados.
+    """
+    return jsonify(cache_resultados.estadisticas()), 200
+
+
+@app.route('/salud', methods=['GET'])
+def salud_route():
+    """
+    Estado del backend y de su dependencia del modelo: 'degradado' mientras el
+    circuito no está cerrado (los análisis que no estén en caché fallan al momento).
+    """
+    circuito = circuito_modelo.estadisticas()
+    return jsonify({
+        "estado": "ok" if circuito["estado"] == CircuitoModelo.CERRADO else "degradado",
+        "modelo_disponible": motor_llm is not None,
+        "circuito": circuito,
+        "limitador": limitador_gemini.estadisticas(),
+        "cobertura": ejecutor_cobertura.estadisticas(),
+    }), 200
 
 
 # --- Endpoints relacionados con historial de Análisis AI ---
 # Estos endpoints guardan y sirven el historial de los RESULTADOS DEL ANÁLISIS AI
 
+# Se crea aquí, con todo el módulo ya definido, porque al indexar las ejecuciones
+# antiguas necesita resumir_uso
+almacen_historial = crear_almacen_historial()
+
+
 @app.route('/guardar_resultados_masivos', methods=['POST'])
 def guardar_resultados_masivos_route():
     """
@@ -372,21 +2841,29 @@ def guardar_resultados_masivos_route():
         if not puesto or not isinstance(resultados_lista, list):
              return jsonify({'error': 'Datos inválidos: falta puesto o resultados no es una lista'}), 400
 
-        historial = cargar_historial()
         # Usar ISO format para mayor precisión y facilidad de ordenamiento/parsing
         timestamp = datetime.now().isoformat()
 
         nueva_ejecucion = {
             "timestamp": timestamp,
             "puesto": puesto,
-            "resultados": resultados_lista # Guardamos la lista completa de resultados (válidos)
+            "resultados": resultados_lista, # Guardamos la lista completa de resultados (válidos)
+            # Tokens y coste de la ejecución, para detectar puestos y configuraciones caras
+            "uso_modelo": resumir_uso(resultados_lista)
         }
+        # Configuración con la que se lanzó el análisis (si el frontend la envía)
+        configuracion = data.get('configuracion')
+        if isinstance(configuracion, dict):
+            filtros, pesos = separar_configuracion(configuracion)
+            nueva_ejecucion["filtros"] = {k: v for k, v in filtros.items() if v is not None}
+            nueva_ejecucion["pesos_usados"] = pesos
 
-        historial.append(nueva_ejecucion)
-        guardar_historial(historial)
+        anadir_al_historial(nueva_ejecucion)
 
         return jsonify({'message': 'Resultados guardados exitosamente en historial', 'timestamp': timestamp}), 200
 
+    except HTTPException:
+        raise # Errores de la petición (400, 413...): los responde Flask con su código
     except Exception as e:
         print(f"Error en la ruta /guardar_resultados_masivos: {e}")
         return jsonify({'error': f'Error al guardar resultados masivos en historial: {e}'}), 500
@@ -395,25 +2872,29 @@ def guardar_resultados_masivos_route():
 @app.route('/historial_ejecuciones', methods=['GET'])
 def historial_ejecuciones_route():
     """
-    Devuelve un resumen del historial de ejecuciones de análisis.
+    Devuelve una página del resumen del historial de ejecuciones de análisis, de la
+    más reciente a la más antigua. Parámetros (todos opcionales):
+      - limit: ejecuciones por página (por defecto HISTORIAL_PAGINA_POR_DEFECTO).
+      - cursor: el de la cabecera X-Siguiente-Cursor de la página anterior.
+      - puesto: solo las ejecuciones de ese puesto.
+      - desde / hasta: rango de fechas AAAA-MM-DD, ambos incluidos.
+      - min_candidatos: número mínimo de candidatos de la ejecución.
+    La cabecera X-Siguiente-Cursor solo se envía si hay más páginas.
     """
     try:
-        historial = cargar_historial()
-        # Devolvemos un resumen de cada ejecución, no los resultados completos de cada candidato
-        historial_resumen = [
-            {
-                "timestamp": ejecucion.get("timestamp"),
-                "puesto": ejecucion.get("puesto"),
-                "num_candidatos": len(ejecucion.get("resultados", [])) # Contar cuántos candidatos se procesaron
-                # Opcional: Incluir los pesos usados en el resumen si se guardaron
-                # "pesos_usados": ejecucion.get("pesos_usados")
-            }
-            for ejecucion in historial
-        ]
-        # Ordenar por timestamp descendente
-        historial_resumen.sort(key=lambda x: x.get('timestamp', ''), reverse=True) # Asegurar que timestamp existe para ordenar
-
-        return jsonify(historial_resumen), 200
+        try:
+            consulta = leer_consulta_historial(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Cada resumen lleva los agregados calculados al guardar la ejecución; el
+        # almacén recorre su índice sin leer los resultados de los candidatos
+        historial_resumen, siguiente_cursor = almacen_historial.pagina(**consulta)
+
+        respuesta = jsonify(historial_resumen)
+        if siguiente_cursor:
+            respuesta.headers['X-Siguiente-Cursor'] = siguiente_cursor
+        return respuesta, 200
     except Exception as e:
         print(f"Error en la ruta /historial_ejecuciones: {e}")
         return jsonify({'error': f'Error al obtener historial: {e}'}), 500
@@ -424,66 +2905,79 @@ def detalles_ejecucion_route(timestamp):
     Devuelve los detalles (counts de aptos/no aptos/error) de una ejecución de análisis específica.
     """
     try:
-        historial = cargar_historial()
-        # Buscar la ejecución por timestamp
-        ejecucion = next((e for e in historial if e.get("timestamp") == timestamp), None)
+        # Buscar el resumen de la ejecución por timestamp (los recuentos se calcularon al guardarla)
+        resumen = obtener_resumen_ejecucion(timestamp)
+
+        if not resumen:
+            return jsonify({'error': 'Ejecución no encontrada en historial'}), 404
+
+        # 'no_procesado' cuenta los resultados con error o sin la clave 'apto'
+        return jsonify({
+            "puesto": resumen.get("puesto"),
+            "timestamp": resumen.get("timestamp"),
+            "counts": resumen.get("counts"),
+            "puntuacion": resumen.get("puntuacion"), # Mínima, media, máxima e histograma
+            "pesos_usados": resumen.get("pesos_usados"),
+            "filtros": resumen.get("filtros"),
+        }), 200
+
+    except Exception as e:
+        print(f"Error en la ruta /detalles_ejecucion/{timestamp}: {e}")
+        return jsonify({'error': f'Error al obtener detalles de la ejecución del historial: {e}'}), 500
+
+
+@app.route('/reordenar_ejecucion/<timestamp>', methods=['POST'])
+def reordenar_ejecucion_route(timestamp):
+    """
+    Recalcula el ranking de una ejecución del historial con un nuevo vector de
+    pesos (JSON: {"pesos": {"peso_experiencia": ..., ...}}), sin llamar al modelo.
+    Devuelve el nuevo orden y la variación de posición de cada candidato.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        pesos_nuevos = data.get('pesos')
+        if not isinstance(pesos_nuevos, dict):
+            return jsonify({'error': 'Falta el objeto "pesos" con los nuevos pesos'}), 400
+        try:
+            pesos_nuevos = {f"peso_{criterio}": float(pesos_nuevos.get(f"peso_{criterio}", 0) or 0) for criterio in CRITERIOS_EVALUACION}
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Los pesos deben ser numéricos'}), 400
+        if any(v < 0 for v in pesos_nuevos.values()) or sum(pesos_nuevos.values()) <= 0:
+            return jsonify({'error': 'Los pesos deben ser no negativos y sumar más de 0'}), 400
 
+        ejecucion = obtener_ejecucion(timestamp)
         if not ejecucion:
             return jsonify({'error': 'Ejecución no encontrada en historial'}), 404
 
-        resultados_candidatos = ejecucion.get("resultados", [])
-
-        # Contar aptos, no aptos, y 'no procesados' (considerando errores si los guardamos así)
-        apto_count = 0
-        no_apto_count = 0
-        no_procesado_count = 0 # Consideraremos 'no procesado' si el resultado en la lista es un objeto de error o no tiene la clave 'apto'
-
-        for res in resultados_candidatos:
-            # Intentar validar con el modelo para seguridad, pero contar incluso si la estructura es solo un error
-            if isinstance(res, dict):
-                 if 'error' in res:
-                      no_procesado_count += 1 # Contar como no procesado si es un objeto de error
-                 elif 'apto' in res: # Si no es un error, esperamos la clave 'apto'
-                     if res['apto']:
-                         apto_count += 1
-                     else:
-                         no_apto_count += 1
-                 else:
-                      # Si es un diccionario pero no tiene 'apto' ni 'error', es inesperado
-                      no_procesado_count += 1
-                      print(f"Advertencia: Resultado en historial con formato inesperado (falta 'apto'): {res}")
-            else:
-                # Si no es un diccionario, es un formato inesperado en la lista de resultados guardada
-                no_procesado_count += 1
-                print(f"Advertencia: Elemento en historial no es un diccionario: {res}")
-
-
-        # Devolvemos los counts
+        inicio = time.perf_counter()
+        pesos_anteriores = ejecucion.get("pesos_usados") or PESOS_POR_DEFECTO
+        ranking, sin_puntuar = reordenar_resultados(ejecucion.get("resultados", []), pesos_nuevos, pesos_anteriores)
         return jsonify({
             "puesto": ejecucion.get("puesto"),
             "timestamp": ejecucion.get("timestamp"),
-            "counts": {
-                "apto": apto_count,
-                "no_apto": no_apto_count,
-                "no_procesado": no_procesado_count
-            },
-            # Opcional: Devolver también los pesos usados para esta ejecución
-            # "pesos_usados": ejecucion.get("pesos_usados")
+            "pesos_anteriores": pesos_anteriores,
+            "pesos": pesos_nuevos,
+            "ranking": ranking,
+            "sin_puntuar": sin_puntuar, # Errores o resultados sin datos para recalcular
+            "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 2),
         }), 200
 
     except Exception as e:
-        print(f"Error en la ruta /detalles_ejecucion/{timestamp}: {e}")
-        return jsonify({'error': f'Error al obtener detalles de la ejecución del historial: {e}'}), 500
+        print(f"Error en la ruta /reordenar_ejecucion/{timestamp}: {e}")
+        return jsonify({'error': f'Error al reordenar la ejecución del historial: {e}'}), 500
 
 
 if __name__ == '__main__':
     # Crear el archivo de historial si no existe al iniciar
     # Asegurarse de que SOLO creas el archivo de historial aquí
-    if not os.path.exists(RUTA_HISTORIAL):
-        guardar_historial([])
+    if ALMACEN_HISTORIAL != "sqlite" and not os.path.exists(RUTA_HISTORIAL):
+        pathlib.Path(RUTA_HISTORIAL).touch()
 
     # NO crees el archivo de usuarios ni la carpeta de CVs recibidos manualmente aquí
 
+    # Los CVs ya no se guardan en disco; se limpian los temporales que quedaran de otras ejecuciones
+    limpiar_temporales_huerfanos()
+
     # Corre en el puerto principal (ej. 5001)
     print(f"Iniciando Backend Principal (Procesamiento CVs) en el puerto 5001...")
     app.run(debug=True, port=5001)
\ No newline at end of file
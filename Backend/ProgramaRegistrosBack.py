@@ -7,9 +7,17 @@ from flask import Flask, request, jsonify
 import os
 import json
 import bcrypt
+import metricas
 
 app = Flask(__name__)
 
+# Métricas para Prometheus (/metrics): peticiones por ruta y tiempo de bcrypt
+registro_metricas = metricas.RegistroMetricas()
+metricas.instrumentar_app(app, registro_metricas)
+duracion_bcrypt = registro_metricas.histograma(
+    "cvisualizer_bcrypt_duracion_segundos", "Duración de las operaciones de bcrypt (hash y verificación).", ("operacion",)
+)
+
 # --- Archivos ---
 RUTA_USUARIOS = "./usuarios.json" # Archivo para guardar usuarios
 
@@ -60,7 +68,8 @@ def register_route():
             return jsonify({'error': 'El usuario ya existe'}), 409 # 409 Conflict
 
         # Hashear la contraseña
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        with duracion_bcrypt.medir(operacion="hash"):
+            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
         # Guardar usuario y contraseña hasheada
         usuarios[username] = {
@@ -103,7 +112,9 @@ def login_route():
              return jsonify({'error': 'Error interno en los datos del usuario'}), 500
 
         # Verificar la contraseña hasheada
-        if bcrypt.checkpw(password.encode('utf-8'), stored_password_hash.encode('utf-8')):
+        with duracion_bcrypt.medir(operacion="verificacion"):
+            password_correcta = bcrypt.checkpw(password.encode('utf-8'), stored_password_hash.encode('utf-8'))
+        if password_correcta:
             # Contraseña correcta
             return jsonify({'message': 'Inicio de sesión exitoso', 'username': username, 'company': company}), 200
         else:
@@ -0,0 +1,758 @@
+###### TFG CVisualizer Historial de ejecuciones ######
+###### Almacenes JSON Lines y SQLite           ######
+
+# Dos almacenes intercambiables para el historial de ejecuciones de análisis, con la
+# misma interfaz (anadir, pagina, obtener_resumen, obtener):
+#  - HistorialJSONL: un archivo de solo añadido con una ejecución por línea.
+#  - HistorialSQLite: tablas normalizadas de ejecuciones y candidatos con índices,
+#    para que el resumen y la búsqueda por timestamp no recorran todo el historial.
+#
+# Al guardar cada ejecución se calculan una vez sus agregados (recuentos de aptos,
+# estadísticas e histograma de puntuaciones, pesos y filtros usados), de modo que la
+# lista del historial y los detalles de una ejecución no leen los resultados de los candidatos.
+# La lista se sirve por páginas, de la ejecución más reciente a la más antigua, con un
+# cursor opaco que apunta detrás de la última ejecución devuelta.
+#
+# Ejecutado como script, migra un historial existente (.json o .jsonl) a SQLite:
+#     python historial.py --origen historial_ejecuciones.jsonl --destino historial_ejecuciones.db
+
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Los avisos de los almacenes van al log (el script de migración escribe en la consola)
+registro = logging.getLogger(__name__)
+
+# Intervalos del histograma de puntuaciones (0-10): [0,1), [1,2), ..., [9,10]
+NUM_INTERVALOS_PUNTUACION = 10
+
+
+def leer_historial_antiguo(ruta):
+    """Lee el historial en el formato original (un único array JSON)."""
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            ejecuciones = json.load(f)
+    except json.JSONDecodeError:
+        registro.warning(f"El archivo de historial '{ruta}' está vacío o corrupto. Se considera vacío.")
+        return []
+    if not isinstance(ejecuciones, list):
+        return []
+    return [ejecucion for ejecucion in ejecuciones if isinstance(ejecucion, dict)]
+
+
+def leer_lineas_jsonl(ruta, desde=0, hasta=None):
+    """
+    Lee los objetos JSON de un archivo de líneas entre los bytes `desde` y `hasta`.
+    Devuelve (lista de (posicion, longitud, objeto), lineas_descartadas).
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            f.seek(desde)
+            contenido = f.read() if hasta is None else f.read(max(0, hasta - desde))
+    except FileNotFoundError:
+        return [], 0
+    objetos, descartadas, posicion = [], 0, desde
+    for linea in contenido.splitlines(keepends=True):
+        if linea.strip():
+            try:
+                objeto = json.loads(linea) if linea.endswith(b"\n") else None
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                objeto = None
+            if isinstance(objeto, dict):
+                objetos.append((posicion, len(linea), objeto))
+            else:
+                descartadas += 1
+        posicion += len(linea)
+    return objetos, descartadas
+
+
+def calcular_agregados(resultados):
+    """
+    Recuentos de aptos, no aptos y no procesados (errores o resultados sin 'apto')
+    y estadísticas de puntuacionPuesto de una lista de resultados.
+    """
+    aptos = no_aptos = no_procesados = 0
+    puntuaciones = []
+    for resultado in resultados:
+        if not isinstance(resultado, dict) or 'error' in resultado or 'apto' not in resultado:
+            no_procesados += 1
+            continue
+        if resultado['apto']:
+            aptos += 1
+        else:
+            no_aptos += 1
+        puntuacion = resultado.get("puntuacionPuesto")
+        if isinstance(puntuacion, (int, float)) and not isinstance(puntuacion, bool):
+            puntuaciones.append(float(puntuacion))
+    histograma = [0] * NUM_INTERVALOS_PUNTUACION
+    for puntuacion in puntuaciones:
+        histograma[min(NUM_INTERVALOS_PUNTUACION - 1, max(0, int(puntuacion)))] += 1
+    return {
+        "num_candidatos": len(resultados),
+        "counts": {"apto": aptos, "no_apto": no_aptos, "no_procesado": no_procesados},
+        "puntuacion": {
+            "min": min(puntuaciones) if puntuaciones else None,
+            "media": round(sum(puntuaciones) / len(puntuaciones), 2) if puntuaciones else None,
+            "max": max(puntuaciones) if puntuaciones else None,
+            "histograma": histograma,
+        },
+    }
+
+
+def resumir_ejecucion(ejecucion, completar_uso=None):
+    """Resumen de una ejecución (sin los resultados) con sus agregados."""
+    resultados = ejecucion.get("resultados") or []
+    uso_modelo = ejecucion.get("uso_modelo")
+    if uso_modelo is None and completar_uso is not None:
+        # Las ejecuciones guardadas antes de contabilizar el uso se resumen una vez, aquí
+        uso_modelo = completar_uso(resultados)
+    return {
+        "timestamp": ejecucion.get("timestamp"),
+        "puesto": ejecucion.get("puesto"),
+        **calcular_agregados(resultados),
+        "pesos_usados": ejecucion.get("pesos_usados"),
+        "filtros": ejecucion.get("filtros"),
+        "uso_modelo": uso_modelo,
+    }
+
+
+def codificar_cursor(timestamp, desempate):
+    """
+    Cursor de paginación: la clave (timestamp, desempate) de la última ejecución
+    devuelta. El desempate ordena ejecuciones con el mismo timestamp.
+    """
+    crudo = json.dumps([timestamp, desempate], separators=(",", ":")).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip("=")
+
+
+def decodificar_cursor(cursor, tipo_desempate=int):
+    """
+    Devuelve la clave (timestamp, desempate) de un cursor, con el desempate del tipo
+    que usa el almacén. Lanza ValueError si no es válido.
+    """
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, desempate = json.loads(crudo)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Cursor no válido: '{cursor}'") from e
+    if not isinstance(timestamp, str) or not isinstance(desempate, tipo_desempate) or isinstance(desempate, bool):
+        raise ValueError(f"Cursor no válido: '{cursor}'")
+    return timestamp, desempate
+
+
+def clave_orden(entrada):
+    """
+    Clave con la que se ordenan y paginan las entradas del índice de un HistorialJSONL.
+    Se desempata por el identificador de la ejecución y no por su posición en el
+    archivo, que cambia al compactarlo: así un cursor sigue valiendo después.
+    """
+    return (entrada.get("timestamp") or "", entrada["_id"])
+
+
+class IndiceEnMemoria:
+    """
+    Copia en memoria del índice de un HistorialJSONL con sus estructuras derivadas:
+    un diccionario timestamp→entrada y las entradas ordenadas por clave_orden, tanto
+    todas juntas como separadas por puesto. Se modifica en el sitio, así que solo se
+    usa con el lock del índice del historial.
+    """
+
+    def __init__(self, version, entradas):
+        self.version = version # La del archivo del índice que se leyó (ver HistorialJSONL._version_indice)
+        self.por_timestamp = {}
+        self.claves = []
+        self.ordenadas = []
+        self.por_puesto = {} # puesto -> (claves, ordenadas), como las de todo el historial
+        for entrada in sorted(entradas, key=clave_orden):
+            self.anadir(entrada)
+
+    @staticmethod
+    def _insertar(claves, ordenadas, entrada):
+        clave = clave_orden(entrada)
+        posicion = len(claves) if not claves or claves[-1] <= clave else bisect.bisect_right(claves, clave)
+        claves.insert(posicion, clave)
+        ordenadas.insert(posicion, entrada)
+
+    def anadir(self, entrada):
+        """Añade una entrada en su sitio; como los timestamps crecen, casi siempre al final (O(1))."""
+        # En orden de clave, la primera entrada de un timestamp es también la primera del archivo
+        self.por_timestamp.setdefault(entrada.get("timestamp"), entrada)
+        self._insertar(self.claves, self.ordenadas, entrada)
+        self._insertar(*self.por_puesto.setdefault(entrada.get("puesto"), ([], [])), entrada)
+
+    def pagina(self, limite, inicio=None, puesto=None, desde=None, hasta=None, min_candidatos=None):
+        """
+        Hasta `limite` entradas que cumplan los filtros, de la más reciente a la más
+        antigua y empezando detrás de la clave `inicio`. El puesto elige la lista y las
+        fechas y el cursor se buscan por bisección, así que solo se recorren las
+        entradas de la página (más las que descarte min_candidatos).
+        """
+        if puesto is None:
+            claves, ordenadas = self.claves, self.ordenadas
+        else:
+            claves, ordenadas = self.por_puesto.get(puesto, ([], []))
+        # (fecha,) queda delante de cualquier clave con ese timestamp: [desde, hasta)
+        primero = bisect.bisect_left(claves, (desde,)) if desde is not None else 0
+        fin = bisect.bisect_left(claves, (hasta,)) if hasta is not None else len(claves)
+        if inicio is not None:
+            fin = min(fin, bisect.bisect_left(claves, inicio))
+        seleccion = []
+        for i in range(fin - 1, primero - 1, -1):
+            entrada = ordenadas[i]
+            if min_candidatos is not None and (entrada.get("num_candidatos") or 0) < min_candidatos:
+                continue
+            seleccion.append(entrada)
+            if len(seleccion) == limite:
+                break
+        return seleccion
+
+
+class HistorialJSONL:
+    """
+    Historial de ejecuciones en un archivo JSON Lines de solo añadido, con un
+    índice aparte (también JSON Lines) que guarda el resumen de cada ejecución, su
+    identificador y su posición en el historial para leerla sin recorrer el archivo.
+    El identificador es un hash del contenido: no cambia al compactar y las copias
+    idénticas de una ejecución (que la compactación deja en una) comparten el mismo.
+
+    El índice se mantiene en memoria mientras su archivo no cambie (mismo inodo,
+    tamaño y fecha de modificación): las escrituras de este proceso le añaden la
+    entrada en el sitio y solo se vuelve a leer si otro proceso modifica el archivo.
+    """
+
+    TIPO_DESEMPATE = str # El de los cursores: el identificador de la ejecución (ver clave_orden)
+
+    def __init__(self, ruta, ruta_antiguo=None, compactar_cada=100, completar_uso=None):
+        self.ruta = ruta
+        self.ruta_indice = os.path.splitext(ruta)[0] + ".indice.jsonl"
+        self.compactar_cada = compactar_cada
+        self.completar_uso = completar_uso
+        self._anadidos_desde_compactacion = 0
+        self._compactando = False
+        self._lock = threading.Lock()
+        self._indice = None
+        self._lock_indice = threading.Lock() # Protege self._indice; se toma siempre después de _lock, nunca antes
+        if ruta_antiguo:
+            self._migrar_desde_json(ruta_antiguo)
+        self._reparar_final()
+        self._sincronizar_indice()
+        with self._lock_indice:
+            self._indice_vigente() # Cargarlo ya, para que no lo pague la primera petición
+
+    def _migrar_desde_json(self, ruta_antiguo):
+        """Convierte una sola vez el historial antiguo (array JSON) al formato de líneas."""
+        if os.path.exists(self.ruta) or not os.path.exists(ruta_antiguo):
+            return
+        try:
+            ejecuciones = leer_historial_antiguo(ruta_antiguo)
+        except OSError as e:
+            registro.error(f"Error al leer el historial antiguo para migrarlo: {e}")
+            return
+        self._escribir_completo(ejecuciones)
+        # Se conserva el original como copia de seguridad, fuera del camino de la migración
+        os.replace(ruta_antiguo, ruta_antiguo + ".migrado")
+        # Se avisa como advertencia (visible sin configurar el log) porque mueve un archivo del usuario
+        registro.warning(f"Historial migrado de '{ruta_antiguo}' a '{self.ruta}' ({len(ejecuciones)} ejecuciones).")
+
+    def _reparar_final(self):
+        """Si el proceso murió a mitad de una escritura, elimina la última línea incompleta."""
+        try:
+            with open(self.ruta, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                tamano = f.tell()
+                if tamano == 0:
+                    return
+                f.seek(tamano - 1)
+                if f.read(1) == b"\n":
+                    return
+                # Buscar hacia atrás el último salto de línea
+                posicion = tamano
+                while posicion > 0:
+                    inicio = max(0, posicion - 65536)
+                    f.seek(inicio)
+                    bloque = f.read(posicion - inicio)
+                    indice = bloque.rfind(b"\n")
+                    if indice != -1:
+                        posicion = inicio + indice + 1
+                        break
+                    posicion = inicio
+                registro.warning(f"Se descarta una línea incompleta al final de '{self.ruta}' ({tamano - posicion} bytes).")
+                f.truncate(posicion)
+                f.flush()
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            return
+
+    @staticmethod
+    def _serializar(objeto):
+        return (json.dumps(objeto, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+
+    @classmethod
+    def _identificador(cls, ejecucion=None, linea=None):
+        """Identificador estable de una ejecución: hash de su línea serializada."""
+        return hashlib.sha256(linea if linea is not None else cls._serializar(ejecucion)).hexdigest()[:16]
+
+    def _entrada_indice(self, ejecucion, posicion, longitud, linea=None):
+        return {
+            **resumir_ejecucion(ejecucion, self.completar_uso),
+            "_id": self._identificador(ejecucion, linea), "_posicion": posicion, "_longitud": longitud,
+        }
+
+    @staticmethod
+    def _sin_posicion(entrada):
+        return {k: v for k, v in entrada.items() if not k.startswith("_")}
+
+    def _escribir_completo(self, ejecuciones):
+        """Escribe el archivo entero de forma atómica (temporal sincronizado + os.replace)."""
+        ruta_tmp = self.ruta + ".tmp"
+        with open(ruta_tmp, 'wb') as f:
+            for ejecucion in ejecuciones:
+                f.write(self._serializar(ejecucion))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta_tmp, self.ruta)
+
+    def _escribir_indice(self, entradas):
+        ruta_tmp = self.ruta_indice + ".tmp"
+        with open(ruta_tmp, 'wb') as f:
+            f.writelines(self._serializar(entrada) for entrada in entradas)
+        os.replace(ruta_tmp, self.ruta_indice)
+
+    def _leer_indice(self):
+        entradas, descartadas = leer_lineas_jsonl(self.ruta_indice)
+        return [entrada for _, _, entrada in entradas], descartadas
+
+    def _version_indice(self):
+        """Identifica el contenido del archivo del índice: (inodo, tamaño, mtime), o None si no existe."""
+        try:
+            estado = os.stat(self.ruta_indice)
+        except FileNotFoundError:
+            return None
+        return (estado.st_ino, estado.st_size, estado.st_mtime_ns)
+
+    def _indice_vigente(self):
+        """
+        Devuelve el índice en memoria, volviendo a leer el archivo solo si ha cambiado.
+        Se llama con _lock_indice tomado, que se mantiene mientras se usa el índice.
+        """
+        version = self._version_indice()
+        if self._indice is None or self._indice.version != version:
+            # Solo se leen los bytes que había al tomar la versión: si el archivo crece
+            # mientras tanto, la versión ya no coincide y se vuelve a leer en la siguiente consulta
+            entradas, _ = leer_lineas_jsonl(self.ruta_indice, hasta=version[1] if version else 0)
+            self._indice = IndiceEnMemoria(version, [entrada for _, _, entrada in entradas])
+        return self._indice
+
+    def _sincronizar_indice(self):
+        """
+        Pone el índice al día con el historial: indexa las ejecuciones que falten al
+        final (p. ej. si el proceso murió entre las dos escrituras) o lo rehace entero
+        si no corresponde al archivo actual.
+        """
+        try:
+            tamano = os.path.getsize(self.ruta)
+        except FileNotFoundError:
+            tamano = 0
+        entradas, descartadas = self._leer_indice()
+        fin = entradas[-1]["_posicion"] + entradas[-1]["_longitud"] if entradas else 0
+        if fin > tamano or any("_id" not in entrada for entrada in entradas):
+            entradas, fin, descartadas = [], 0, 1 # El índice no corresponde al historial: rehacerlo
+        if fin == tamano and not descartadas:
+            return
+        nuevas, _ = leer_lineas_jsonl(self.ruta, desde=fin)
+        entradas += [self._entrada_indice(ejecucion, posicion, longitud) for posicion, longitud, ejecucion in nuevas]
+        self._escribir_indice(entradas)
+        registro.info(f"Índice del historial actualizado: {len(nuevas)} ejecuciones indexadas, {len(entradas)} en total.")
+
+    def pagina(self, limite, cursor=None, puesto=None, desde=None, hasta=None, min_candidatos=None):
+        """
+        Hasta `limite` resúmenes (sin los resultados) que cumplan los filtros, de la
+        ejecución más reciente a la más antigua y empezando detrás de `cursor`.
+        Devuelve (resumenes, siguiente_cursor); siguiente_cursor es None en la última página.
+        """
+        inicio = decodificar_cursor(cursor, self.TIPO_DESEMPATE) if cursor else None
+        with self._lock_indice:
+            # Se pide una de más para saber si hay página siguiente
+            seleccion = self._indice_vigente().pagina(limite + 1, inicio, puesto, desde, hasta, min_candidatos)
+        siguiente = None
+        if len(seleccion) > limite:
+            seleccion = seleccion[:limite]
+            siguiente = codificar_cursor(*clave_orden(seleccion[-1]))
+        return [self._sin_posicion(entrada) for entrada in seleccion], siguiente
+
+    def _buscar_entrada(self, timestamp):
+        with self._lock_indice:
+            return self._indice_vigente().por_timestamp.get(timestamp)
+
+    def obtener_resumen(self, timestamp):
+        """Resumen de la ejecución con ese timestamp, o None."""
+        entrada = self._buscar_entrada(timestamp)
+        return self._sin_posicion(entrada) if entrada is not None else None
+
+    def obtener(self, timestamp):
+        """Ejecución completa con ese timestamp, o None. Solo lee su línea del historial."""
+        # Con el lock, una compactación no puede cambiar las posiciones entre ambas lecturas
+        with self._lock:
+            entrada = self._buscar_entrada(timestamp)
+            if entrada is None:
+                return None
+            with open(self.ruta, 'rb') as f:
+                f.seek(entrada["_posicion"])
+                linea = f.read(entrada["_longitud"])
+        try:
+            ejecucion = json.loads(linea)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            ejecucion = None
+        if not isinstance(ejecucion, dict) or ejecucion.get("timestamp") != timestamp:
+            registro.warning(f"El índice del historial no coincide con '{self.ruta}'. Se busca recorriendo el archivo.")
+            ejecuciones, _ = leer_lineas_jsonl(self.ruta)
+            return next((e for _, _, e in ejecuciones if e.get("timestamp") == timestamp), None)
+        return ejecucion
+
+    def anadir(self, ejecucion):
+        """Añade una ejecución al final del archivo, la sincroniza a disco y la indexa."""
+        linea = self._serializar(ejecucion)
+        resumen = resumir_ejecucion(ejecucion, self.completar_uso)
+        with self._lock:
+            with open(self.ruta, 'ab') as f:
+                posicion = f.seek(0, os.SEEK_END)
+                f.write(linea)
+                f.flush()
+                os.fsync(f.fileno())
+            # El índice no se sincroniza a disco: si se pierde su final, se rehace al arrancar
+            entrada = {**resumen, "_id": self._identificador(linea=linea), "_posicion": posicion, "_longitud": len(linea)}
+            with self._lock_indice:
+                version_anterior = self._version_indice()
+                with open(self.ruta_indice, 'ab') as f:
+                    f.write(self._serializar(entrada))
+                # Si la copia en memoria estaba al día, se le añade la entrada sin releer el archivo
+                if self._indice is not None and self._indice.version == version_anterior:
+                    self._indice.anadir(entrada)
+                    self._indice.version = self._version_indice()
+            self._anadidos_desde_compactacion += 1
+            compactar = (
+                self.compactar_cada > 0
+                and self._anadidos_desde_compactacion >= self.compactar_cada
+                and not self._compactando
+            )
+            if compactar:
+                self._compactando = True
+        if compactar:
+            threading.Thread(target=self.compactar, name="compactar_historial", daemon=True).start()
+
+    def compactar(self):
+        """
+        Reescribe el historial sin líneas dañadas ni ejecuciones repetidas, y su
+        índice con las nuevas posiciones. Las ejecuciones añadidas mientras tanto se
+        copian al final antes de sustituir los archivos, así que no se pierde ninguna.
+        """
+        try:
+            with self._lock:
+                try:
+                    tamano_leido = os.path.getsize(self.ruta)
+                except FileNotFoundError:
+                    return
+            ejecuciones, descartadas = leer_lineas_jsonl(self.ruta, hasta=tamano_leido)
+            # Las líneas idénticas (p. ej. un guardado reintentado) se conservan una sola vez
+            lineas = {}
+            for _, _, ejecucion in ejecuciones:
+                lineas.setdefault(self._serializar(ejecucion), ejecucion)
+            entradas, posicion = [], 0
+            ruta_tmp = self.ruta + ".tmp"
+            with open(ruta_tmp, 'wb') as f:
+                for linea, ejecucion in lineas.items():
+                    f.write(linea)
+                    entradas.append(self._entrada_indice(ejecucion, posicion, len(linea), linea))
+                    posicion += len(linea)
+                f.flush()
+                with self._lock:
+                    # Copiar lo añadido durante la compactación y sustituir los archivos
+                    nuevas, _ = leer_lineas_jsonl(self.ruta, desde=tamano_leido)
+                    for _, _, ejecucion in nuevas:
+                        linea = self._serializar(ejecucion)
+                        f.write(linea)
+                        entradas.append(self._entrada_indice(ejecucion, posicion, len(linea), linea))
+                        posicion += len(linea)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    os.replace(ruta_tmp, self.ruta)
+                    with self._lock_indice:
+                        self._escribir_indice(entradas)
+                        self._indice = IndiceEnMemoria(self._version_indice(), entradas)
+                    self._anadidos_desde_compactacion = 0
+            registro.info(f"Historial compactado: {len(entradas)} ejecuciones, {len(ejecuciones) - len(lineas)} repetidas y {descartadas} líneas dañadas eliminadas.")
+        except Exception as e:
+            registro.error(f"Error al compactar el historial: {e}")
+        finally:
+            with self._lock:
+                self._compactando = False
+
+
+class HistorialSQLite:
+    """
+    Historial en SQLite: una fila por ejecución (con sus agregados) y una por
+    candidato, con índices por timestamp, puesto, apto y puntuacionPuesto. El modo
+    WAL permite leer mientras se guarda una ejecución. Cada hilo usa su propia conexión.
+    """
+
+    TIPO_DESEMPATE = int # El de los cursores: el id de la fila de la ejecución
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS ejecuciones (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            puesto TEXT,
+            num_candidatos INTEGER NOT NULL DEFAULT 0,
+            aptos INTEGER,
+            no_aptos INTEGER,
+            no_procesados INTEGER,
+            puntuacion_min REAL,
+            puntuacion_media REAL,
+            puntuacion_max REAL,
+            histograma TEXT,
+            pesos_usados TEXT,
+            filtros TEXT,
+            uso_modelo TEXT,
+            datos TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS candidatos (
+            id INTEGER PRIMARY KEY,
+            ejecucion_id INTEGER NOT NULL REFERENCES ejecuciones(id) ON DELETE CASCADE,
+            posicion INTEGER NOT NULL,
+            nombre TEXT,
+            apellidos TEXT,
+            nombre_archivo_cv TEXT,
+            apto INTEGER,
+            puntuacionPuesto REAL,
+            error TEXT,
+            datos TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_timestamp ON ejecuciones(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_puesto_timestamp ON ejecuciones(puesto, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_candidatos_ejecucion ON candidatos(ejecucion_id, posicion);
+        CREATE INDEX IF NOT EXISTS idx_candidatos_apto ON candidatos(apto);
+        CREATE INDEX IF NOT EXISTS idx_candidatos_puntuacion ON candidatos(puntuacionPuesto);
+    """
+
+    COLUMNAS_RESUMEN = (
+        "timestamp, puesto, num_candidatos, aptos, no_aptos, no_procesados, "
+        "puntuacion_min, puntuacion_media, puntuacion_max, histograma, pesos_usados, filtros, uso_modelo"
+    )
+
+    def __init__(self, ruta, ruta_importar=None, completar_uso=None):
+        self.ruta = ruta
+        self.completar_uso = completar_uso
+        self._local = threading.local()
+        nueva = not os.path.exists(ruta)
+        conexion = self._conexion()
+        conexion.executescript(self.ESQUEMA)
+        self._completar_uso_pendiente(conexion)
+        if nueva and ruta_importar and os.path.exists(ruta_importar):
+            # Primera vez con SQLite: se importa el historial que hubiera en el otro formato
+            ejecuciones = leer_ejecuciones(ruta_importar)
+            self.importar(ejecuciones)
+            registro.info(f"Historial importado de '{ruta_importar}' a '{ruta}' ({len(ejecuciones)} ejecuciones).")
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.row_factory = sqlite3.Row
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL") # En WAL sigue siendo seguro ante caídas del proceso
+            conexion.execute("PRAGMA foreign_keys=ON")
+            self._local.conexion = conexion
+        return conexion
+
+    def _completar_uso_pendiente(self, conexion):
+        """
+        Recalcula los agregados de las ejecuciones sin uso del modelo, como las migradas
+        con la herramienta de línea de comandos (que no recibe completar_uso).
+        """
+        if self.completar_uso is None:
+            return
+        pendientes = conexion.execute("SELECT id, datos FROM ejecuciones WHERE uso_modelo IS NULL").fetchall()
+        if not pendientes:
+            return
+        with conexion:
+            for fila in pendientes:
+                ejecucion = self._reconstruir(fila)
+                conexion.execute(
+                    "UPDATE ejecuciones SET aptos = ?, no_aptos = ?, no_procesados = ?, puntuacion_min = ?, puntuacion_media = ?, "
+                    "puntuacion_max = ?, histograma = ?, filtros = ?, uso_modelo = ? WHERE id = ?",
+                    self._valores_agregados(resumir_ejecucion(ejecucion, self.completar_uso)) + (fila["id"],)
+                )
+        registro.info(f"Uso del modelo calculado para {len(pendientes)} ejecuciones antiguas del historial.")
+
+    @staticmethod
+    def _a_json(valor):
+        return json.dumps(valor, ensure_ascii=False) if valor is not None else None
+
+    def _valores_agregados(self, resumen):
+        counts, puntuacion = resumen["counts"], resumen["puntuacion"]
+        return (
+            counts["apto"], counts["no_apto"], counts["no_procesado"],
+            puntuacion["min"], puntuacion["media"], puntuacion["max"], json.dumps(puntuacion["histograma"]),
+            self._a_json(resumen["filtros"]), self._a_json(resumen["uso_modelo"]),
+        )
+
+    def _insertar(self, conexion, ejecucion):
+        resultados = ejecucion.get("resultados") or []
+        datos = {k: v for k, v in ejecucion.items() if k != "resultados"}
+        resumen = resumir_ejecucion(ejecucion, self.completar_uso)
+        cursor = conexion.execute(
+            "INSERT INTO ejecuciones (timestamp, puesto, num_candidatos, pesos_usados, datos, aptos, no_aptos, no_procesados, "
+            "puntuacion_min, puntuacion_media, puntuacion_max, histograma, filtros, uso_modelo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                ejecucion.get("timestamp") or "", ejecucion.get("puesto"), len(resultados),
+                self._a_json(ejecucion.get("pesos_usados")), json.dumps(datos, ensure_ascii=False),
+            ) + self._valores_agregados(resumen)
+        )
+        ejecucion_id = cursor.lastrowid
+        filas = []
+        for posicion, resultado in enumerate(resultados):
+            es_dict = isinstance(resultado, dict)
+            apto = resultado.get("apto") if es_dict else None
+            puntuacion = resultado.get("puntuacionPuesto") if es_dict else None
+            filas.append((
+                ejecucion_id, posicion,
+                resultado.get("nombre") if es_dict else None,
+                resultado.get("apellidos") if es_dict else None,
+                (resultado.get("nombre_archivo_cv") or resultado.get("nombre_cv")) if es_dict else None,
+                int(bool(apto)) if isinstance(apto, bool) else None,
+                float(puntuacion) if isinstance(puntuacion, (int, float)) and not isinstance(puntuacion, bool) else None,
+                str(resultado["error"]) if es_dict and "error" in resultado else None,
+                json.dumps(resultado, ensure_ascii=False),
+            ))
+        conexion.executemany(
+            "INSERT INTO candidatos (ejecucion_id, posicion, nombre, apellidos, nombre_archivo_cv, apto, puntuacionPuesto, error, datos) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            filas
+        )
+
+    def anadir(self, ejecucion):
+        """Guarda una ejecución, sus agregados y sus candidatos en una sola transacción."""
+        conexion = self._conexion()
+        with conexion:
+            self._insertar(conexion, ejecucion)
+
+    def importar(self, ejecuciones):
+        """Inserta muchas ejecuciones en una sola transacción (migración)."""
+        conexion = self._conexion()
+        with conexion:
+            for ejecucion in ejecuciones:
+                self._insertar(conexion, ejecucion)
+
+    def _reconstruir(self, fila):
+        """Vuelve a montar el diccionario de la ejecución, con sus resultados en orden."""
+        ejecucion = json.loads(fila["datos"])
+        ejecucion["resultados"] = [
+            json.loads(candidato["datos"])
+            for candidato in self._conexion().execute(
+                "SELECT datos FROM candidatos WHERE ejecucion_id = ? ORDER BY posicion", (fila["id"],)
+            )
+        ]
+        return ejecucion
+
+    @staticmethod
+    def _fila_a_resumen(fila):
+        return {
+            "timestamp": fila["timestamp"],
+            "puesto": fila["puesto"],
+            "num_candidatos": fila["num_candidatos"],
+            "counts": {"apto": fila["aptos"], "no_apto": fila["no_aptos"], "no_procesado": fila["no_procesados"]},
+            "puntuacion": {
+                "min": fila["puntuacion_min"],
+                "media": fila["puntuacion_media"],
+                "max": fila["puntuacion_max"],
+                "histograma": json.loads(fila["histograma"]),
+            },
+            "pesos_usados": json.loads(fila["pesos_usados"]) if fila["pesos_usados"] else None,
+            "filtros": json.loads(fila["filtros"]) if fila["filtros"] else None,
+            "uso_modelo": json.loads(fila["uso_modelo"]) if fila["uso_modelo"] else None,
+        }
+
+    def pagina(self, limite, cursor=None, puesto=None, desde=None, hasta=None, min_candidatos=None):
+        """
+        Hasta `limite` resúmenes (sin los resultados) que cumplan los filtros, de la
+        ejecución más reciente a la más antigua y empezando detrás de `cursor`.
+        Devuelve (resumenes, siguiente_cursor); siguiente_cursor es None en la última página.
+        Se recorre el índice por (timestamp, id), o por (puesto, timestamp) si se filtra por puesto.
+        """
+        condiciones, parametros = [], []
+        if cursor:
+            condiciones.append("(timestamp, id) < (?, ?)")
+            parametros += decodificar_cursor(cursor, self.TIPO_DESEMPATE)
+        if puesto is not None:
+            condiciones.append("puesto = ?")
+            parametros.append(puesto)
+        if desde is not None:
+            condiciones.append("timestamp >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append("timestamp < ?")
+            parametros.append(hasta)
+        if min_candidatos is not None:
+            condiciones.append("num_candidatos >= ?")
+            parametros.append(min_candidatos)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        # Se pide una fila de más para saber si hay página siguiente
+        filas = self._conexion().execute(
+            f"SELECT id, {self.COLUMNAS_RESUMEN} FROM ejecuciones {donde} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            parametros + [limite + 1]
+        ).fetchall()
+        siguiente = None
+        if len(filas) > limite:
+            filas = filas[:limite]
+            siguiente = codificar_cursor(filas[-1]["timestamp"], filas[-1]["id"])
+        return [self._fila_a_resumen(fila) for fila in filas], siguiente
+
+    def obtener_resumen(self, timestamp):
+        """Resumen de la ejecución con ese timestamp, o None."""
+        fila = self._conexion().execute(
+            f"SELECT {self.COLUMNAS_RESUMEN} FROM ejecuciones WHERE timestamp = ? ORDER BY id LIMIT 1", (timestamp,)
+        ).fetchone()
+        return self._fila_a_resumen(fila) if fila is not None else None
+
+    def obtener(self, timestamp):
+        """Ejecución completa con ese timestamp, o None."""
+        fila = self._conexion().execute(
+            "SELECT id, datos FROM ejecuciones WHERE timestamp = ? ORDER BY id LIMIT 1", (timestamp,)
+        ).fetchone()
+        return self._reconstruir(fila) if fila is not None else None
+
+
+def leer_ejecuciones(ruta):
+    """Lee un historial en cualquiera de los formatos de archivo (.json antiguo o .jsonl)."""
+    if ruta.endswith(".jsonl"):
+        ejecuciones, _ = leer_lineas_jsonl(ruta)
+        return [ejecucion for _, _, ejecucion in ejecuciones]
+    return leer_historial_antiguo(ruta)
+
+
+def migrar_a_sqlite(origen, destino):
+    """Copia todas las ejecuciones de un historial en archivo a una base de datos SQLite."""
+    if os.path.exists(destino):
+        raise FileExistsError(f"La base de datos '{destino}' ya existe; no se sobrescribe.")
+    inicio = time.perf_counter()
+    ejecuciones = leer_ejecuciones(origen)
+    almacen = HistorialSQLite(destino)
+    almacen.importar(ejecuciones)
+    candidatos = sum(len(e.get("resultados") or []) for e in ejecuciones)
+    print(f"Migradas {len(ejecuciones)} ejecuciones ({candidatos} candidatos) de '{origen}' a '{destino}' en {time.perf_counter() - inicio:.2f} s.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migra el historial de ejecuciones de CVisualizer a SQLite.")
+    parser.add_argument("--origen", default="./historial_ejecuciones.jsonl", help="Historial actual (.json o .jsonl)")
+    parser.add_argument("--destino", default="./historial_ejecuciones.db", help="Base de datos SQLite a crear")
+    argumentos = parser.parse_args()
+    migrar_a_sqlite(argumentos.origen, argumentos.destino)
@@ -0,0 +1,160 @@
+###### TFG CVisualizer Métricas compartidas ######
+###### Formato de exposición de Prometheus    ######
+
+# Contadores e histogramas en memoria, exportados en el formato de texto de
+# Prometheus por el endpoint /metrics de cada backend. No depende de
+# prometheus_client: cada observación es un bisect y una suma bajo un lock.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+
+# Límites (en segundos) de los buckets de latencia por defecto
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def formatear_etiquetas(nombres, valores, extra=None):
+    """Devuelve '{a="x",b="y"}' escapando los valores, o '' si no hay etiquetas."""
+    pares = list(zip(nombres, valores)) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{nombre}="{escapar(valor)}"' for nombre, valor in pares) + "}"
+
+
+def formatear_valor(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador monótono con etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(etiquetas.get(nombre, "") for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for clave, valor in valores:
+            lineas.append(f"{self.nombre}{formatear_etiquetas(self.etiquetas, clave)} {formatear_valor(valor)}")
+        return lineas
+
+
+class Histograma:
+    """Histograma de buckets fijos con etiquetas."""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # etiquetas -> [cuentas por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas.get(nombre, "") for nombre in self.etiquetas)
+        posicion = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]
+            if posicion < len(self.buckets):
+                serie[0][posicion] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Mide la duración del bloque (también sirve como decorador)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = sorted((clave, (list(cuentas), suma, total)) for clave, (cuentas, suma, total) in self._series.items())
+        for clave, (cuentas, suma, total) in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets, cuentas):
+                acumulado += cuenta
+                lineas.append(f"{self.nombre}_bucket{formatear_etiquetas(self.etiquetas, clave, {'le': formatear_valor(float(limite))})} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{formatear_etiquetas(self.etiquetas, clave, {'le': '+Inf'})} {total}")
+            lineas.append(f"{self.nombre}_sum{formatear_etiquetas(self.etiquetas, clave)} {formatear_valor(suma)}")
+            lineas.append(f"{self.nombre}_count{formatear_etiquetas(self.etiquetas, clave)} {total}")
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas de un backend, en el orden en que se exportan."""
+
+    def __init__(self):
+        self._metricas = []
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        metrica = Histograma(nombre, ayuda, etiquetas, buckets)
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self):
+        """Texto completo en el formato de exposición de Prometheus."""
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+def instrumentar_app(app, registro):
+    """
+    Cuenta las peticiones por ruta, método y código de estado, mide su duración
+    y añade el endpoint /metrics a la app. En las respuestas en streaming la
+    duración es la de preparar la respuesta, no la de enviarla completa.
+    """
+    peticiones = registro.contador(
+        "http_peticiones_total", "Peticiones HTTP atendidas por ruta, método y código de estado.",
+        ("ruta", "metodo", "estado")
+    )
+    duracion = registro.histograma(
+        "http_duracion_peticion_segundos", "Duración de las peticiones HTTP por ruta y método.",
+        ("ruta", "metodo")
+    )
+
+    @app.before_request
+    def iniciar_medicion_peticion():
+        g.inicio_peticion_metricas = time.perf_counter()
+
+    @app.after_request
+    def registrar_medicion_peticion(response):
+        # Las rutas se etiquetan por su patrón (p. ej. /jobs/<job_id>) para no disparar la cardinalidad
+        ruta = request.url_rule.rule if request.url_rule is not None else "sin_ruta"
+        peticiones.inc(ruta=ruta, metodo=request.method, estado=response.status_code)
+        inicio = g.get("inicio_peticion_metricas")
+        if inicio is not None:
+            duracion.observar(time.perf_counter() - inicio, ruta=ruta, metodo=request.method)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_route():
+        """Exporta las métricas del backend para Prometheus."""
+        return Response(registro.exponer(), mimetype="text/plain; version=0.0.4; charset=utf-8")
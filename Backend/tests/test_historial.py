@@ -0,0 +1,108 @@
+###### TFG CVisualizer Pruebas del historial de ejecuciones ######
+
+# Ejecutar desde Backend/:  python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import historial
+
+
+def ejecucion(timestamp, puesto="P"):
+    return {"timestamp": timestamp, "puesto": puesto, "resultados": []}
+
+
+class HistorialJSONLTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.directorio, "historial.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def abrir(self):
+        return historial.HistorialJSONL(self.ruta, compactar_cada=0)
+
+    def test_cursor_sigue_valiendo_despues_de_compactar(self):
+        # Una línea dañada y una ejecución repetida al principio: al compactar se
+        # eliminan y cambian las posiciones de todas las demás
+        with open(self.ruta, "wb") as f:
+            f.write(b"{danada\n")
+            f.write(historial.HistorialJSONL._serializar(ejecucion("2025-01-01T00:00:00", "repetida")) * 2)
+        almacen = self.abrir()
+        for i in range(30):
+            # Tres ejecuciones por timestamp, para que el cursor tenga que desempatar
+            almacen.anadir(ejecucion(f"2025-01-{i // 3 + 2:02d}T00:00:00", f"P{i}"))
+
+        primera, cursor = almacen.pagina(10)
+        almacen.compactar()
+        resto = []
+        while cursor:
+            pagina, cursor = almacen.pagina(10, cursor)
+            resto += pagina
+
+        # Todas las ejecuciones (la repetida, una vez) sin saltos ni repeticiones
+        vistas = [e["puesto"] for e in primera + resto]
+        self.assertEqual(sorted(vistas), sorted([f"P{i}" for i in range(30)] + ["repetida"]))
+
+    def test_anadir_actualiza_el_indice_en_memoria_en_el_sitio(self):
+        almacen = self.abrir()
+        almacen.anadir(ejecucion("2025-01-01T00:00:00", "A"))
+        indice = almacen._indice
+        # Algunas fuera de orden, para que no todas acaben al final
+        for i, timestamp in enumerate(["2025-01-03T00:00:00", "2025-01-02T00:00:00", "2025-01-03T00:00:00", "2024-12-31T00:00:00"]):
+            almacen.anadir(ejecucion(timestamp, "AB"[i % 2]))
+        almacen.pagina(10)
+
+        # Ni se copia ni se vuelve a leer el archivo, y queda igual que uno rehecho desde disco
+        self.assertIs(almacen._indice, indice)
+        rehecho = self.abrir()._indice
+        self.assertEqual(indice.claves, rehecho.claves)
+        self.assertEqual({puesto: claves for puesto, (claves, _) in indice.por_puesto.items()},
+                         {puesto: claves for puesto, (claves, _) in rehecho.por_puesto.items()})
+        self.assertEqual(indice.version, almacen._version_indice())
+
+    def test_pagina_con_filtros_coincide_con_recorrer_todo(self):
+        almacen = self.abrir()
+        for i in range(40):
+            almacen.anadir(ejecucion(f"2025-01-{i % 20 + 1:02d}T00:00:00", f"P{i % 3}"))
+        todas, _ = almacen.pagina(100)
+        for filtros in ({"puesto": "P1"}, {"desde": "2025-01-05", "hasta": "2025-01-12"}, {"puesto": "P2", "desde": "2025-01-10"}):
+            esperadas = [
+                e for e in todas
+                if e["puesto"] == filtros.get("puesto", e["puesto"])
+                and e["timestamp"] >= filtros.get("desde", "")
+                and e["timestamp"] < filtros.get("hasta", "9999")
+            ]
+            vistas, cursor = almacen.pagina(4, **filtros)
+            while cursor:
+                pagina, cursor = almacen.pagina(4, cursor, **filtros)
+                vistas += pagina
+            self.assertEqual(vistas, esperadas, filtros)
+
+    def test_vuelve_a_leer_el_indice_si_otro_proceso_lo_cambia(self):
+        almacen = self.abrir()
+        almacen.anadir(ejecucion("2025-01-01T00:00:00", "A"))
+        almacen.pagina(10)
+        indice = almacen._indice
+
+        self.abrir().anadir(ejecucion("2025-01-02T00:00:00", "B"))
+        pagina, _ = almacen.pagina(10)
+        self.assertEqual([e["puesto"] for e in pagina], ["B", "A"])
+        self.assertIsNot(almacen._indice, indice)
+
+        # Tras releerlo, sus propias escrituras vuelven a añadirse en el sitio
+        indice = almacen._indice
+        almacen.anadir(ejecucion("2025-01-03T00:00:00", "C"))
+        self.assertEqual(almacen.obtener("2025-01-03T00:00:00")["puesto"], "C")
+        self.assertIs(almacen._indice, indice)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+###### TFG CVisualizer Pruebas del limitador de llamadas al modelo ######
+
+# Ejecutar desde Backend/:  python -m unittest discover tests
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ProgramaLlamadasIA = None
+
+
+def setUpModule():
+    global ProgramaLlamadasIA
+    # El módulo crea el historial y las cachés en el directorio actual al importarse
+    os.chdir(tempfile.mkdtemp())
+    import ProgramaLlamadasIA
+
+
+class ErrorSaturacion(Exception):
+    """Error con la forma de un 429 de la API, con un retryDelay fijo para que la espera sea predecible."""
+
+    code = 429
+
+    def __init__(self, retardo):
+        super().__init__(f"429 RESOURCE_EXHAUSTED {{'retryDelay': '{retardo}s'}}")
+
+
+class LimitadorGeminiTest(unittest.TestCase):
+
+    def crear(self, espera=0.5, **opciones):
+        # Un solo hueco de concurrencia y cuotas que no limitan; la espera entre reintentos es siempre `espera`
+        return ProgramaLlamadasIA.LimitadorGemini(6000, 10 ** 9, 1, 1, 2, espera, espera, **opciones)
+
+    def test_la_espera_del_reintento_no_ocupa_el_hueco(self):
+        limitador = self.crear()
+        primer_fallo = threading.Event()
+        intentos = []
+
+        def llamada_saturada():
+            intentos.append(time.monotonic())
+            if len(intentos) == 1:
+                primer_fallo.set()
+                raise ErrorSaturacion(0.5)
+            return "primera"
+
+        resultados = {}
+        hilo = threading.Thread(target=lambda: resultados.update(primera=limitador.ejecutar(llamada_saturada, 10)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            hilo.start()
+            self.assertTrue(primer_fallo.wait(5))
+            # Con el único hueco libre durante la espera, otra llamada no tiene que esperar al reintento
+            inicio = time.monotonic()
+            self.assertEqual(limitador.ejecutar(lambda: "segunda", 10), "segunda")
+            self.assertLess(time.monotonic() - inicio, 0.3)
+            self.assertEqual(len(intentos), 1)
+            hilo.join(5)
+
+        self.assertEqual(resultados, {"primera": "primera"})
+        self.assertEqual(len(intentos), 2)
+        self.assertEqual(limitador.estadisticas()["reintentos"], 1)
+        self.assertEqual(limitador.concurrencia.en_curso, 0)
+
+    def test_libera_el_hueco_si_la_llamada_falla(self):
+        limitador = self.crear(espera=0.01)
+
+        def llamada_rota():
+            raise ValueError("respuesta inválida")
+
+        def llamada_saturada():
+            raise ErrorSaturacion(0.01)
+
+        with self.assertRaises(ValueError):
+            limitador.ejecutar(llamada_rota, 10)
+        # Agotando los reintentos también se devuelve el hueco
+        with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(ErrorSaturacion):
+            limitador.ejecutar(llamada_saturada, 10)
+        self.assertEqual(limitador.concurrencia.en_curso, 0)
+
+
+class CircuitoModeloTest(unittest.TestCase):
+
+    def crear(self, espera_segundos=0.1):
+        # Se abre con la mitad de fallos (o de llamadas lentas, de 1 s o más) entre las 4 últimas
+        return ProgramaLlamadasIA.CircuitoModelo(4, 4, 0.5, 1.0, 0.5, espera_segundos, 1)
+
+    def abrir(self, circuito):
+        for exito in (True, True, False, False):
+            circuito.permitir()
+            circuito.registrar(exito, 0.01)
+
+    def test_se_abre_con_fallos_y_rechaza_al_momento(self):
+        circuito = self.crear(espera_segundos=60)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.abrir(circuito)
+        self.assertEqual(circuito.estado, circuito.ABIERTO)
+        with self.assertRaises(ProgramaLlamadasIA.CircuitoAbiertoError) as contexto:
+            circuito.permitir()
+        self.assertGreater(contexto.exception.reintentar_en, 50)
+
+    def test_se_abre_con_llamadas_lentas(self):
+        circuito = self.crear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for latencia in (0.01, 0.01, 2.0, 2.0):
+                circuito.permitir()
+                circuito.registrar(True, latencia)
+        self.assertEqual(circuito.estado, circuito.ABIERTO)
+
+    def test_semiabierto_deja_pasar_una_sola_sonda(self):
+        circuito = self.crear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.abrir(circuito)
+            time.sleep(0.15)
+            circuito.permitir()
+            self.assertEqual(circuito.estado, circuito.SEMIABIERTO)
+            with self.assertRaises(ProgramaLlamadasIA.CircuitoAbiertoError):
+                circuito.permitir()
+            # Si la sonda no llega a llamar al modelo, su plaza vuelve a quedar libre
+            circuito.liberar_sonda()
+            circuito.permitir()
+            circuito.registrar(True, 0.01)
+        self.assertEqual(circuito.estado, circuito.CERRADO)
+
+    def test_una_sonda_lenta_vuelve_a_abrir(self):
+        circuito = self.crear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.abrir(circuito)
+            time.sleep(0.15)
+            circuito.permitir()
+            circuito.registrar(True, 2.0)
+        self.assertEqual(circuito.estado, circuito.ABIERTO)
+
+    def test_los_errores_de_la_peticion_no_abren_el_circuito(self):
+        circuito = self.crear()
+        limitador = ProgramaLlamadasIA.LimitadorGemini(6000, 10 ** 9, 1, 1, 0, 0.01, 0.01, circuito=circuito)
+        error = ValueError("petición no válida")
+        error.code = 400
+
+        def llamada_rechazada():
+            raise error
+
+        for _ in range(4):
+            with self.assertRaises(ValueError):
+                limitador.ejecutar(llamada_rechazada, 10)
+        self.assertEqual(circuito.estado, circuito.CERRADO)
+
+
+class EjecutorCoberturaTest(unittest.TestCase):
+
+    def crear(self, plazo_segundos=0.2, activada=False):
+        # Con la cobertura activada se lanza en cuanto hay 3 latencias anotadas (percentil 50)
+        return ProgramaLlamadasIA.EjecutorCobertura(plazo_segundos, activada, 50, 1.0, 3, 10, 4)
+
+    def test_el_plazo_no_libera_hasta_que_acaba_la_llamada(self):
+        ejecutor = self.crear()
+        soltar = threading.Event()
+        terminado = threading.Event()
+        self.addCleanup(soltar.set)
+
+        with self.assertRaises(ProgramaLlamadasIA.PlazoExcedidoError):
+            ejecutor.ejecutar(lambda: soltar.wait(5), al_terminar=terminado.set)
+        # La llamada abandonada sigue en el pool: todavía no ha terminado
+        self.assertFalse(terminado.wait(0.1))
+        soltar.set()
+        self.assertTrue(terminado.wait(2))
+        self.assertEqual(ejecutor.estadisticas()["plazos_excedidos"], 1)
+
+    def test_la_cobertura_gana_y_la_original_sigue_contando(self):
+        ejecutor = self.crear(plazo_segundos=5.0, activada=True)
+        for _ in range(3):
+            ejecutor.ejecutar(lambda: "rápida")
+        soltar = threading.Event()
+        terminado = threading.Event()
+        self.addCleanup(soltar.set)
+        lanzadas = []
+
+        def llamada():
+            lanzadas.append(None)
+            if len(lanzadas) == 1:
+                soltar.wait(5)
+                return "original"
+            return "cobertura"
+
+        self.assertEqual(ejecutor.ejecutar(llamada, al_terminar=terminado.set), "cobertura")
+        self.assertEqual(ejecutor.coberturas_ganadas, 1)
+        self.assertFalse(terminado.wait(0.1))
+        soltar.set()
+        self.assertTrue(terminado.wait(2))
+
+    def test_el_limitador_mantiene_el_hueco_de_la_llamada_abandonada(self):
+        limitador = ProgramaLlamadasIA.LimitadorGemini(6000, 10 ** 9, 1, 1, 0, 0.01, 0.01, cobertura=self.crear())
+        soltar = threading.Event()
+        self.addCleanup(soltar.set)
+
+        with self.assertRaises(ProgramaLlamadasIA.PlazoExcedidoError):
+            limitador.ejecutar(lambda: soltar.wait(5), 10)
+        self.assertEqual(limitador.concurrencia.en_curso, 1)
+        soltar.set()
+        for _ in range(200):
+            if limitador.concurrencia.en_curso == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(limitador.concurrencia.en_curso, 0)
+
+
+class ConcurrenciaAIMDTest(unittest.TestCase):
+
+    def test_reparte_los_huecos_segun_el_peso_de_cada_clase(self):
+        interactiva, masiva = ProgramaLlamadasIA.PRIORIDAD_INTERACTIVA, ProgramaLlamadasIA.PRIORIDAD_MASIVA
+        concurrencia = ProgramaLlamadasIA.ConcurrenciaAIMD(1, 1, 1, {interactiva: 2.0, masiva: 1.0})
+        concurrencia.adquirir(masiva)
+        orden = []
+
+        def esperar_turno(clase):
+            concurrencia.adquirir(clase)
+            orden.append(clase)
+            concurrencia.liberar()
+
+        # Cuatro llamadas masivas y, detrás, tres interactivas; se encolan de una en una
+        hilos = []
+        for clase in [masiva] * 4 + [interactiva] * 3:
+            esperando = sum(concurrencia.en_cola().values())
+            hilo = threading.Thread(target=esperar_turno, args=(clase,))
+            hilo.start()
+            hilos.append(hilo)
+            while sum(concurrencia.en_cola().values()) == esperando:
+                time.sleep(0.001)
+        concurrencia.liberar()
+        for hilo in hilos:
+            hilo.join(5)
+
+        # Las interactivas adelantan a las masivas, pero estas siguen recibiendo su parte
+        self.assertEqual(orden, [interactiva, masiva, interactiva, interactiva, masiva, masiva, masiva])
+        self.assertEqual(concurrencia.en_curso, 0)
+
+    def test_la_saturacion_reduce_a_la_mitad_una_vez_por_rafaga(self):
+        concurrencia = ProgramaLlamadasIA.ConcurrenciaAIMD(8, 1, 16)
+        concurrencia.saturacion()
+        concurrencia.saturacion()
+        self.assertEqual(concurrencia.limite, 4)
+        concurrencia.exito()
+        self.assertEqual(concurrencia.limite, 4.25)
+
+
+class CuboTokensTest(unittest.TestCase):
+
+    def test_no_concede_mas_de_la_capacidad(self):
+        cubo = ProgramaLlamadasIA.CuboTokens(60) # Se repone un token por segundo
+        self.assertTrue(cubo.intentar_adquirir(60))
+        self.assertFalse(cubo.intentar_adquirir(1))
+
+    def test_ajustar_descuenta_el_uso_real(self):
+        cubo = ProgramaLlamadasIA.CuboTokens(60)
+        cubo.ajustar(100) # La llamada gastó 100 tokens más de lo estimado: el cubo queda en negativo
+        self.assertFalse(cubo.intentar_adquirir(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
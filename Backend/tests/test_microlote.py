@@ -0,0 +1,77 @@
+###### TFG CVisualizer Pruebas de los micro-lotes ######
+
+# Ejecutar desde Backend/:  python -m unittest discover tests
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ProgramaLlamadasIA = None
+
+
+def setUpModule():
+    global ProgramaLlamadasIA
+    # El módulo crea el historial y las cachés en el directorio actual al importarse
+    os.chdir(tempfile.mkdtemp())
+    import ProgramaLlamadasIA
+
+
+def pdf_nuevo():
+    """Bytes distintos en cada llamada, para que ningún CV salga de la caché de resultados."""
+    return f"%PDF-1.4 CV {uuid.uuid4()}".encode()
+
+
+class MicroLoteadorTest(unittest.TestCase):
+
+    def setUp(self):
+        # Motor simulado sin latencia, aunque las pruebas se ejecuten con otro motor configurado
+        motor = mock.patch.object(ProgramaLlamadasIA, "motor_llm", ProgramaLlamadasIA.MotorSimulado("fija:0"))
+        motor.start()
+        self.addCleanup(motor.stop)
+
+    def enviar_a_la_vez(self, loteador, cantidad):
+        """Envía `cantidad` CVs del mismo puesto en paralelo y devuelve el resultado o el error de cada uno."""
+        def enviar(pdf_bytes):
+            try:
+                return loteador.enviar(pdf_bytes, "Puesto", {})
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=cantidad) as pool:
+            return list(pool.map(enviar, [pdf_nuevo() for _ in range(cantidad)]))
+
+    def test_combina_los_cvs_del_mismo_puesto(self):
+        loteador = ProgramaLlamadasIA.MicroLoteador(5.0, 2, plazo_segundos=5.0)
+        resultados = self.enviar_a_la_vez(loteador, 2)
+        self.assertTrue(all(isinstance(resultado, dict) for resultado in resultados), resultados)
+        self.assertEqual(loteador.lotes_combinados, 1)
+        self.assertEqual(loteador.documentos_combinados, 2)
+
+    def test_un_error_al_preparar_el_lote_llega_a_todas_las_peticiones(self):
+        loteador = ProgramaLlamadasIA.MicroLoteador(5.0, 2, plazo_segundos=5.0)
+        error = RuntimeError("PDF ilegible")
+        inicio = time.monotonic()
+        with mock.patch.object(ProgramaLlamadasIA, "preparar_documento", side_effect=error), contextlib.redirect_stdout(io.StringIO()):
+            resultados = self.enviar_a_la_vez(loteador, 2)
+        # Ninguna petición se queda esperando al plazo: reciben el error del grupo
+        self.assertEqual(resultados, [error, error])
+        self.assertLess(time.monotonic() - inicio, 2.0)
+
+    def test_sin_respuesta_lanza_plazo_excedido(self):
+        loteador = ProgramaLlamadasIA.MicroLoteador(0.01, 1, plazo_segundos=0.2)
+        # Un grupo que nunca llega a resolverse
+        with mock.patch.object(loteador, "_procesar_grupo_pendiente"):
+            with self.assertRaises(ProgramaLlamadasIA.PlazoExcedidoError):
+                loteador.enviar(pdf_nuevo(), "Puesto", {})
+
+
+if __name__ == '__main__':
+    unittest.main()
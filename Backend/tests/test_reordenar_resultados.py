@@ -0,0 +1,74 @@
+###### TFG CVisualizer Pruebas de reordenar_resultados ######
+
+# Ejecutar desde Backend/:  python -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ProgramaLlamadasIA = None
+
+
+def setUpModule():
+    global ProgramaLlamadasIA
+    # El módulo crea el historial y las cachés en el directorio actual al importarse
+    os.chdir(tempfile.mkdtemp())
+    import ProgramaLlamadasIA
+
+
+# Ejecución antigua (sin subpuntuaciones ni pesos guardados) con los porcentaje_* en
+# escalas mezcladas, tal como aparecían en el historial antiguo (historial_ejecuciones.json)
+RESULTADOS_ANTIGUOS = [
+    {"nombre": "Guillermo", "apto": False, "puntuacionPuesto": 4, "porcentaje_experiencia": 1.75, "porcentaje_educacion": 2.4, "porcentaje_habilidades": 1.6, "porcentaje_idiomas": 0.8, "porcentaje_otros": 0.4},
+    {"nombre": "Javier", "apto": False, "puntuacionPuesto": 4, "porcentaje_experiencia": 0.175, "porcentaje_educacion": 0.3, "porcentaje_habilidades": 0.2, "porcentaje_idiomas": 0.1, "porcentaje_otros": 0.025},
+    {"nombre": "Noelia", "apto": True, "puntuacionPuesto": 8, "porcentaje_experiencia": 0.35, "porcentaje_educacion": 0.3, "porcentaje_habilidades": 0.2, "porcentaje_idiomas": 0.1, "porcentaje_otros": 0.05},
+    {"nombre": "Pedro", "apto": False, "puntuacionPuesto": 4, "porcentaje_experiencia": 10.5, "porcentaje_educacion": 18.0, "porcentaje_habilidades": 12.0, "porcentaje_idiomas": 6.0, "porcentaje_otros": 3.5},
+]
+
+
+class ReordenarResultadosAntiguosTest(unittest.TestCase):
+
+    def reordenar(self, resultados, pesos_nuevos):
+        pesos_anteriores = ProgramaLlamadasIA.PESOS_POR_DEFECTO
+        ranking, sin_puntuar = ProgramaLlamadasIA.reordenar_resultados(resultados, pesos_nuevos, pesos_anteriores)
+        return {fila["nombre"]: fila for fila in ranking}, sin_puntuar
+
+    def test_mismos_pesos_conserva_puntuaciones_con_escalas_mezcladas(self):
+        ranking, sin_puntuar = self.reordenar(RESULTADOS_ANTIGUOS, ProgramaLlamadasIA.PESOS_POR_DEFECTO)
+        self.assertEqual(sin_puntuar, 0)
+        self.assertAlmostEqual(ranking["Noelia"]["puntuacion"], 8.0, places=2)
+        self.assertEqual(ranking["Noelia"]["posicion"], 1)
+        for nombre in ("Guillermo", "Javier", "Pedro"):
+            self.assertAlmostEqual(ranking[nombre]["puntuacion"], 4.0, places=2)
+            self.assertEqual(ranking[nombre]["fuente"], "porcentajes")
+
+    def test_la_escala_de_los_porcentajes_no_cambia_el_resultado(self):
+        # Javier y Pedro tienen el mismo reparto relativo salvo por la escala (x60)
+        javier = dict(RESULTADOS_ANTIGUOS[1], porcentaje_otros=0.05)
+        pedro = {**javier, "nombre": "Pedro", **{k: v * 60 for k, v in javier.items() if k.startswith("porcentaje_")}}
+        pesos_nuevos = {"peso_experiencia": 10, "peso_educacion": 60, "peso_habilidades": 10, "peso_idiomas": 10, "peso_otros": 10}
+        ranking, _ = self.reordenar([javier, pedro], pesos_nuevos)
+        self.assertAlmostEqual(ranking["Javier"]["puntuacion"], ranking["Pedro"]["puntuacion"], places=2)
+
+    def test_filas_con_porcentajes_a_cero_se_omiten(self):
+        sin_porcentajes = {"nombre": "Vacio", "puntuacionPuesto": 6, **{f"porcentaje_{c}": 0 for c in ProgramaLlamadasIA.CRITERIOS_EVALUACION}}
+        ranking, sin_puntuar = self.reordenar(RESULTADOS_ANTIGUOS + [sin_porcentajes], ProgramaLlamadasIA.PESOS_POR_DEFECTO)
+        self.assertNotIn("Vacio", ranking)
+        self.assertEqual(sin_puntuar, 1)
+
+    def test_quien_no_cumple_los_filtros_no_pasa_a_apto(self):
+        subpuntuaciones = {f"subpuntuacion_{c}": 9 for c in ProgramaLlamadasIA.CRITERIOS_EVALUACION}
+        descartado = {"nombre": "Filtrado", "apto": False, "cumpleFiltros": False, "puntuacionPuesto": 9, **subpuntuaciones}
+        sin_dato = {"nombre": "SinDato", "apto": True, "puntuacionPuesto": 9, **subpuntuaciones}
+        ranking, _ = self.reordenar([descartado, sin_dato], ProgramaLlamadasIA.PESOS_POR_DEFECTO)
+        self.assertFalse(ranking["Filtrado"]["apto"])
+        self.assertTrue(ranking["SinDato"]["apto"])
+        # Coincide con la puntuación de un análisis nuevo
+        self.assertEqual(ranking["Filtrado"]["apto"], ProgramaLlamadasIA.puntuar_resultado(descartado, ProgramaLlamadasIA.PESOS_POR_DEFECTO)["apto"])
+
+
+if __name__ == '__main__':
+    unittest.main()
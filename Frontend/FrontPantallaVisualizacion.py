@@ -52,15 +52,29 @@ RUTA_ARCHIVO_PROFESIONES = "./Profesiones.csv"
 # Endpoint del backend principal (procesamiento de CVs) - Asumimos puerto 5001
 BACKEND_CV_URL = "http://127.0.0.1:5001"
 ENDPOINT_PROCESAR_PDF = f"{BACKEND_CV_URL}/procesar_pdf"
+ENDPOINT_PROCESAR_LOTE_EVENTOS = f"{BACKEND_CV_URL}/procesar_lote/eventos"
 ENDPOINT_GUARDAR_HISTORIAL = f"{BACKEND_CV_URL}/guardar_resultados_masivos"
 ENDPOINT_HISTORIAL_EJECUCIONES = f"{BACKEND_CV_URL}/historial_ejecuciones"
 ENDPOINT_DETALLES_EJECUCION = f"{BACKEND_CV_URL}/detalles_ejecucion"
+# Ejecuciones que se piden al backend en cada página del historial
+HISTORIAL_EJECUCIONES_POR_PAGINA = 25
 
 # Endpoint del backend de autenticación - ASEGÚRATE que este puerto coincide con tu auth_backend.py
 AUTH_BACKEND_URL = "http://127.0.0.1:5002" # <--- PUERTO DEL BACKEND DE AUTENTICACIÓN
 ENDPOINT_REGISTER = f"{AUTH_BACKEND_URL}/register"
 ENDPOINT_LOGIN = f"{AUTH_BACKEND_URL}/login"
 
+# --- Puntuación local ---
+# Criterios con subpuntuación (0-10) en los resultados y umbral de aptitud (el mismo que usa el backend)
+CRITERIOS_EVALUACION = ["experiencia", "educacion", "habilidades", "idiomas", "otros"]
+UMBRAL_APTO = float(os.environ.get("CVISUALIZER_UMBRAL_APTO", "5"))
+
+# Tiempo máximo de espera por CV en el envío uno a uno (conexión, respuesta). Un poco
+# mayor que el plazo de las llamadas al modelo en el backend, para recibir su error
+TIMEOUT_ANALISIS_CV = (10, float(os.environ.get("CVISUALIZER_TIMEOUT_ANALISIS_CV_SEGUNDOS", "150")))
+# En el lote el tiempo de respuesta se cuenta entre eventos: el backend emite uno por CV terminado
+TIMEOUT_LOTE_CV = TIMEOUT_ANALISIS_CV
+
 # --- Estilos personalizados ---
 st.markdown(
     """
@@ -339,24 +353,18 @@ def enviar_cv_y_profesion(
     try:
         with open(ruta_cv, "rb") as archivo_pdf:
             files = {"pdf": (nombre_cv, archivo_pdf, "application/pdf")}
-            data = {"puesto": profesion}
-
-            # Añadir filtros solo si tienen valor
-            if filtro_idioma: data["filtro_idioma"] = filtro_idioma
-            if filtro_experiencia_min is not None: data["filtro_experiencia_min"] = filtro_experiencia_min
-            if filtro_palabras_clave: data["filtro_palabras_clave"] = filtro_palabras_clave
-            if filtro_nivel_educativo: data["filtro_nivel_educativo"] = filtro_nivel_educativo
-            if filtro_sector: data["filtro_sector"] = filtro_sector
-
-            # Añadir pesos si no son None (estos valores los recibe el backend, pero OJO:
-            # el backend actual no los usa en el prompt a Gemini según el código previo)
-            if peso_experiencia is not None: data["peso_experiencia"] = peso_experiencia
-            if peso_educacion is not None: data["peso_educacion"] = peso_educacion
-            if peso_habilidades is not None: data["peso_habilidades"] = peso_habilidades
-            if peso_idiomas is not None: data["peso_idiomas"] = peso_idiomas
-            if peso_otros is not None: data["peso_otros"] = peso_otros
-
-            response = requests.post(ENDPOINT_PROCESAR_PDF, files=files, data=data)
+            data = construir_datos_formulario(
+                profesion,
+                filtro_idioma, filtro_experiencia_min, filtro_palabras_clave,
+                filtro_nivel_educativo, filtro_sector,
+                peso_experiencia, peso_educacion, peso_habilidades, peso_idiomas, peso_otros
+            )
+
+            # Forma parte de un procesamiento masivo: que no quite turno a los análisis interactivos
+            response = requests.post(
+                ENDPOINT_PROCESAR_PDF, files=files, data=data,
+                headers={"X-Prioridad": "masiva"}, timeout=TIMEOUT_ANALISIS_CV
+            )
 
             if response.status_code != 200:
                 print(f"Error al procesar {nombre_cv}. Estado: {response.status_code}. Respuesta: {response.text}")
@@ -368,19 +376,97 @@ def enviar_cv_y_profesion(
     except requests.exceptions.ConnectionError:
         st.error(f"Error: No se pudo conectar con el servidor backend de CVs en {BACKEND_CV_URL}. Asegúrate de que está corriendo.")
         return None
+    except requests.exceptions.Timeout:
+        # Se sigue con el resto de CVs en lugar de bloquear todo el procesamiento
+        st.error(f"El análisis del CV {nombre_cv} superó el tiempo máximo de espera ({TIMEOUT_ANALISIS_CV[1]:g} s).")
+        return None
     except Exception as e:
         st.error(f"Ocurrió un error al enviar el CV {nombre_cv}: {e}")
         print(f"Excepción al enviar CV {nombre_cv}: {e}")
         return None
 
+def construir_datos_formulario(
+    profesion,
+    filtro_idioma=None, filtro_experiencia_min=None, filtro_palabras_clave=None,
+    filtro_nivel_educativo=None, filtro_sector=None,
+    peso_experiencia=None, peso_educacion=None, peso_habilidades=None,
+    peso_idiomas=None, peso_otros=None
+):
+    """Construye los campos de formulario comunes (puesto, filtros y pesos) para el backend."""
+    data = {"puesto": profesion}
+
+    # Añadir filtros solo si tienen valor
+    if filtro_idioma: data["filtro_idioma"] = filtro_idioma
+    if filtro_experiencia_min is not None: data["filtro_experiencia_min"] = filtro_experiencia_min
+    if filtro_palabras_clave: data["filtro_palabras_clave"] = filtro_palabras_clave
+    if filtro_nivel_educativo: data["filtro_nivel_educativo"] = filtro_nivel_educativo
+    if filtro_sector: data["filtro_sector"] = filtro_sector
+
+    # Añadir pesos si no son None
+    if peso_experiencia is not None: data["peso_experiencia"] = peso_experiencia
+    if peso_educacion is not None: data["peso_educacion"] = peso_educacion
+    if peso_habilidades is not None: data["peso_habilidades"] = peso_habilidades
+    if peso_idiomas is not None: data["peso_idiomas"] = peso_idiomas
+    if peso_otros is not None: data["peso_otros"] = peso_otros
+    return data
+
+def leer_eventos_sse(response):
+    """Generador que convierte una respuesta Server-Sent Events en pares (evento, datos)."""
+    evento, datos = "message", []
+    for linea in response.iter_lines(decode_unicode=True):
+        if linea is None:
+            continue
+        if linea == "":
+            # Línea vacía: fin del evento actual
+            if datos:
+                yield evento, json.loads("\n".join(datos))
+            evento, datos = "message", []
+        elif linea.startswith("event:"):
+            evento = linea[len("event:"):].strip()
+        elif linea.startswith("data:"):
+            datos.append(linea[len("data:"):].strip())
+
+def enviar_lote_cvs(nombres_cv, data):
+    """
+    Envía todos los CVs en una sola petición a /procesar_lote/eventos y va
+    devolviendo (generador) cada evento de progreso según lo emite el backend.
+    Devuelve None si el backend no acepta el lote (no tiene el endpoint o responde
+    con un error, p. ej. 413 si supera el tamaño máximo), para enviarlos uno a uno.
+    """
+    archivos_abiertos = []
+    try:
+        files = []
+        for nombre_cv in nombres_cv:
+            archivo_pdf = open(os.path.join(RUTA_CARPETA_CV, nombre_cv), "rb")
+            archivos_abiertos.append(archivo_pdf)
+            files.append(("pdfs", (nombre_cv, archivo_pdf, "application/pdf")))
+
+        response = requests.post(
+            ENDPOINT_PROCESAR_LOTE_EVENTOS, files=files, data=data, stream=True, timeout=TIMEOUT_LOTE_CV
+        )
+        if response.status_code != 200:
+            if response.status_code != 404:
+                print(f"Error al procesar el lote de CVs. Estado: {response.status_code}. Mensaje: {response.text[:200]}... Se envían los CVs uno a uno.")
+            response.close()
+            return None
+        return (datos for evento, datos in leer_eventos_sse(response) if evento == "resultado")
+    finally:
+        for archivo_pdf in archivos_abiertos:
+            archivo_pdf.close()
+
 # Funciones para interactuar con el historial en el backend
-def guardar_resultados_en_historial(puesto, resultados_lista):
-    """Envía los resultados de un procesamiento masivo al backend para guardar historial."""
+def guardar_resultados_en_historial(puesto, resultados_lista, configuracion=None):
+    """
+    Envía los resultados de un procesamiento masivo al backend para guardar historial,
+    junto con los filtros y pesos usados (para comparar el coste entre configuraciones).
+    """
     try:
         data = {
             "puesto": puesto,
             "resultados": resultados_lista
         }
+        if configuracion:
+            data["configuracion"] = configuracion
         response = requests.post(ENDPOINT_GUARDAR_HISTORIAL, json=data)
         if response.status_code == 200:
              return True
@@ -399,10 +485,21 @@ def guardar_resultados_en_historial(puesto, resultados_lista):
         return False
 
 @st.cache_data(ttl=60) # Cachea los resultados por 60 segundos
-def obtener_historial_ejecuciones():
-    """Obtiene el resumen del historial de ejecuciones desde el backend."""
+def obtener_historial_ejecuciones(cursor=None, puesto=None, desde=None, hasta=None, min_candidatos=None):
+    """
+    Obtiene una página del resumen del historial de ejecuciones desde el backend,
+    filtrada allí. Devuelve (ejecuciones, siguiente_cursor); el cursor es None en la última página.
+    """
+    parametros = {
+        "limit": HISTORIAL_EJECUCIONES_POR_PAGINA,
+        "cursor": cursor,
+        "puesto": puesto,
+        "desde": desde,
+        "hasta": hasta,
+        "min_candidatos": min_candidatos,
+    }
     try:
-        response = requests.get(ENDPOINT_HISTORIAL_EJECUCIONES)
+        response = requests.get(ENDPOINT_HISTORIAL_EJECUCIONES, params={k: v for k, v in parametros.items() if v})
         if response.status_code == 200:
             historial_data = response.json()
             # Formatear la fecha para mejor visualización
@@ -412,20 +509,33 @@ def obtener_historial_ejecuciones():
                     ejecucion['fecha_hora'] = dt_object.strftime('%Y-%m-%d %H:%M:%S')
                 except ValueError:
                     ejecucion['fecha_hora'] = ejecucion['timestamp'] # Mantener original si falla
-            return historial_data
+            return historial_data, response.headers.get('X-Siguiente-Cursor')
         elif response.status_code == 501:
              # Esto podría ser un error si el endpoint no está implementado en el backend
              st.warning("El historial de análisis no está disponible en el backend de CV (endpoint /historial_ejecuciones no encontrado o no implementado).")
-             return []
+             return [], None
         else:
             st.error(f"Error al obtener historial del backend de CV. Estado: {response.status_code}. Mensaje: {response.text}")
-            return []
+            return [], None
     except requests.exceptions.ConnectionError:
         st.error(f"Error: No se pudo conectar con el servidor backend de CVs en {BACKEND_CV_URL} para obtener el historial. Asegúrate de que está corriendo.")
-        return []
+        return [], None
     except Exception as e:
         st.error(f"Error inesperado al obtener historial: {e}")
-        return []
+        return [], None
+
+def cargar_paginas_historial(filtros, num_paginas):
+    """
+    Encadena las primeras `num_paginas` páginas del historial (cada una cacheada por
+    separado). Devuelve (ejecuciones, siguiente_cursor).
+    """
+    ejecuciones, cursor = [], None
+    for _ in range(num_paginas):
+        pagina, cursor = obtener_historial_ejecuciones(cursor, **filtros)
+        ejecuciones.extend(pagina)
+        if not cursor:
+            break
+    return ejecuciones, cursor
 
 def obtener_detalles_ejecucion(timestamp):
     """Obtiene los detalles (recuentos) de una ejecución específica desde el backend."""
@@ -457,10 +567,52 @@ def procesar_cvs_masivamente(
     filtro_idioma=None, filtro_experiencia_min=None, filtro_palabras_clave=None,
     filtro_nivel_educativo=None, filtro_sector=None,
     peso_experiencia=None, peso_educacion=None, peso_habilidades=None,
-    peso_idiomas=None, peso_otros=None # Aceptar los pesos
+    peso_idiomas=None, peso_otros=None, # Aceptar los pesos
+    al_recibir_resultado=None
 ):
-    """Procesa todos los CVs en la carpeta y devuelve los resultados, pasando los pesos."""
+    """
+    Procesa todos los CVs en la carpeta y devuelve los resultados, pasando los pesos.
+    Si se indica `al_recibir_resultado`, se llama con (resultados, progreso) cada vez
+    que el backend termina un CV, para poder mostrar resultados parciales.
+    """
     resultados = []
+    total_cv = len(nombres_cv)
+    data = construir_datos_formulario(
+        profesion,
+        filtro_idioma, filtro_experiencia_min, filtro_palabras_clave,
+        filtro_nivel_educativo, filtro_sector,
+        peso_experiencia, peso_educacion, peso_habilidades, peso_idiomas, peso_otros
+    )
+    try:
+        resultados_lote = enviar_lote_cvs(nombres_cv, data)
+    except FileNotFoundError as e:
+        st.error(f"No se encontró el archivo: {e.filename}")
+        return []
+    except requests.exceptions.ConnectionError:
+        st.error(f"Error: No se pudo conectar con el servidor backend de CVs en {BACKEND_CV_URL}. Asegúrate de que está corriendo.")
+        return []
+    except requests.exceptions.Timeout:
+        print(f"El lote de CVs no respondió en {TIMEOUT_LOTE_CV[1]:g} s. Se envían los CVs uno a uno.")
+        resultados_lote = None
+
+    # El backend procesa el lote en paralelo: cada línea es un resultado (o un error) de un CV
+    if resultados_lote is not None:
+        recibidos = set()
+        try:
+            for evento in resultados_lote:
+                respuesta_json = evento.get("resultado", {})
+                if 'error' in respuesta_json:
+                    print(f"Error al procesar {respuesta_json.get('nombre_archivo_cv')}: {respuesta_json.get('error_message', respuesta_json['error'])}")
+                resultados.append(respuesta_json)
+                recibidos.add(respuesta_json.get("nombre_archivo_cv"))
+                if al_recibir_resultado:
+                    al_recibir_resultado(resultados, evento)
+        except (json.JSONDecodeError, requests.exceptions.RequestException) as e:
+            st.warning(f"Se interrumpió la respuesta del lote de CVs ({e}). Los CVs que faltan se envían uno a uno.")
+        # Solo quedan los que no llegaron por el lote (si la respuesta se cortó)
+        nombres_cv = [nombre_cv for nombre_cv in nombres_cv if nombre_cv not in recibidos]
+
+    # Backends sin /procesar_lote/eventos, lotes rechazados o cortados: un POST por CV
     for nombre_cv in nombres_cv:
         response = enviar_cv_y_profesion(
             nombre_cv, profesion,
@@ -490,10 +642,13 @@ def procesar_cvs_masivamente(
             error_text = response.text if response else 'Sin respuesta o error de conexión'
             st.error(f"Error al procesar {nombre_cv}. Código de estado: {status_code}. Mensaje: {error_text[:200]}...")
             resultados.append({"error": f"Error HTTP {status_code}", "nombre_cv": nombre_cv, "error_message": error_text})
+        if al_recibir_resultado:
+            al_recibir_resultado(resultados, {"completados": len(resultados), "total": total_cv})
 
     if resultados:
         st.info("Guardando resultados en el historial...")
-        success = guardar_resultados_en_historial(profesion, resultados)
+        configuracion = {k: v for k, v in data.items() if k != "puesto"}
+        success = guardar_resultados_en_historial(profesion, resultados, configuracion)
         if success:
             st.success("Historial de procesamiento guardado.")
             # Invalida la caché del historial para que se cargue la nueva ejecución
@@ -503,71 +658,136 @@ def procesar_cvs_masivamente(
 
     return resultados
 
-def mostrar_respuesta_servidor_masivo(resultados):
+def recalcular_puntuaciones(resultados, pesos, umbral=UMBRAL_APTO):
     """
-    Muestra la respuesta del servidor para el procesamiento masivo en un AgGrid.
+    Recalcula en local la puntuación, la aptitud y los porcentajes de un lote ya
+    analizado con otros pesos, a partir de las subpuntuaciones (0-10) de cada
+    criterio, y devuelve los resultados ordenados por puntuación. No llama al backend.
+    """
+    columnas = [f"subpuntuacion_{criterio}" for criterio in CRITERIOS_EVALUACION]
+    df = pd.DataFrame([{col: res.get(col) for col in columnas} for res in resultados], columns=columnas, dtype=float)
+    # Los errores y los resultados sin subpuntuaciones (p. ej. prefiltrados) se quedan como están
+    validos = df.notna().all(axis=1) & pd.Series(['error' not in res for res in resultados], dtype=bool)
+
+    vector_pesos = pd.Series([float(pesos.get(f"peso_{criterio}", 0) or 0) for criterio in CRITERIOS_EVALUACION], index=columnas)
+    if vector_pesos.sum() <= 0:
+        vector_pesos[:] = 1.0
+    ponderadas = df[validos].clip(0, 10).mul(vector_pesos / vector_pesos.sum(), axis=1)
+    puntuaciones = ponderadas.sum(axis=1)
+    contribuciones = ponderadas.div(puntuaciones.where(puntuaciones > 0), axis=0).mul(100).fillna(0.0)
+
+    nuevos = []
+    for i, res in enumerate(resultados):
+        if not validos.iloc[i]:
+            nuevos.append(res)
+            continue
+        res = dict(res)
+        res["puntuacionPonderada"] = round(float(puntuaciones.loc[i]), 2)
+        res["puntuacionPuesto"] = int(round(float(puntuaciones.loc[i])))
+        res["apto"] = bool(puntuaciones.loc[i] >= umbral) and res.get("cumpleFiltros") is not False
+        for criterio, col in zip(CRITERIOS_EVALUACION, columnas):
+            res[f"porcentaje_{criterio}"] = round(float(contribuciones.loc[i, col]), 1)
+        nuevos.append(res)
+
+    # Mejor puntuación primero; los errores, al final
+    return sorted(nuevos, key=lambda res: -1 if 'error' in res else res.get("puntuacionPonderada", res.get("puntuacionPuesto", 0)), reverse=True)
+
+def construir_tabla_resultados(resultados):
+    """
+    Construye el DataFrame y las opciones de AgGrid para la tabla de resultados.
     La columna 'Detalles' muestra el resumen o las razones de no aptitud directamente,
     calculadas en Python, sin usar JavaScript en el cellRenderer.
     """
+    df_resultados_tabla = []
+    for res in resultados:
+        detalle_texto = "" # Inicializamos la variable para el texto de detalles
+
+        if 'error' not in res:
+            # Lógica para determinar el texto de detalles en Python
+            if res.get('apto', False) is True: # Si es apto
+                detalle_texto = res.get('resumenCandidato', 'Sin resumen disponible.')
+            elif res.get('apto', False) is False: # Si NO es apto
+                detalle_texto = res.get('razonesNoAptitud', 'Sin razones de no aptitud disponibles.')
+            else: # Si el valor de 'apto' no es un booleano claro (caso poco probable)
+                detalle_texto = 'Estado de aptitud no definido.'
+
+            df_resultados_tabla.append({
+                "Nombre Completo": f"{res.get('nombre', 'N/A')} {res.get('apellidos', 'N/A')}",
+                "Apto": "Apto" if res.get('apto', False) else "No apto", # Se muestra como texto "Apto" o "No apto"
+                "Puntuación": res.get('puntuacionPonderada', res.get('puntuacionPuesto', 'N/A')),
+                "Detalles": detalle_texto, # <--- ¡Aquí se asigna el texto directamente!
+                "respuesta_json": res # Guardamos el JSON completo para la sección de detalles interactiva
+            })
+        else:
+            # Manejo de casos con error en la respuesta del backend para un CV específico
+            df_resultados_tabla.append({
+                "Nombre Completo": f"{res.get('nombre_archivo_cv', 'Error de archivo')}",
+                "Apto": "Error",
+                "Puntuación": "N/A",
+                "Detalles": f"Error de procesamiento: {res.get('error_message', 'Desconocido')}",
+                "respuesta_json": res # Guardamos el JSON de error completo
+            })
+
+    # Creamos el DataFrame de Pandas a partir de la lista de diccionarios
+    df_resultados = pd.DataFrame(df_resultados_tabla)
+
+    # Configurador de opciones para AgGrid
+    gb = GridOptionsBuilder.from_dataframe(df_resultados)
+    
+    # Ocultamos la columna 'respuesta_json'. Aunque no se muestra, es crucial
+    # que exista en el DataFrame para que la sección de detalles pueda acceder
+    # a toda la información original del backend.
+    gb.configure_column("respuesta_json", hide=True)
+
+    # Configuramos la columna "Detalles" para que el texto se envuelva y la fila se ajuste
+    # según el contenido. No hay JavaScript aquí.
+    gb.configure_column("Detalles",
+                         header_name="Detalles del Candidato",
+                         wrapText=True, # Permite que el texto se envuelva dentro de la celda
+                         autoHeight=True, # Ajusta la altura de la fila al contenido de la celda
+                         resizable=True, # Permite al usuario redimensionar la columna
+                         flex=2, # Le da el doble de espacio flexible que a otras columnas
+                         minWidth=300 # Ancho mínimo de la columna
+                     )
+    
+    # Habilitamos la selección de una única fila. Cuando el usuario hace clic en una fila,
+    # esa fila se considera "seleccionada" en AgGrid.
+    gb.configure_selection(selection_mode='single', use_checkbox=False)
+    
+    # Construimos las opciones finales de la cuadrícula
+    gridOptions = gb.build()
+    return df_resultados, gridOptions
+
+def mostrar_progreso_masivo(contenedor, resultados, progreso):
+    """
+    Redibuja la tabla de resultados parciales mientras el lote sigue en curso,
+    con el número de CVs completados, los que quedan en cola y el ritmo actual.
+    """
+    completados = progreso.get("completados", len(resultados))
+    total = progreso.get("total", completados) or 1
+    transcurrido = progreso.get("tiempo_transcurrido", 0.0)
+    ritmo = (completados / transcurrido * 60) if transcurrido else 0.0
+    df_resultados, gridOptions = construir_tabla_resultados(resultados)
+    with contenedor.container():
+        st.progress(completados / total, text=f"{completados}/{total} CVs procesados · {progreso.get('en_cola', 0)} en cola · {transcurrido:.1f} s · {ritmo:.1f} CVs/min")
+        AgGrid(
+            df_resultados,
+            gridOptions=gridOptions,
+            update_mode=GridUpdateMode.NO_UPDATE, # Tabla de solo lectura mientras llegan resultados
+            fit_columns_on_grid_load=True,
+            allow_unsafe_jscode=False,
+            enable_enterprise_modules=False,
+            height=350,
+            width='100%',
+            key=f"grid_progreso_masivo_{completados}" # Clave distinta en cada redibujado
+        )
+
+def mostrar_respuesta_servidor_masivo(resultados):
+    """
+    Muestra la respuesta del servidor para el procesamiento masivo en un AgGrid.
+    """
     if resultados:
-        df_resultados_tabla = []
-        for res in resultados:
-            detalle_texto = "" # Inicializamos la variable para el texto de detalles
-
-            if 'error' not in res:
-                # Lógica para determinar el texto de detalles en Python
-                if res.get('apto', False) is True: # Si es apto
-                    detalle_texto = res.get('resumenCandidato', 'Sin resumen disponible.')
-                elif res.get('apto', False) is False: # Si NO es apto
-                    detalle_texto = res.get('razonesNoAptitud', 'Sin razones de no aptitud disponibles.')
-                else: # Si el valor de 'apto' no es un booleano claro (caso poco probable)
-                    detalle_texto = 'Estado de aptitud no definido.'
-
-                df_resultados_tabla.append({
-                    "Nombre Completo": f"{res.get('nombre', 'N/A')} {res.get('apellidos', 'N/A')}",
-                    "Apto": "Apto" if res.get('apto', False) else "No apto", # Se muestra como texto "Apto" o "No apto"
-                    "Puntuación": res.get('puntuacionPuesto', 'N/A'),
-                    "Detalles": detalle_texto, # <--- ¡Aquí se asigna el texto directamente!
-                    "respuesta_json": res # Guardamos el JSON completo para la sección de detalles interactiva
-                })
-            else:
-                # Manejo de casos con error en la respuesta del backend para un CV específico
-                df_resultados_tabla.append({
-                    "Nombre Completo": f"{res.get('nombre_archivo_cv', 'Error de archivo')}",
-                    "Apto": "Error",
-                    "Puntuación": "N/A",
-                    "Detalles": f"Error de procesamiento: {res.get('error_message', 'Desconocido')}",
-                    "respuesta_json": res # Guardamos el JSON de error completo
-                })
-
-        # Creamos el DataFrame de Pandas a partir de la lista de diccionarios
-        df_resultados = pd.DataFrame(df_resultados_tabla)
-
-        # Configurador de opciones para AgGrid
-        gb = GridOptionsBuilder.from_dataframe(df_resultados)
-        
-        # Ocultamos la columna 'respuesta_json'. Aunque no se muestra, es crucial
-        # que exista en el DataFrame para que la sección de detalles pueda acceder
-        # a toda la información original del backend.
-        gb.configure_column("respuesta_json", hide=True)
-
-        # Configuramos la columna "Detalles" para que el texto se envuelva y la fila se ajuste
-        # según el contenido. No hay JavaScript aquí.
-        gb.configure_column("Detalles",
-                             header_name="Detalles del Candidato",
-                             wrapText=True, # Permite que el texto se envuelva dentro de la celda
-                             autoHeight=True, # Ajusta la altura de la fila al contenido de la celda
-                             resizable=True, # Permite al usuario redimensionar la columna
-                             flex=2, # Le da el doble de espacio flexible que a otras columnas
-                             minWidth=300 # Ancho mínimo de la columna
-                         )
-        
-        # Habilitamos la selección de una única fila. Cuando el usuario hace clic en una fila,
-        # esa fila se considera "seleccionada" en AgGrid.
-        gb.configure_selection(selection_mode='single', use_checkbox=False)
-        
-        # Construimos las opciones finales de la cuadrícula
-        gridOptions = gb.build()
+        df_resultados, gridOptions = construir_tabla_resultados(resultados)
 
         st.subheader("Resultados del Procesamiento Masivo")
         
@@ -721,7 +941,10 @@ def tab_procesamiento_masivo():
             st.session_state['selected_row_data'] = None
             st.session_state['ejecucion_seleccionada_historial'] = None # Limpiar historial seleccionado también
 
-            with st.spinner(f"Procesando {len(nombres_cv)} CVs para el puesto '{profesion_a_usar}' con pesos personalizados... Esto puede tomar un tiempo."):
+            # Los resultados se van añadiendo a esta tabla según el backend termina cada CV
+            st.write(f"Procesando {len(nombres_cv)} CVs para el puesto '{profesion_a_usar}' con pesos personalizados...")
+            contenedor_progreso = st.empty()
+            with st.spinner("Esperando los primeros resultados..."):
                 # Llama a la función de procesamiento masivo pasando todos los parámetros necesarios
                 resultados = procesar_cvs_masivamente(
                     nombres_cv,
@@ -736,13 +959,23 @@ def tab_procesamiento_masivo():
                     peso_educacion=st.session_state['peso_educacion'],
                     peso_habilidades=st.session_state['peso_habilidades'],
                     peso_idiomas=st.session_state['peso_idiomas'],
-                    peso_otros=st.session_state['peso_otros']
+                    peso_otros=st.session_state['peso_otros'],
+                    al_recibir_resultado=lambda parciales, progreso: mostrar_progreso_masivo(contenedor_progreso, parciales, progreso)
                 )
+            # La tabla definitiva (con selección de filas) sustituye a la de progreso
+            contenedor_progreso.empty()
             # Guarda los resultados obtenidos en el estado de sesión para mostrarlos
             st.session_state['resultados_procesamiento_masivo'] = resultados
 
     # Mostrar los resultados después de que el procesamiento haya terminado y estén en session_state
     if 'resultados_procesamiento_masivo' in st.session_state and st.session_state['resultados_procesamiento_masivo']:
+        # Reordenar el lote ya analizado con los pesos actuales, sin volver a llamar al modelo
+        if st.button("Recalcular con los pesos actuales", key="button_recalcular_pesos_main", help="Aplica los pesos a las subpuntuaciones ya obtenidas. No consume llamadas a la API."):
+            if suma_actual != 100:
+                st.error("La suma de los pesos de evaluación debe ser exactamente 100% para recalcular.")
+            else:
+                pesos_actuales = {f"peso_{criterio}": st.session_state[f"peso_{criterio}"] for criterio in CRITERIOS_EVALUACION}
+                st.session_state['resultados_procesamiento_masivo'] = recalcular_puntuaciones(st.session_state['resultados_procesamiento_masivo'], pesos_actuales)
         mostrar_respuesta_servidor_masivo(st.session_state['resultados_procesamiento_masivo'])
     # Este elif maneja el caso de que se pulsó el botón pero no hubo resultados válidos
     elif 'button_procesar_masivo_main' in st.session_state and st.session_state.button_procesar_masivo_main and \
@@ -809,6 +1042,12 @@ def tab_procesamiento_masivo():
         st.write(f"- Idiomas: {respuesta_detallada.get('porcentaje_idiomas', 'N/A')}%")
         st.write(f"- Otros: {respuesta_detallada.get('porcentaje_otros', 'N/A')}%")
 
+        # Subpuntuaciones por criterio (sin ponderar), si el backend las devuelve
+        if respuesta_detallada.get('subpuntuacion_experiencia') is not None:
+            st.write("**Subpuntuaciones por Criterio (0-10):**")
+            for criterio in CRITERIOS_EVALUACION:
+                st.write(f"- {criterio.capitalize()}: {respuesta_detallada.get(f'subpuntuacion_{criterio}', 'N/A')}")
+
 
 # --- Contenido de la segunda pestaña (Historial) ---
 def tab_historial():
@@ -816,11 +1055,31 @@ def tab_historial():
     st.title("Historial de Ejecuciones")
     st.write("Selecciona una ejecución del historial para ver el resumen de aptitud.")
 
-    # Obtener el historial del backend
-    historial = obtener_historial_ejecuciones()
+    # Filtros que aplica el backend; las ejecuciones se cargan página a página
+    with st.expander("Filtrar ejecuciones"):
+        col_puesto, col_desde, col_hasta, col_minimo = st.columns(4)
+        puesto_filtro = col_puesto.selectbox("Puesto", ["Todos"] + cargar_profesiones(RUTA_ARCHIVO_PROFESIONES), key="historial_filtro_puesto")
+        fecha_desde = col_desde.date_input("Desde", value=None, key="historial_filtro_desde")
+        fecha_hasta = col_hasta.date_input("Hasta", value=None, key="historial_filtro_hasta")
+        minimo_candidatos = col_minimo.number_input("Mínimo de candidatos", min_value=0, value=0, step=1, key="historial_filtro_minimo")
+    filtros = {
+        "puesto": None if puesto_filtro == "Todos" else puesto_filtro,
+        "desde": fecha_desde.isoformat() if fecha_desde else None,
+        "hasta": fecha_hasta.isoformat() if fecha_hasta else None,
+        "min_candidatos": int(minimo_candidatos) or None,
+    }
+
+    # Al cambiar los filtros se vuelve a la primera página y se limpia la selección
+    if st.session_state.get("historial_filtros") != filtros:
+        st.session_state["historial_filtros"] = filtros
+        st.session_state["historial_paginas"] = 1
+        st.session_state['select_historial_ejecucion_main'] = None
+
+    # Obtener del backend las páginas cargadas hasta ahora
+    historial, siguiente_cursor = cargar_paginas_historial(filtros, st.session_state["historial_paginas"])
 
     if not historial:
-        st.info("No hay ejecuciones en el historial.")
+        st.info("No hay ejecuciones en el historial que cumplan los filtros." if any(filtros.values()) else "No hay ejecuciones en el historial.")
         # Limpiar la selección si no hay historial
         st.session_state['select_historial_ejecucion_main'] = None
 
@@ -846,6 +1105,13 @@ def tab_historial():
             key="select_historial_ejecucion_main" # Usa una clave única para mantener el estado
         )
 
+        # Solo se pide la página siguiente cuando el usuario la necesita
+        if siguiente_cursor:
+            st.caption(f"{len(historial)} ejecuciones cargadas; hay más ejecuciones anteriores.")
+            if st.button("Cargar más ejecuciones", key="historial_cargar_mas"):
+                st.session_state["historial_paginas"] += 1
+                st.rerun()
+
         # Mostrar detalles de la ejecución seleccionada
         if seleccion_indice is not None and 0 <= seleccion_indice < len(historial):
             ejecucion_seleccionada = historial[seleccion_indice]
@@ -865,6 +1131,14 @@ def tab_historial():
                     st.write(f"Fecha y Hora: {ejecucion_seleccionada.get('fecha_hora', 'N/A')}")
                     st.write(f"Total Candidatos Procesados: {ejecucion_seleccionada.get('num_candidatos', 0)}")
 
+                    # Tokens y coste estimado de la ejecución (si el backend los devuelve)
+                    uso = ejecucion_seleccionada.get('uso_modelo')
+                    if uso:
+                        col_tokens, col_coste, col_cache = st.columns(3)
+                        col_tokens.metric("Tokens totales", f"{uso.get('tokens_totales', 0):,}", help=f"Entrada: {uso.get('tokens_entrada', 0):,} · Salida: {uso.get('tokens_salida', 0):,} · Cacheados: {uso.get('tokens_cacheados', 0):,}")
+                        col_coste.metric("Coste estimado", f"{uso.get('coste_estimado', 0.0):.4f} USD")
+                        col_cache.metric("Sin llamada al modelo", uso.get('resultados_cache', 0) + uso.get('resultados_prefiltro', 0), help="Resultados servidos desde la caché o descartados en el prefiltrado")
+
                     # Preparar datos para el gráfico de pastel
                     data_pie = {
                         'Categoría': ['Aptos', 'No Aptos', 'No Procesados'],
@@ -892,6 +1166,21 @@ def tab_historial():
                     else:
                         st.info("No hay datos válidos para mostrar en el gráfico para esta ejecución.")
 
+                    # Distribución de puntuaciones (calculada por el backend al guardar la ejecución)
+                    puntuacion = detalles_ejecucion.get('puntuacion') or {}
+                    histograma = puntuacion.get('histograma')
+                    if histograma and sum(histograma) > 0:
+                        col_min, col_media, col_max = st.columns(3)
+                        col_min.metric("Puntuación mínima", puntuacion.get('min'))
+                        col_media.metric("Puntuación media", puntuacion.get('media'))
+                        col_max.metric("Puntuación máxima", puntuacion.get('max'))
+                        df_histograma = pd.DataFrame({
+                            'Puntuación': [f"{i}-{i + 1}" for i in range(len(histograma))],
+                            'Candidatos': histograma,
+                        })
+                        fig_histograma = px.bar(df_histograma, x='Puntuación', y='Candidatos', title='Distribución de Puntuaciones')
+                        st.plotly_chart(fig_histograma, use_container_width=True)
+
                 # Manejar casos donde obtener_detalles_ejecucion falló o devolvió formato inesperado
                 elif detalles_ejecucion is None:
                     # El error ya se muestra dentro de obtener_detalles_ejecucion